@@ -0,0 +1,232 @@
+# Benchmark jeni, comparing alternative ways to apply injections.
+#
+# Run with `python bench_jeni.py [name ...]`, default is all benchmarks.
+
+from __future__ import print_function
+
+import atexit
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import jeni
+
+
+class BenchInjector(jeni.Injector):
+    pass
+
+
+@BenchInjector.factory('config')
+def config():
+    return {'scale': 2}
+
+
+@BenchInjector.provider('counter')
+def counter():
+    yield [0]
+
+
+@jeni.annotate('config', 'counter')
+def process(config, counter, record):
+    counter[0] += 1
+    return record * config['scale']
+
+
+class SealedBenchInjector(BenchInjector):
+    pass
+
+
+class SlotBenchInjector(BenchInjector):
+    pass
+
+
+SealedBenchInjector.seal(stats=False)
+SlotBenchInjector.seal(stats=False, slots=True)
+
+
+RECORDS = list(range(10000))
+
+
+def bench_apply_loop():
+    injector = BenchInjector()
+    for record in RECORDS:
+        injector.apply(process, record)
+
+
+def bench_apply_loop_sealed():
+    injector = SealedBenchInjector()
+    for record in RECORDS:
+        injector.apply(process, record)
+
+
+def bench_apply_loop_slots():
+    injector = SlotBenchInjector()
+    for record in RECORDS:
+        injector.apply(process, record)
+
+
+def bench_apply_many():
+    injector = BenchInjector()
+    for _ in injector.apply_many(process, RECORDS, star=False):
+        pass
+
+
+def bench_apply_many_chunked():
+    injector = BenchInjector()
+    for _ in injector.apply_many(process, RECORDS, star=False, chunksize=500):
+        pass
+
+
+# Key-value gets against an in-process server, with and without pipelining.
+KV_KEYS = ['key{}'.format(i) for i in range(10)]
+KV_ROUNDS = 200
+
+
+@jeni.annotate(*('kv:' + key for key in KV_KEYS))
+def read_keys(*values):
+    return len(values)
+
+
+kv_injector_classes = []
+
+
+def kv_injector_class():
+    """Injector class of a KV provider, on a server stopped at exit."""
+    if not kv_injector_classes:
+        from test_jeni import FakeRespServer
+        server = FakeRespServer()
+        atexit.register(server.stop)
+        for key in KV_KEYS:
+            server.data[key.encode('ascii')] = b'x' * 100
+
+        class KVBenchInjector(jeni.Injector):
+            pass
+
+        @KVBenchInjector.provider('kv')
+        class Store(jeni.KVProvider):
+            port = server.port
+
+        # Run before stopping the server, as exit functions run in reverse.
+        atexit.register(Store.close_pool)
+        kv_injector_classes.append(KVBenchInjector)
+    return kv_injector_classes[0]
+
+
+def bench_kv_get():
+    injector_class = kv_injector_class()
+    for _ in range(KV_ROUNDS):
+        with injector_class() as injector:
+            for key in KV_KEYS:
+                injector.get('kv:' + key)
+
+
+def bench_kv_pipelined():
+    injector_class = kv_injector_class()
+    for _ in range(KV_ROUNDS):
+        with injector_class() as injector:
+            injector.apply(read_keys)
+
+
+# Startup and lookups of a large table, loaded into a dict or memory-mapped.
+TABLE_SIZE = 200000
+TABLE_LOOKUPS = ['key{}'.format(i) for i in range(0, TABLE_SIZE, 200)]
+table_files = {}
+
+
+def table_file(kind):
+    if not table_files:
+        directory = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, directory)
+        items = dict(('key{}'.format(i), b'value' * 20)
+                     for i in range(TABLE_SIZE))
+        table_files['pickle'] = os.path.join(directory, 'bench.pickle')
+        with open(table_files['pickle'], 'wb') as f:
+            pickle.dump(items, f, pickle.HIGHEST_PROTOCOL)
+        table_files['table'] = os.path.join(directory, 'bench.table')
+        jeni.Table.build(table_files['table'], items)
+    return table_files[kind]
+
+
+def bench_table_dict():
+    with open(table_file('pickle'), 'rb') as f:
+        table = pickle.load(f)
+    for key in TABLE_LOOKUPS:
+        table[key]
+
+
+def bench_table_mmap():
+    table = jeni.Table(table_file('table'))
+    for key in TABLE_LOOKUPS:
+        table[key]
+    table.close()
+
+
+BENCHMARKS = [
+    ('apply_loop', bench_apply_loop),
+    ('apply_loop_sealed', bench_apply_loop_sealed),
+    ('apply_loop_slots', bench_apply_loop_slots),
+    ('apply_many', bench_apply_many),
+    ('apply_many_chunked', bench_apply_many_chunked),
+    ('kv_get', bench_kv_get),
+    ('kv_pipelined', bench_kv_pipelined),
+    ('table_dict', bench_table_dict),
+    ('table_mmap', bench_table_mmap),
+]
+
+
+# Startup cost of registering providers, eagerly or by import path.
+IMPORT_BENCHMARKS = [
+    ('import_eager', (
+        'import asyncio, jeni\n'
+        'jeni.Injector.factory("loop", asyncio.new_event_loop)\n')),
+    ('import_lazy', (
+        'import jeni\n'
+        'jeni.Injector.factory("loop", "asyncio:new_event_loop")\n')),
+]
+
+
+def run(name, fn, number=5):
+    best = min(timeit.repeat(fn, number=1, repeat=number))
+    print('{:<30} {:>10.2f} ms'.format(name, best * 1000))
+
+
+def import_time(script):
+    """Total microseconds of imports by script, per `python -X importtime`."""
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    _, stderr = process.communicate()
+    total = 0
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith('import time:'):
+            self_us = line.split(':', 1)[1].split('|')[0].strip()
+            if self_us.isdigit():
+                total += int(self_us)
+    return total
+
+
+def run_import(name, script, number=5):
+    best = min(import_time(script) for _ in range(number))
+    print('{:<30} {:>10.2f} ms'.format(name, best / 1000.0))
+
+
+def main(argv):
+    names = set(argv[1:])
+    for name, fn in BENCHMARKS:
+        if not names or name in names:
+            run(name, fn)
+    if sys.version_info >= (3, 7):
+        for name, script in IMPORT_BENCHMARKS:
+            if not names or name in names:
+                run_import(name, script)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -9,21 +9,50 @@ __version__ = '0.4.2-dev'
 import abc
 import collections
 import functools
+import importlib
 import inspect
+import itertools
 import re
+import struct
+import threading
+import time
+import timeit
 import warnings
 import sys
+import weakref
 
 import six
 
+try:
+    import contextvars
+except ImportError: # Python < 3.7
+    contextvars = None
+
+try:
+    buffer_slice = buffer # Python 2, zero-copy slice of an mmap; see `Table`.
+except NameError: # Python 3, slice a memoryview instead.
+    buffer_slice = None
+
 
 MAYBE = 'maybe'
 PARTIAL = 'partial'
 PARTIAL_REGARDLESS = 'partial_regardless'
 EAGER_PARTIAL = 'eager_partial'
 EAGER_PARTIAL_REGARDLESS = 'eager_partial_regardless'
+NOTE_WRAPPERS = (
+    MAYBE, PARTIAL, PARTIAL_REGARDLESS, EAGER_PARTIAL,
+    EAGER_PARTIAL_REGARDLESS)
 WRAPPER_ASSIGNMENTS = functools.WRAPPER_ASSIGNMENTS + ('__notes__',)
 
+# Caching policies for provided values, see `Injector.register`.
+ALWAYS = 'always'
+TRANSIENT = 'transient'
+WEAK = 'weak'
+LRU = 'lru'
+CACHE_POLICIES = (ALWAYS, TRANSIENT, WEAK, LRU)
+
+MISSING = object() # sentinel for values not found
+
 
 
 class UnsetError(LookupError):
@@ -40,6 +69,36 @@ class DependencyCycleError(RuntimeError):
         super(DependencyCycleError, self).__init__(*a, **kw)
 
 
+class CloseError(RuntimeError):
+    """One or more providers failed to close, see `errors`."""
+    def __init__(self, *a, **kw):
+        #: List of (finalizer, exception) pairs.
+        self.errors = kw.pop('errors', None)
+        super(CloseError, self).__init__(*a, **kw)
+
+
+class FinalizerTimeoutError(RuntimeError):
+    """Provider did not finish closing within the allotted time."""
+
+
+class PoolTimeoutError(RuntimeError):
+    """No pooled resource became available within the allotted time."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Provider is failing, so its circuit breaker rejected the call."""
+    def __init__(self, *a, **kw):
+        self.note = kw.pop('note', None)
+        super(CircuitOpenError, self).__init__(*a, **kw)
+
+
+class ProviderTimeoutError(RuntimeError):
+    """Provider did not instantiate or get a value within its time budget."""
+    def __init__(self, *a, **kw):
+        self.note = kw.pop('note', None)
+        super(ProviderTimeoutError, self).__init__(*a, **kw)
+
+
 @six.add_metaclass(abc.ABCMeta)
 class Provider(object):
     """Provide a single prepared dependency."""
@@ -75,18 +134,24 @@ class FactoryProvider(Provider):
     """Adapt factory functions to the Provider interface.
 
     `Injector` uses this class to support registering factories.
+
+    With ``retain=False``, the factory is called on every get instead of once
+    on init, leaving caching of the value to the injector's caching policy.
     """
     unset_error = None
 
     @classmethod
-    def bind(cls, fn):
+    def bind(cls, fn, retain=True):
         @annotate(annotate.partial_regardless(fn))
         def init(fn):
-            return cls(fn)
+            return cls(fn, retain=retain)
         return init
 
-    def __init__(self, function):
+    def __init__(self, function, retain=True):
         self.function = function
+        self.retain = retain
+        if not retain:
+            return
         try:
             self.value = function()
         except UnsetError as err:
@@ -95,11 +160,282 @@ class FactoryProvider(Provider):
     def get(self, name=None):
         if name is not None:
             return self.function(name)
+        if not self.retain:
+            return self.function()
         if self.unset_error is not None:
             raise self.unset_error
         return self.value
 
 
+class RefreshingFactoryProvider(FactoryProvider):
+    """Keep the value of a factory, refreshing it in the background.
+
+    `Injector` uses this class to support registering factories with a
+    `ttl`. Once the value is older than `ttl` seconds, `get` keeps returning
+    the stale value while a single background thread calls the factory
+    again. The new value is then swapped in, and the old value is closed if
+    it has a close method. If the factory raises an error other than
+    `UnsetError`, the stale value is kept until the next refresh, and the
+    error is kept in `refresh_error`.
+    """
+
+    clock = staticmethod(time.time)
+
+    @classmethod
+    def bind(cls, fn, ttl=60):
+        @annotate(annotate.partial_regardless(fn))
+        def init(fn):
+            return cls(fn, ttl=ttl)
+        return init
+
+    def __init__(self, function, ttl=60):
+        super(RefreshingFactoryProvider, self).__init__(function)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.thread = None # refresh in progress
+        self.refresh_error = None
+        # Swap value & error together, as one attribute.
+        self.current = (getattr(self, 'value', None), self.unset_error)
+        self.expires = self.clock() + ttl
+
+    def get(self, name=None):
+        if name is not None:
+            return self.function(name)
+        if self.clock() >= self.expires:
+            self.refresh()
+        value, unset_error = self.current
+        if unset_error is not None:
+            raise unset_error
+        return value
+
+    def refresh(self):
+        """Start a background refresh, unless one is already in progress."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run_refresh)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run_refresh(self):
+        """Call factory, then swap in the new value."""
+        try:
+            try:
+                current = (self.function(), None)
+            except UnsetError as err:
+                current = (None, err)
+            except Exception as err:
+                self.refresh_error = err
+                return
+            old_value, _ = self.current
+            self.current = current
+            self.refresh_error = None
+            if old_value is not current[0]:
+                close = getattr(old_value, 'close', None)
+                if callable(close):
+                    close()
+        finally:
+            with self.lock:
+                self.expires = self.clock() + self.ttl
+                self.thread = None
+
+    def wait(self, timeout=None):
+        """Wait for a refresh in progress, if any."""
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def close(self):
+        """Wait for a refresh in progress, which may close the old value."""
+        self.wait()
+
+
+class CircuitBreaker(object):
+    """Fail fast once a provider has failed repeatedly, sharing state.
+
+    Register a provider with a breaker to guard its instantiation and get::
+
+        Injector.factory('rates', fetch_rates,
+                         breaker=CircuitBreaker(failures=5, cooldown=30))
+
+    A breaker is 'closed' until `failures` consecutive calls raise an error
+    (other than `UnsetError`), at which point it opens: calls are rejected
+    with `CircuitOpenError` without calling the provider, for `cooldown`
+    seconds. Then the breaker is 'half_open' and lets a single call through
+    as a probe, still rejecting others, until the probe either closes the
+    breaker or opens it again.
+
+    With `fallback`, the breaker keeps the last value provided without
+    name (shared across injectors) and provides it instead of raising when
+    the provider fails or is rejected. The breaker's `state` and counters
+    of events in `stats` are shared by all injectors of the class.
+    """
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, failures=5, cooldown=30, fallback=False):
+        if failures < 1:
+            raise ValueError('failures must be at least 1')
+        self.failures = failures
+        self.cooldown = cooldown
+        self.fallback = fallback
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failure_count = 0 # consecutive failures
+        self.opened_at = None
+        self.probing = False
+        self.last_good = MISSING
+        #: Counters: 'failures', 'opened', 'rejected', 'probes', 'fallbacks'.
+        self.stats = collections.defaultdict(int)
+
+    def call(self, note, fn, *a, **kw):
+        """Call fn if the breaker allows it, recording success or failure."""
+        probe = self.allow(note)
+        try:
+            result = fn(*a, **kw)
+        except UnsetError:
+            self.success(probe)
+            raise
+        except Exception:
+            self.failure(probe)
+            raise
+        self.success(probe)
+        return result
+
+    def allow(self, note):
+        """Return True if the call is a probe, raise if call is rejected."""
+        with self.lock:
+            if self.state == 'closed':
+                return False
+            if (self.state == 'open' and
+                    self.clock() - self.opened_at >= self.cooldown):
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                self.stats['probes'] += 1
+                return True
+            self.stats['rejected'] += 1
+        msg = 'circuit breaker of {!r} is {}'.format(note, self.state)
+        raise CircuitOpenError(msg, note=note)
+
+    def success(self, probe=False):
+        with self.lock:
+            if probe:
+                self.probing = False
+            self.state = 'closed'
+            self.failure_count = 0
+
+    def failure(self, probe=False):
+        with self.lock:
+            if probe:
+                self.probing = False
+            self.stats['failures'] += 1
+            self.failure_count += 1
+            if probe or (self.state == 'closed' and
+                         self.failure_count >= self.failures):
+                self.state = 'open'
+                self.opened_at = self.clock()
+                self.stats['opened'] += 1
+
+    def snapshot(self):
+        """Copy state and stats into a dict."""
+        with self.lock:
+            snapshot = dict(self.stats)
+            snapshot['state'] = self.state
+            snapshot['failure_count'] = self.failure_count
+        return snapshot
+
+
+class BreakerProvider(Provider):
+    """Guard instantiation and get of a provider with a `CircuitBreaker`.
+
+    `Injector` uses this class to support registering providers with a
+    `breaker`. The guarded provider is instantiated on first get, and again
+    on later gets if instantiation failed. With a timeout, see `get_within`.
+    """
+
+    @classmethod
+    def bind(cls, basenote, provider_factory, breaker):
+        @annotate('injector')
+        def init(injector):
+            return cls(basenote, injector, provider_factory, breaker)
+        # Let `Injector.seal` check the dependencies of the guarded provider.
+        init.guarded_provider = provider_factory
+        return init
+
+    def __init__(self, basenote, injector, provider_factory, breaker):
+        self.basenote = basenote
+        self.injector = injector
+        self.provider_factory = provider_factory
+        self.breaker = breaker
+        self.provider = None
+
+    def get(self, name=None):
+        return self.guard(self.call_provider, name)
+
+    def get_within(self, note, timeout, name=None):
+        """Like `get`, within a budget of timeout seconds.
+
+        Called by `Injector` instead of `get` for providers with a timeout.
+        The guarded provider is instantiated and its get is called each
+        within the budget, such that timeouts count as failures of the
+        breaker. As with `Injector.create_provider_within`, notes are
+        injected on the calling thread, and the worker thread never uses the
+        injector.
+        """
+        return self.guard(self.call_provider_within, name, note, timeout)
+
+    def guard(self, fn, name, *a):
+        """Call fn(name, *a) through the breaker, falling back if enabled."""
+        breaker = self.breaker
+        try:
+            value = breaker.call(self.basenote, fn, name, *a)
+        except UnsetError:
+            raise
+        except Exception as err:
+            record_stats = self.injector.record_stats
+            if record_stats and isinstance(err, CircuitOpenError):
+                self.injector.metrics[(self.basenote, 'breaker_rejected')] += 1
+            if (not breaker.fallback or name is not None or
+                    breaker.last_good is MISSING):
+                raise
+            with breaker.lock:
+                breaker.stats['fallbacks'] += 1
+            if record_stats:
+                self.injector.metrics[
+                    (self.basenote, 'breaker_fallbacks')] += 1
+            return breaker.last_good
+        if breaker.fallback and name is None:
+            breaker.last_good = value
+        return value
+
+    def call_provider(self, name=None):
+        """Get from guarded provider, instantiating it if needed."""
+        if self.provider is None:
+            self.provider = self.injector.create_provider(
+                self.provider_factory)
+        get = self.injector.partial_regardless(self.provider.get)
+        if name is not None:
+            return get(name=name)
+        return get()
+
+    def call_provider_within(self, name, note, timeout):
+        """Implementation of `get_within`, like `call_provider`."""
+        injector = self.injector
+        if self.provider is None:
+            self.provider = injector.create_provider_within(
+                note, timeout, self.provider_factory)
+        get = injector.eager_partial_regardless(self.provider.get)
+        if name is not None:
+            return injector.call_with_timeout(note, timeout, get, name=name)
+        return injector.call_with_timeout(note, timeout, get)
+
+    def close(self):
+        close = getattr(self.provider, 'close', None)
+        if close is not None:
+            close()
+
+
 class GeneratorProvider(Provider):
     """Manage generator lifecycle to implement Provider interface.
 
@@ -156,188 +492,1467 @@ class GeneratorProvider(Provider):
             raise RuntimeError(msg.format(self.function))
 
 
-def see_doc(obj_with_doc):
-    """Copy docstring from existing object to the decorated callable."""
-    def decorator(fn):
-        fn.__doc__ = obj_with_doc.__doc__
-        return fn
-    return decorator
+class PooledGeneratorProvider(GeneratorProvider):
+    """Spread get-by-name across a pool of generators, for use from threads.
 
+    `Injector` uses this class to support registering generators with a
+    `pool` size. Where `GeneratorProvider` sends every name to a single
+    generator, this provider keeps up to `maxsize` generators (started
+    lazily, as needed) and sends each name to a generator which is not
+    currently handling another name, waiting for one if all are busy.
 
-class Annotator(object):
-    """Class intent: serve as a stateless dict of function pointers.
+    Each generator should hold its own resource, e.g. a connection. The value
+    provided without name is the first yield of the first generator.
+    """
 
-    Annotate callables, settings data on callable objects themselves,
-    providing hints for modes like maybe and partial.
+    @classmethod
+    def bind(cls, fn, maxsize=4):
+        @annotate(annotate.partial_regardless(fn))
+        def init(fn):
+            return cls(fn, maxsize=maxsize)
+        return init
 
-    Annotations on callables are data for jeni's injection.
-    Built as a class to embed annotation helpers and support customization.
-    """
+    def __init__(self, function, maxsize=4):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        super(PooledGeneratorProvider, self).__init__(
+            function, support_name=True)
+        self.maxsize = maxsize
+        self.condition = threading.Condition()
+        self.generators = [self.generator] # all open generators
+        self.idle = [self.generator] # generators not handling a name
+        self.starting = 0 # number of generators being started
 
-    def __call__(self, *notes, **keyword_notes):
-        """Annotate a callable with a decorator to provide data for Injectors.
+    def get(self, name=None):
+        """Get initial yield value, or result of send(name) on a generator."""
+        if name is None:
+            return self.init_value
+        generator = self.checkout()
+        try:
+            value = generator.send(name)
+        except StopIteration:
+            self.discard(generator)
+            msg = "generator didn't yield: function {!r}"
+            raise RuntimeError(msg.format(self.function))
+        except Exception:
+            # Error raised out of the generator, which is now finished.
+            self.discard(generator)
+            raise
+        self.checkin(generator)
+        return value
 
-        Intended use::
+    def checkout(self):
+        """Take an idle generator, starting one if the pool has room."""
+        with self.condition:
+            while (not self.idle and
+                   len(self.generators) + self.starting >= self.maxsize):
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.starting += 1
+        # Start generator outside of lock, as it may block on I/O.
+        try:
+            generator = self.function()
+            next(generator)
+        except Exception:
+            with self.condition:
+                self.starting -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.starting -= 1
+            self.generators.append(generator)
+        return generator
+
+    def checkin(self, generator):
+        """Return generator to the pool of idle generators."""
+        with self.condition:
+            self.idle.append(generator)
+            self.condition.notify()
+
+    def discard(self, generator):
+        """Remove a finished generator from the pool."""
+        with self.condition:
+            if generator in self.generators:
+                self.generators.remove(generator)
+            self.condition.notify()
 
-            from jeni import annotate
+    def close(self):
+        """Close all generators."""
+        with self.condition:
+            generators, self.generators, self.idle = self.generators, [], []
+        for generator in generators:
+            generator.close()
+
+
+class ResourcePool(object):
+    """Thread-safe pool of reusable resources, e.g. connections.
+
+    `PooledProvider` uses this class to share resources across injectors.
+    Resources are created on demand, up to `maxsize` at once, by the
+    `create` method of the provider acquiring one. Counters of pool events
+    are in `stats`: 'created', 'destroyed', 'checkouts', 'waits' (checkouts
+    which waited for a resource), 'timeouts', 'expired' (idle too long) and
+    'unhealthy' (failed health check). Idle resources are health checked on
+    checkout once idle for `check_idle` seconds.
+    """
 
-            @annotate('foo', 'bar')
-            def function(foo, bar):
-                return
+    def __init__(self, maxsize=8, idle_timeout=None, timeout=None,
+                 check_idle=0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.condition = threading.Condition()
+        # Idle (resource, time released, provider which released it).
+        self.idle = collections.deque()
+        self.size = 0 # resources created and not yet destroyed
+        self.closed = False
+        self.stats = collections.defaultdict(int)
 
-        An `Injector` would then need to register providers for 'foo' and 'bar'
-        in order to apply this function; an injector with such providers can
-        apply the annotated function without any further information::
+    def acquire(self, provider):
+        """Check out an idle healthy resource, or create one with provider.
 
-            injector.apply(function)
+        Wait up to `timeout` seconds when all resources are checked out,
+        then raise `PoolTimeoutError`.
+        """
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        waited = False
+        while True:
+            with self.condition:
+                if self.closed:
+                    raise RuntimeError('{!r} already closed'.format(self))
+                expired = self.expire()
+                if self.idle:
+                    resource, released, owner = self.idle.pop()
+                elif self.size < self.maxsize:
+                    resource = MISSING
+                    self.size += 1
+                else:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.stats['timeouts'] += 1
+                            msg = 'no resource available within {} seconds'
+                            raise PoolTimeoutError(msg.format(self.timeout))
+                    if not waited:
+                        waited = True
+                        self.stats['waits'] += 1
+                    self.condition.wait(remaining)
+                    continue
+            self.destroy_all(expired)
 
-        To get a partially applied function, to call later::
+            if resource is MISSING:
+                try:
+                    resource = provider.create()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                with self.condition:
+                    self.stats['created'] += 1
+            elif (time.time() - released >= self.check_idle and
+                  not self.healthy(owner, resource)):
+                continue
 
-            fn = injector.partial(function)
-            fn()
+            with self.condition:
+                self.stats['checkouts'] += 1
+            return resource
 
-        Annotation does not alter the callable's default behavior.
-        Call it normally::
+    def release(self, provider, resource, discard=False):
+        """Return a checked out resource to the pool, or destroy it."""
+        with self.condition:
+            if not discard and not self.closed:
+                self.idle.append((resource, time.time(), provider))
+                self.condition.notify()
+                return
+        self.destroy(provider, resource)
 
-            foo, bar = 'foo', 'bar'
-            function(foo, bar)
+    def healthy(self, provider, resource):
+        """Check resource with provider, destroying it if unhealthy."""
+        try:
+            healthy = provider.check(resource)
+        except Exception:
+            healthy = False
+        if not healthy:
+            with self.condition:
+                self.stats['unhealthy'] += 1
+            self.destroy(provider, resource)
+        return healthy
+
+    def expire(self):
+        """Remove idle entries past `idle_timeout`, returning them.
+
+        Call with lock held. Most recently released resources are reused
+        first, so the oldest are at the left of the deque.
+        """
+        expired = []
+        if self.idle_timeout is None:
+            return expired
+        cutoff = time.time() - self.idle_timeout
+        while self.idle and self.idle[0][1] <= cutoff:
+            expired.append(self.idle.popleft())
+            self.stats['expired'] += 1
+        return expired
+
+    def destroy(self, provider, resource):
+        """Destroy resource, making room in the pool."""
+        try:
+            provider.destroy(resource)
+        finally:
+            with self.condition:
+                self.size -= 1
+                self.stats['destroyed'] += 1
+                self.condition.notify()
 
-        On Python 2, use decorators to annotate.
-        On Python 3, use either decorators or function annotations::
+    def destroy_all(self, entries):
+        """Destroy resources of given idle entries."""
+        for resource, _, provider in entries:
+            self.destroy(provider, resource)
 
-            from jeni import annotate
+    def close(self):
+        """Destroy idle resources; resources in use are destroyed on release.
+        """
+        with self.condition:
+            self.closed = True
+            idle, self.idle = list(self.idle), collections.deque()
+        self.destroy_all(idle)
 
-            @annotate
-            def function(foo: 'foo', bar: 'bar'):
-                return
 
-        Note that when using Python function annotations, all injected values
-        are provided as keyword arguments.
+class LazyProvider(object):
+    """Stand in for a provider in a registry, until the provider is needed.
 
-        Since function annotations could be interpreted differently by
-        different packages, injectors do not use ``function.__annotations__``
-        directly. Functions opt in by a simple ``@annotate``
-        decoration. Functions with Python annotations which have not been
-        decorated are assumed to not be decorated for injection.
+    `Injector` uses this class to support registering import paths. On first
+    lookup, `load` imports the object at `path` and adapts it to a provider
+    with the `adapt` function given on registration.
+    """
 
-        (For this reason, annotating a callable with a single note where the
-        note is a callable is not supported.)
+    def __init__(self, path, adapt):
+        self.path = path
+        self.adapt = adapt
 
-        Notes which are provided to `annotate` (above 'foo' and 'bar') can be
-        any hashable object (i.e. object able to be used as a key in a dict)
-        and is not limited to strings. If tuples are used as notes, they must
-        be of length 2, and `('maybe', ...)` and `('partial', ...)` are
-        reserved.
-        """
-        if not keyword_notes and len(notes) == 1 and callable(notes[0]):
-            # Here @annotate is being used without arguments.
-            fn = notes[0]
-            if not hasattr(fn, '__annotations__'):
-                msg = '{!r} does not have annotations'
-                raise AttributeError(msg.format(fn))
-            self.set_annotations(fn, **fn.__annotations__)
-            return fn
-        def decorator(__fn):
-            self.set_annotations(__fn, *notes, **keyword_notes)
-            return __fn
-        return decorator
+    def load(self):
+        """Import and adapt provider."""
+        return self.adapt(import_string(self.path))
 
-    # When getting or setting annotations, check callable for __func__. If
-    # found, the callable is a method, and the __func__ as function object
-    # should be used instead.
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.path)
 
-    @classmethod
-    def get_annotations(cls, __fn):
-        """Get the annotations of a given callable."""
-        if hasattr(__fn, '__func__'):
-            __fn = __fn.__func__
-        if hasattr(__fn, '__notes__'):
-            return __fn.__notes__
-        raise AttributeError('{!r} does not have annotations'.format(__fn))
 
-    @classmethod
-    def set_annotations(cls, __fn, *notes, **keyword_notes):
-        """Set the annotations on the given callable."""
-        if hasattr(__fn, '__func__'):
-            __fn = __fn.__func__
-        if hasattr(__fn, '__notes__'):
-            msg = 'callable already has notes: {!r}'
-            raise AttributeError(msg.format(__fn))
-        __fn.__notes__ = (notes, keyword_notes)
+def import_string(path):
+    """Import object by path, either 'package.module:attr' or dotted.
 
-    @classmethod
-    def has_annotations(cls, __fn):
-        """True if callable is annotated, else False."""
-        try:
-            cls.get_annotations(__fn)
-        except AttributeError:
-            return False
-        return True
+    Attributes after the colon can be dotted, e.g. 'module:Class.method'.
+    Without a colon, the last dotted name is the attribute of the module.
+    """
+    if ':' in path:
+        module_name, attrs = path.split(':', 1)
+    else:
+        module_name, _, attrs = path.rpartition('.')
+    if not module_name or not attrs:
+        raise ValueError('not an import path: {!r}'.format(path))
+    obj = importlib.import_module(module_name)
+    for attr in attrs.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class LRUValues(object):
+    """Least-recently-used store of values, bounded by count and/or bytes.
+
+    `Injector` uses this class for values of providers registered with
+    ``cache='lru'``. Size in bytes is measured with the `sizeof` function.
+    """
 
-    @staticmethod
-    def wraps(__fn, **kw):
-        """Like ``functools.wraps``, with support for annotations."""
-        kw['assigned'] = kw.get('assigned', WRAPPER_ASSIGNMENTS)
-        return functools.wraps(__fn, **kw)
+    def __init__(self, maxcount=None, maxbytes=None, sizeof=sys.getsizeof):
+        self.maxcount = maxcount
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.items = collections.OrderedDict() # key -> (value, size)
+        self.nbytes = 0
 
-    @staticmethod
-    def maybe(note):
-        """Wrap a keyword note to record that its resolution is optional.
+    def __len__(self):
+        return len(self.items)
 
-        Normally all annotations require fulfilled dependencies, but if a
-        keyword argument is annotated as `maybe`, then on apply, an injector
-        does not attempt to pass dependencies which are unset or not provided::
+    def __contains__(self, key):
+        return key in self.items
 
-            from jeni import annotate
+    def get(self, key, default=None):
+        """Get value of key, marking it as most recently used."""
+        try:
+            value, size = self.items.pop(key)
+        except KeyError:
+            return default
+        self.items[key] = (value, size)
+        return value
 
-            @annotate('foo', bar=annotate.maybe('bar'))
-            def foobar(foo, bar=None):
-                return
+    def put(self, key, value):
+        """Store value, returning list of keys evicted to stay in budget.
+
+        A value larger than the whole byte budget is not stored, in which
+        case the returned list includes the given key.
         """
-        return (MAYBE, note)
+        self.discard(key)
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and size > self.maxbytes:
+            return [key]
+        self.items[key] = (value, size)
+        self.nbytes += size
+        evicted = []
+        while ((self.maxcount is not None and
+                len(self.items) > self.maxcount) or
+               (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            evicted_key, (_, evicted_size) = self.items.popitem(last=False)
+            self.nbytes -= evicted_size
+            evicted.append(evicted_key)
+        return evicted
+
+    def discard(self, key):
+        """Remove key if present."""
+        if key in self.items:
+            _, size = self.items.pop(key)
+            self.nbytes -= size
+
+    def clear(self):
+        """Remove all values."""
+        self.items.clear()
+        self.nbytes = 0
+
+
+class TopCounts(object):
+    """Approximate counts of the most frequent keys, in bounded memory.
+
+    Up to `maxsize` keys are counted. Counts are exact until there are more
+    distinct keys than that, at which point the least frequent half of keys
+    is dropped. A key counted after a drop starts from the highest count
+    dropped so far (`floor`), such that counts of frequent keys are never
+    under-estimated, and over-estimated by at most `floor`, as reported by
+    `error`. This is a variant of the Space-Saving algorithm, which prunes
+    in batches so that counting is amortized constant time.
+    """
 
-    @staticmethod
-    def partial(__fn, *a, **kw):
-        """Wrap a note for injection of a partially applied function.
+    __slots__ = ('maxsize', 'counts', 'floor')
 
-        This allows for annotated functions to be injected for composition::
+    def __init__(self, maxsize=1024):
+        if maxsize < 2:
+            raise ValueError('maxsize must be at least 2')
+        self.maxsize = maxsize
+        self.counts = {} # key -> [count, error]
+        self.floor = 0
 
-            from jeni import annotate
+    def __len__(self):
+        return len(self.counts)
 
-            @annotate('foo', bar=annotate.maybe('bar'))
-            def foobar(foo, bar=None):
-                return
+    def __contains__(self, key):
+        return key in self.counts
 
-            @annotate('foo', annotate.partial(foobar))
-            def bazquux(foo, fn):
-                # fn: injector.partial(foobar)
-                return
+    def add(self, key, n=1):
+        """Count key n more times."""
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += n
+            return
+        if len(self.counts) >= self.maxsize:
+            self.prune()
+        self.counts[key] = [self.floor + n, self.floor]
+
+    def prune(self):
+        """Drop the least frequent half of keys."""
+        entries = sorted(self.counts.items(), key=lambda item: item[1][0])
+        for key, (count, _) in entries[:len(entries) - self.maxsize // 2]:
+            del self.counts[key]
+            self.floor = max(self.floor, count)
+
+    def get(self, key, default=0):
+        """Estimated count of key, or default if key is not counted."""
+        entry = self.counts.get(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def error(self, key):
+        """Most by which the count of key could be over-estimated."""
+        entry = self.counts.get(key)
+        if entry is None:
+            return self.floor
+        return entry[1]
+
+    def discard(self, key):
+        """Stop counting key."""
+        self.counts.pop(key, None)
+
+    def most_common(self, n=None):
+        """List of (key, count) pairs, most frequent first."""
+        items = sorted(
+            ((key, entry[0]) for key, entry in self.counts.items()),
+            key=lambda item: item[1], reverse=True)
+        return items if n is None else items[:n]
+
+
+class NoteStats(six.moves.collections_abc.MutableMapping):
+    """Counts of resolved notes, note -> count, as `Injector.stats`.
+
+    Counts of notes without a name are exact. Counts of get-by-name notes,
+    e.g. 'header:<anything>' or a ``(basenote, name)`` tuple, are kept in a
+    `TopCounts` of `maxnames` notes, so that stats of a long-lived injector
+    do not grow without bound.
+    Counts per basenote, including all names, are exact; see `basenotes`.
+
+    Notes which are not counted have a count of 0.
+    """
 
-        Keyword arguments are treated as `maybe` when using partial, in order
-        to allow partial application of only the notes which can be provided,
-        where the caller could then apply arguments known to be unavailable in
-        the injector. Note that with Python 3 function annotations, all
-        annotations are injected as keyword arguments.
+    __slots__ = ('maxnames', 'counts', 'names', 'name_totals')
 
-        Injections on the partial function are lazy and not applied until the
-        injected partial function is called. See `eager_partial` to inject
-        eagerly.
-        """
-        return (PARTIAL, (__fn, a, tuple(kw.items())))
+    def __init__(self, maxnames=1024):
+        self.maxnames = maxnames
+        self.counts = {} # note -> count, for notes without name
 
-    @staticmethod
-    def partial_regardless(__fn, *a, **kw):
-        """Wrap a note for injection of a partially applied function, or don't.
+        # Allocated on first get-by-name.
+        self.names = None # TopCounts of notes
+        self.name_totals = None # basenote -> count of all names
 
-        Use this instead of `partial` when binding a callable that may or may
-        not have annotations.
-        """
-        return (PARTIAL_REGARDLESS, (__fn, a, tuple(kw.items())))
+    @property
+    def basenotes(self):
+        """Exact counts per basenote, basenote -> count including names."""
+        basenotes = dict(self.counts)
+        for basenote, count in (self.name_totals or {}).items():
+            basenotes[basenote] = basenotes.get(basenote, 0) + count
+        return basenotes
 
     @staticmethod
-    def eager_partial(__fn, *a, **kw):
-        """Wrap a note for injection of an eagerly partially applied function.
-
+    def split(note):
+        """Basenote of a get-by-name note, else None."""
+        if isinstance(note, six.string_types):
+            if ':' in note:
+                return note.partition(':')[0]
+            return None
+        if (isinstance(note, tuple) and len(note) == 2 and
+                note[1] is not None and note[0] not in NOTE_WRAPPERS):
+            return note[0]
+        return None
+
+    def add(self, note, n=1):
+        """Count note n more times, e.g. ``stats[note] += n`` but faster."""
+        counts = self.counts
+        if note in counts:
+            counts[note] += n
+            return
+        if isinstance(note, six.string_types):
+            basenote = note.partition(':')[0] if ':' in note else None
+        else:
+            basenote = self.split(note)
+        if basenote is None:
+            counts[note] = n
+            return
+        entry = self.names.counts.get(note) if self.names else None
+        if entry is not None:
+            # Skip `TopCounts.add` for a note which is counted already.
+            entry[0] += n
+            self.name_totals[basenote] += n
+            return
+        if self.names is None:
+            self.names = TopCounts(self.maxnames)
+            self.name_totals = {}
+        self.names.add(note, n)
+        self.name_totals[basenote] = self.name_totals.get(basenote, 0) + n
+
+    def __getitem__(self, note):
+        if self.split(note) is None:
+            return self.counts.get(note, 0)
+        if self.names is None:
+            return 0
+        return self.names.get(note)
+
+    def __setitem__(self, note, count):
+        basenote = self.split(note)
+        if basenote is None:
+            self.counts[note] = count
+            return
+        if self.names is None:
+            self.names = TopCounts(self.maxnames)
+            self.name_totals = {}
+        delta = count - self.names.get(note)
+        self.names.add(note, delta)
+        self.name_totals[basenote] = self.name_totals.get(basenote, 0) + delta
+
+    def __delitem__(self, note):
+        if self.split(note) is None:
+            del self.counts[note]
+            return
+        if note not in self:
+            raise KeyError(note)
+        self[note] = 0
+        self.names.discard(note)
+
+    def __contains__(self, note):
+        if self.split(note) is None:
+            return note in self.counts
+        return self.names is not None and note in self.names
+
+    def __iter__(self):
+        for note in list(self.counts):
+            yield note
+        if self.names is not None:
+            for note in list(self.names.counts):
+                yield note
+
+    def __len__(self):
+        return len(self.counts) + (len(self.names) if self.names else 0)
+
+    def most_common_names(self, n=None, basenote=None):
+        """List of (note, count) of most requested get-by-name notes.
+
+        Filter by `basenote` if given. See `TopCounts` for accuracy.
+        """
+        if self.names is None:
+            return []
+        items = self.names.most_common()
+        if basenote is not None:
+            items = [(note, count) for note, count in items
+                     if self.split(note) == basenote]
+        return items if n is None else items[:n]
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self.items()))
+
+
+#: Timing of a sampled call, see `Sampler`.
+Sample = collections.namedtuple('Sample', 'note phase wall cpu')
+
+
+class Sampler(object):
+    """Time one in `every` calls to `Injector.get` and `Injector.apply`.
+
+    Assign a sampler to an injector class to enable sampling::
+
+        Injector.sampler = Sampler(every=1000)
+
+    Alternatively, sample at most one call per `interval` seconds. A sampled
+    call records a `Sample` of wall and CPU time for each phase:
+
+    * 'get': resolving a note, including all of the phases below.
+    * 'apply': resolving the notes of a callable in `apply`, by callable.
+    * 'instantiate': creating the provider of a basenote.
+    * 'provider_get': calling the `get` method of a provider.
+
+    Every note resolved within a sampled call is also sampled, so that the
+    time of a note can be broken down by its dependencies. Tuple notes (e.g.
+    partially applied functions) are not recorded as a 'get', nor are calls
+    to `apply` made by the injector itself. Only top-level calls are
+    counted, such that one in `every` calls to `apply` is sampled regardless
+    of how many notes it resolves. Samples are kept in a ring buffer of the
+    `size` most recent samples; call `drain` periodically to collect them.
+    Calls which are not sampled cost a counter check. CPU time is time of
+    the current thread where supported.
+    """
+
+    wall_timer = staticmethod(timeit.default_timer)
+    cpu_timer = staticmethod(
+        getattr(time, 'thread_time', None) or
+        getattr(time, 'process_time', None) or
+        time.clock)
+
+    def __init__(self, every=100, interval=None, size=4096):
+        if every < 1:
+            raise ValueError('every must be at least 1')
+        self.every = every
+        self.interval = interval
+        self.counter = itertools.count()
+        self.next_time = 0
+        # Appends & pops of a deque are atomic, no lock is needed.
+        self.samples = collections.deque(maxlen=size)
+        self.local = threading.local()
+
+    def active(self):
+        """True if a sampled call is in progress on the current thread."""
+        return getattr(self.local, 'depth', 0) > 0
+
+    def tick(self):
+        """Count a call, returning True if the call is to be sampled.
+
+        Calls nested in a call to `measure` are sampled, and calls nested in
+        a call to `skip` are not; neither are counted.
+        """
+        depth = getattr(self.local, 'depth', 0)
+        if depth:
+            return depth > 0
+        if self.interval is None:
+            return next(self.counter) % self.every == 0
+        now = time.time()
+        if now < self.next_time:
+            return False
+        self.next_time = now + self.interval
+        return True
+
+    def measure(self, note, phase, fn, *a, **kw):
+        """Call fn, recording a `Sample` of its duration."""
+        self.local.depth = getattr(self.local, 'depth', 0) + 1
+        wall, cpu = self.wall_timer(), self.cpu_timer()
+        try:
+            return fn(*a, **kw)
+        finally:
+            self.samples.append(Sample(
+                note, phase,
+                self.wall_timer() - wall, self.cpu_timer() - cpu))
+            self.local.depth -= 1
+
+    def skip(self, fn, *a, **kw):
+        """Call fn without sampling it, nor counting calls nested in it."""
+        # Depth is negative within calls which are not sampled.
+        self.local.depth = getattr(self.local, 'depth', 0) - 1
+        try:
+            return fn(*a, **kw)
+        finally:
+            self.local.depth += 1
+
+    def drain(self):
+        """Remove and return all samples recorded so far, oldest first."""
+        samples = []
+        while True:
+            try:
+                samples.append(self.samples.popleft())
+            except IndexError:
+                return samples
+
+
+class Flight(object):
+    """Call in flight, see `Injector.coalesce`."""
+    __slots__ = ('event', 'result', 'exc_info', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.waiters = 0 # threads waiting for the call, under flight_lock
+
+
+class StatsAggregator(object):
+    """Statistics summed across injectors, e.g. one injector per request.
+
+    Injectors flush into the aggregator when closed, see
+    `Injector.flush_stats`. Totals are kept per basenote and metric, and can
+    be exported with `snapshot`, `to_json` and `to_prometheus`.
+    """
+
+    #: Metric -> (Prometheus type, help text).
+    metric_info = collections.OrderedDict([
+        ('gets', ('counter', 'Notes resolved by get.')),
+        ('instantiations', ('counter', 'Providers instantiated.')),
+        ('unset', ('counter', 'Providers which raised UnsetError.')),
+        ('lookup_errors', ('counter', 'Notes without a registered provider.')),
+        ('provider_calls', ('counter', 'Calls into providers, timed.')),
+        ('provider_seconds', ('counter', 'Time spent in providers.')),
+        ('timeouts', ('counter', 'Providers which exceeded time budget.')),
+        ('breaker_rejected', ('counter', 'Calls rejected by open breaker.')),
+        ('breaker_fallbacks', ('counter', 'Last good values provided.')),
+        ('coalesced', ('counter', 'Calls which shared a call in flight.')),
+        ('provider_bytes', ('counter', 'Bytes retained by providers.')),
+        ('value_bytes', ('counter', 'Bytes retained by provided values.')),
+        ('values_measured', ('counter', 'Values measured for memory.')),
+    ])
+
+    def __init__(self, prefix='jeni'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.totals = collections.defaultdict(int) # (basenote, metric) -> n
+        self.flushes = 0
+
+    def add(self, totals):
+        """Add a batch of (basenote, metric) -> number totals."""
+        with self.lock:
+            for key, value in totals.items():
+                self.totals[key] += value
+            self.flushes += 1
+
+    def reset(self):
+        """Clear all totals."""
+        with self.lock:
+            self.totals.clear()
+            self.flushes = 0
+
+    @staticmethod
+    def note_label(basenote):
+        """String label of basenote, which could be any Python object."""
+        if isinstance(basenote, six.string_types):
+            return basenote
+        return repr(basenote)
+
+    def snapshot(self):
+        """Copy totals into a dict which can be serialized as JSON."""
+        with self.lock:
+            totals = list(self.totals.items())
+            flushes = self.flushes
+        notes = {}
+        for (basenote, metric), value in totals:
+            label = self.note_label(basenote)
+            notes.setdefault(label, {})
+            notes[label][metric] = notes[label].get(metric, 0) + value
+        return {'injectors': flushes, 'notes': notes}
+
+    def to_json(self, **kw):
+        """Serialize `snapshot` as JSON, keyword arguments to `json.dumps`."""
+        import json
+        kw.setdefault('sort_keys', True)
+        return json.dumps(self.snapshot(), **kw)
+
+    def to_prometheus(self):
+        """Format totals in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        name = '{}_injectors_total'.format(self.prefix)
+        lines.append('# HELP {} Injectors flushed.'.format(name))
+        lines.append('# TYPE {} counter'.format(name))
+        lines.append('{} {}'.format(name, snapshot['injectors']))
+        for metric, (kind, text) in self.metric_info.items():
+            samples = sorted(
+                (label, values[metric])
+                for label, values in snapshot['notes'].items()
+                if metric in values)
+            if not samples:
+                continue
+            name = '{}_{}_total'.format(self.prefix, metric)
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for label, value in samples:
+                lines.append('{}{{note="{}"}} {}'.format(
+                    name, self.escape_label(label), value))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def escape_label(label):
+        """Escape label value for the Prometheus text format."""
+        return (label.replace('\\', '\\\\')
+                     .replace('"', '\\"')
+                     .replace('\n', '\\n'))
+
+
+class SlotValues(six.moves.collections_abc.MutableMapping):
+    """Mapping of basenote -> object, stored in a list by slot of basenote.
+
+    `Injector` uses this class for `values` and `instances` of classes sealed
+    with ``slots=True``. Notes without a slot in `slot_table` are kept in a
+    dict, so that the mapping accepts any note.
+    """
+
+    __slots__ = ('slot_table', 'slots', 'overflow')
+
+    def __init__(self, slot_table):
+        self.slot_table = slot_table
+        self.slots = [MISSING] * len(slot_table)
+        self.overflow = {}
+
+    def __getitem__(self, key):
+        slot = self.slot_table.get(key)
+        if slot is None:
+            return self.overflow[key]
+        value = self.slots[slot]
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        slot = self.slot_table.get(key)
+        if slot is None:
+            self.overflow[key] = value
+        else:
+            self.slots[slot] = value
+
+    def __delitem__(self, key):
+        slot = self.slot_table.get(key)
+        if slot is None:
+            del self.overflow[key]
+        elif self.slots[slot] is MISSING:
+            raise KeyError(key)
+        else:
+            self.slots[slot] = MISSING
+
+    def __contains__(self, key):
+        slot = self.slot_table.get(key)
+        if slot is None:
+            return key in self.overflow
+        return self.slots[slot] is not MISSING
+
+    def __iter__(self):
+        for key, slot in self.slot_table.items():
+            if self.slots[slot] is not MISSING:
+                yield key
+        for key in list(self.overflow):
+            yield key
+
+    def __len__(self):
+        return (len(self.overflow) +
+                sum(1 for value in self.slots if value is not MISSING))
+
+    def clear(self):
+        self.slots[:] = [MISSING] * len(self.slots)
+        self.overflow.clear()
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, dict(self.items()))
+
+
+class PooledProvider(Provider):
+    """Check out a resource per injector from a pool shared by the class.
+
+    Implement `create` in a subclass, and optionally `destroy` and `check`::
+
+        @Injector.provider('db')
+        class DatabaseProvider(PooledProvider):
+            maxsize = 10
+
+            def create(self):
+                return sqlite3.connect(DATABASE, check_same_thread=False)
+
+    The first get on a provider instance checks out a resource from the pool
+    of its class, and `close` returns it to the pool, such that injectors
+    created per request reuse resources instead of opening new ones. Override
+    `get` to provide something other than the resource itself, calling
+    `checkout` to get the resource. See `ResourcePool` for pool statistics.
+
+    Resources are shared across threads, so must be safe to use from a
+    thread other than the one which created them.
+    """
+
+    #: Maximum number of resources, in use or idle.
+    maxsize = 8
+
+    #: Seconds an idle resource is kept before it is destroyed, or None.
+    idle_timeout = None
+
+    #: Seconds to wait for a resource when all are in use, or None.
+    checkout_timeout = None
+
+    #: Seconds a resource is idle before it is checked on checkout.
+    check_idle = 0
+
+    pool_lock = threading.Lock()
+
+    resource = MISSING # checked out resource
+    resource_source = None # pool the resource is checked out from
+
+    @classmethod
+    def pool(cls):
+        """Get the pool of this class, creating it if needed."""
+        pool = vars(cls).get('resource_pool')
+        if pool is None:
+            with cls.pool_lock:
+                pool = vars(cls).get('resource_pool')
+                if pool is None:
+                    pool = cls.resource_pool = ResourcePool(
+                        cls.maxsize, cls.idle_timeout, cls.checkout_timeout,
+                        cls.check_idle)
+        return pool
+
+    @classmethod
+    def close_pool(cls):
+        """Destroy pooled resources, e.g. on application shutdown."""
+        with cls.pool_lock:
+            pool = vars(cls).get('resource_pool')
+            if pool is not None:
+                del cls.resource_pool
+        if pool is not None:
+            pool.close()
+
+    @abc.abstractmethod
+    def create(self):
+        """Implement in subclass, returning a new resource."""
+
+    def destroy(self, resource):
+        """Destroy a resource. By default, call its close method, if any."""
+        if hasattr(resource, 'close'):
+            resource.close()
+
+    def check(self, resource):
+        """Return True if an idle resource is usable, before checkout.
+
+        Called only for resources idle for `check_idle` seconds or more. By
+        default, assume that it is. Errors count as unhealthy.
+        """
+        return True
+
+    def checkout(self):
+        """Get resource of this provider, checking one out on first call."""
+        if self.resource is MISSING:
+            pool = self.pool()
+            self.resource = pool.acquire(self)
+            self.resource_source = pool
+        return self.resource
+
+    def get(self, name=None):
+        """Provide the checked out resource."""
+        return self.checkout()
+
+    def close(self, discard=False):
+        """Return the resource to the pool, or destroy it if discard."""
+        if self.resource is not MISSING:
+            resource, self.resource = self.resource, MISSING
+            self.resource_source.release(self, resource, discard=discard)
+
+
+class RespError(RuntimeError):
+    """Error reply from a server speaking RESP, the Redis protocol."""
+
+
+class RespConnection(object):
+    """Client connection to a server speaking RESP, the Redis protocol.
+
+    `execute` sends one command and reads its reply. `pipeline` sends many
+    commands at once, then reads all replies, in one network round trip.
+    Bulk replies are bytes, and error replies are `RespError`.
+    """
+
+    def __init__(self, host='localhost', port=6379, timeout=None):
+        import socket
+        self.sock = socket.create_connection((host, port), timeout)
+        # Commands are written whole; do not wait to coalesce small writes.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile('rb')
+        self.round_trips = 0
+
+    @staticmethod
+    def encode(*args):
+        """Encode command as a RESP array of bulk strings."""
+        parts = ['*{}\r\n'.format(len(args)).encode('ascii')]
+        for arg in args:
+            if isinstance(arg, six.text_type):
+                arg = arg.encode('utf-8')
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode('ascii')
+            parts.append('${}\r\n'.format(len(arg)).encode('ascii'))
+            parts.append(arg)
+            parts.append(b'\r\n')
+        return b''.join(parts)
+
+    def execute(self, *args):
+        """Send command, returning its reply, raising `RespError` on error."""
+        reply, = self.pipeline([args])
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def pipeline(self, commands):
+        """Send commands in one write, returning list of replies in order.
+
+        Error replies are returned as `RespError` instances, not raised.
+        """
+        self.sock.sendall(b''.join(self.encode(*args) for args in commands))
+        self.round_trips += 1
+        return [self.read_reply() for _ in commands]
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise IOError('connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            return RespError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self.reader.read(size + 2)
+            if len(data) != size + 2:
+                raise IOError('connection closed by server')
+            return data[:-2]
+        if kind == b'*':
+            size = int(rest)
+            if size < 0:
+                return None
+            return [self.read_reply() for _ in range(size)]
+        raise IOError('invalid RESP reply: {!r}'.format(line))
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class KVProvider(PooledProvider):
+    """Provide values by key from a server speaking RESP, e.g. Redis::
+
+        @Injector.provider('kv')
+        class SessionStore(KVProvider):
+            host = 'cache.internal'
+
+    A note of ``'kv:session'`` gets the value of key ``session``, as bytes,
+    and raises `UnsetError` if the key is not set. The basenote ``'kv'``
+    provides the `RespConnection` itself. Connections are pooled per class,
+    see `PooledProvider`.
+
+    When a function is applied with several get-by-name notes of this
+    provider, `Injector.prefetch` gets all of their keys in one pipelined
+    round trip. Values are kept per provider instance, i.e. per injector.
+    With `cache_ttl`, values are also kept in a cache shared by the class,
+    such that other injectors skip the server for recently read keys.
+    """
+
+    host = 'localhost'
+    port = 6379
+
+    #: Seconds to wait on the server before a socket error, or None.
+    socket_timeout = None
+
+    #: Connections idle for less than this are reused without a PING, such
+    #: that a request makes a single round trip.
+    check_idle = 10
+
+    #: Seconds values are kept in the shared client cache, or None.
+    cache_ttl = None
+
+    #: Maximum number of keys in the shared client cache.
+    cache_maxcount = 1024
+
+    cache_lock = threading.Lock()
+
+    clock = staticmethod(timeit.default_timer)
+
+    def __init__(self):
+        self.values = {} # key -> value, or None if not set
+
+    @classmethod
+    def client_cache(cls):
+        """Get the shared cache of this class, creating it if needed."""
+        cache = vars(cls).get('value_cache')
+        if cache is None:
+            with cls.cache_lock:
+                cache = vars(cls).get('value_cache')
+                if cache is None:
+                    cache = cls.value_cache = LRUValues(cls.cache_maxcount)
+        return cache
+
+    def create(self):
+        return RespConnection(self.host, self.port, self.socket_timeout)
+
+    def check(self, resource):
+        return resource.execute('PING') == 'PONG'
+
+    def get(self, name=None):
+        """Provide value of key name, or the connection if no name."""
+        if name is None:
+            return self.checkout()
+        if name not in self.values:
+            self.prefetch([name])
+        value = self.values[name]
+        if value is None:
+            raise UnsetError()
+        return value
+
+    def prefetch(self, names):
+        """Get values of keys not yet known, in one pipelined round trip."""
+        names = [name for name in names if name not in self.values]
+        if self.cache_ttl is not None and names:
+            cache, now = self.client_cache(), self.clock()
+            with self.cache_lock:
+                for name in names:
+                    value, expires = cache.get(name, (None, None))
+                    if expires is not None and now < expires:
+                        self.values[name] = value
+            names = [name for name in names if name not in self.values]
+        if not names:
+            return
+        try:
+            replies = self.checkout().pipeline(
+                [('GET', name) for name in names])
+        except (IOError, OSError):
+            # Connection is not reusable after a partial exchange.
+            self.close(discard=True)
+            raise
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        self.values.update(zip(names, replies))
+        if self.cache_ttl is not None:
+            cache = self.client_cache()
+            expires = self.clock() + self.cache_ttl
+            with self.cache_lock:
+                for name, value in zip(names, replies):
+                    cache.put(name, (value, expires))
+
+    @classmethod
+    def forget(cls, *names):
+        """Remove names from the shared cache, e.g. after writing them."""
+        cache = cls.client_cache()
+        with cls.cache_lock:
+            for name in names:
+                cache.discard(name)
+
+
+class Table(six.moves.collections_abc.Mapping):
+    """Read-only mapping of key -> bytes, memory-mapped from a table file.
+
+    Build a file with `Table.build`, then open it in any number of processes;
+    the operating system shares its pages among them. Lookup is a binary
+    search of an on-disk index, and values are `memoryview` slices of the
+    mapping (`buffer` objects on Python 2), such that nothing is copied until
+    the caller decodes a value. Keys are text, stored as UTF-8.
+
+    File format: header of magic and count, then count index records of
+    (key offset, key length, value offset, value length) sorted by key,
+    then key and value bytes. Integers are unsigned 64-bit little-endian.
+    """
+
+    magic = b'JENITBL1'
+    header = struct.Struct('<8sQ')
+    record = struct.Struct('<QQQQ')
+
+    def __init__(self, path):
+        import mmap
+        with open(path, 'rb') as f:
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = self.header.unpack_from(self.mapping, 0)
+        if magic != self.magic:
+            self.mapping.close()
+            raise ValueError('not a table file: {!r}'.format(path))
+        if buffer_slice is None:
+            self.view = memoryview(self.mapping)
+        else: # Python 2, mmap has no memoryview support.
+            self.view = None
+
+    @classmethod
+    def build(cls, path, items):
+        """Write a table file of items, a mapping or (key, value) pairs.
+
+        Values must be bytes-like, else raise `TypeError`. Raise `ValueError`
+        if a key is given more than once.
+        """
+        if hasattr(items, 'items'):
+            items = items.items()
+        entries = sorted(
+            (cls.encode_key(key), cls.encode_value(value))
+            for key, value in items)
+        for (key, _), (next_key, _) in zip(entries, entries[1:]):
+            if key == next_key:
+                raise ValueError('duplicate key: {!r}'.format(key))
+        offset = cls.header.size + cls.record.size * len(entries)
+        with open(path, 'wb') as f:
+            f.write(cls.header.pack(cls.magic, len(entries)))
+            for key, value in entries:
+                f.write(cls.record.pack(
+                    offset, len(key), offset + len(key), len(value)))
+                offset += len(key) + len(value)
+            for key, value in entries:
+                f.write(key)
+                f.write(value)
+
+    @staticmethod
+    def encode_key(key):
+        if isinstance(key, six.text_type):
+            return key.encode('utf-8')
+        return key
+
+    @staticmethod
+    def encode_value(value):
+        if isinstance(value, bytes):
+            return value
+        try:
+            return memoryview(value).tobytes()
+        except TypeError:
+            msg = 'table values must be bytes-like, not {!r}'
+            raise TypeError(msg.format(type(value).__name__))
+
+    def read_record(self, index):
+        return self.record.unpack_from(
+            self.mapping, self.header.size + self.record.size * index)
+
+    def read_key(self, index):
+        key_offset, key_size, _, _ = self.read_record(index)
+        return self.mapping[key_offset:key_offset + key_size]
+
+    def find(self, key):
+        """Get index of key, or -1 if not found."""
+        key = self.encode_key(key)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.read_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.read_key(low) == key:
+            return low
+        return -1
+
+    def __getitem__(self, key):
+        index = self.find(key)
+        if index < 0:
+            raise KeyError(key)
+        _, _, value_offset, value_size = self.read_record(index)
+        if self.view is None:
+            return buffer_slice(self.mapping, value_offset, value_size)
+        return self.view[value_offset:value_offset + value_size]
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.read_key(index).decode('utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Unmap the file. Values got from the table must be released."""
+        if self.view is not None:
+            self.view.release()
+        self.mapping.close()
+
+
+class TableProvider(Provider):
+    """Provide values by key from a memory-mapped `Table` file::
+
+        @Injector.provider('table')
+        class Countries(TableProvider):
+            path = '/srv/data/countries.table'
+
+            def decode(self, value):
+                return json.loads(bytes(value).decode('utf-8'))
+
+    A note of ``'table:FR'`` gets the value of key ``FR``, decoded by
+    `decode`, which by default provides the `memoryview` slice as is, and
+    raises `UnsetError` if the key is not in the table. The basenote
+    ``'table'`` provides the `Table` itself. The file is mapped once per
+    class and process, on first get, and shared by all injectors.
+    """
+
+    #: Path of the table file, see `Table.build`.
+    path = None
+
+    table_lock = threading.Lock()
+
+    @classmethod
+    def table(cls):
+        """Get the table of this class, mapping the file if needed."""
+        table = vars(cls).get('mapped_table')
+        if table is None:
+            with cls.table_lock:
+                table = vars(cls).get('mapped_table')
+                if table is None:
+                    table = cls.mapped_table = Table(cls.path)
+        return table
+
+    @classmethod
+    def close_table(cls):
+        """Unmap the table of this class, e.g. before replacing the file."""
+        with cls.table_lock:
+            table = vars(cls).get('mapped_table')
+            if table is not None:
+                del cls.mapped_table
+        if table is not None:
+            table.close()
+
+    def decode(self, value):
+        """Decode a value, a `memoryview` (`buffer` on Python 2).
+
+        By default, provide it as is.
+        """
+        return value
+
+    def get(self, name=None):
+        """Provide decoded value of key name, or the table if no name."""
+        table = self.table()
+        if name is None:
+            return table
+        try:
+            value = table[name]
+        except KeyError:
+            raise UnsetError()
+        return self.decode(value)
+
+
+def see_doc(obj_with_doc):
+    """Copy docstring from existing object to the decorated callable."""
+    def decorator(fn):
+        fn.__doc__ = obj_with_doc.__doc__
+        return fn
+    return decorator
+
+
+class Annotator(object):
+    """Class intent: serve as a stateless dict of function pointers.
+
+    Annotate callables, settings data on callable objects themselves,
+    providing hints for modes like maybe and partial.
+
+    Annotations on callables are data for jeni's injection.
+    Built as a class to embed annotation helpers and support customization.
+    """
+
+    def __call__(self, *notes, **keyword_notes):
+        """Annotate a callable with a decorator to provide data for Injectors.
+
+        Intended use::
+
+            from jeni import annotate
+
+            @annotate('foo', 'bar')
+            def function(foo, bar):
+                return
+
+        An `Injector` would then need to register providers for 'foo' and 'bar'
+        in order to apply this function; an injector with such providers can
+        apply the annotated function without any further information::
+
+            injector.apply(function)
+
+        To get a partially applied function, to call later::
+
+            fn = injector.partial(function)
+            fn()
+
+        Annotation does not alter the callable's default behavior.
+        Call it normally::
+
+            foo, bar = 'foo', 'bar'
+            function(foo, bar)
+
+        On Python 2, use decorators to annotate.
+        On Python 3, use either decorators or function annotations::
+
+            from jeni import annotate
+
+            @annotate
+            def function(foo: 'foo', bar: 'bar'):
+                return
+
+        Note that when using Python function annotations, all injected values
+        are provided as keyword arguments.
+
+        Since function annotations could be interpreted differently by
+        different packages, injectors do not use ``function.__annotations__``
+        directly. Functions opt in by a simple ``@annotate``
+        decoration. Functions with Python annotations which have not been
+        decorated are assumed to not be decorated for injection.
+
+        (For this reason, annotating a callable with a single note where the
+        note is a callable is not supported.)
+
+        Notes which are provided to `annotate` (above 'foo' and 'bar') can be
+        any hashable object (i.e. object able to be used as a key in a dict)
+        and is not limited to strings. If tuples are used as notes, they must
+        be of length 2, and `('maybe', ...)` and `('partial', ...)` are
+        reserved.
+        """
+        if not keyword_notes and len(notes) == 1 and callable(notes[0]):
+            # Here @annotate is being used without arguments.
+            fn = notes[0]
+            if not hasattr(fn, '__annotations__'):
+                msg = '{!r} does not have annotations'
+                raise AttributeError(msg.format(fn))
+            self.set_annotations(fn, **fn.__annotations__)
+            return fn
+        def decorator(__fn):
+            self.set_annotations(__fn, *notes, **keyword_notes)
+            return __fn
+        return decorator
+
+    # When getting or setting annotations, check callable for __func__. If
+    # found, the callable is a method, and the __func__ as function object
+    # should be used instead.
+
+    @classmethod
+    def get_annotations(cls, __fn):
+        """Get the annotations of a given callable."""
+        if hasattr(__fn, '__func__'):
+            __fn = __fn.__func__
+        if hasattr(__fn, '__notes__'):
+            return __fn.__notes__
+        raise AttributeError('{!r} does not have annotations'.format(__fn))
+
+    @classmethod
+    def set_annotations(cls, __fn, *notes, **keyword_notes):
+        """Set the annotations on the given callable."""
+        if hasattr(__fn, '__func__'):
+            __fn = __fn.__func__
+        if hasattr(__fn, '__notes__'):
+            msg = 'callable already has notes: {!r}'
+            raise AttributeError(msg.format(__fn))
+        __fn.__notes__ = (notes, keyword_notes)
+
+    @classmethod
+    def has_annotations(cls, __fn):
+        """True if callable is annotated, else False."""
+        if cls.get_annotations.__func__ is Annotator.get_annotations.__func__:
+            # Skip formatting the error of `get_annotations`, as providers'
+            # get methods are checked on every get.
+            return hasattr(getattr(__fn, '__func__', __fn), '__notes__')
+        try:
+            cls.get_annotations(__fn)
+        except AttributeError:
+            return False
+        return True
+
+    @staticmethod
+    def wraps(__fn, **kw):
+        """Like ``functools.wraps``, with support for annotations."""
+        kw['assigned'] = kw.get('assigned', WRAPPER_ASSIGNMENTS)
+        return functools.wraps(__fn, **kw)
+
+    @staticmethod
+    def maybe(note):
+        """Wrap a keyword note to record that its resolution is optional.
+
+        Normally all annotations require fulfilled dependencies, but if a
+        keyword argument is annotated as `maybe`, then on apply, an injector
+        does not attempt to pass dependencies which are unset or not provided::
+
+            from jeni import annotate
+
+            @annotate('foo', bar=annotate.maybe('bar'))
+            def foobar(foo, bar=None):
+                return
+        """
+        return (MAYBE, note)
+
+    @staticmethod
+    def partial(__fn, *a, **kw):
+        """Wrap a note for injection of a partially applied function.
+
+        This allows for annotated functions to be injected for composition::
+
+            from jeni import annotate
+
+            @annotate('foo', bar=annotate.maybe('bar'))
+            def foobar(foo, bar=None):
+                return
+
+            @annotate('foo', annotate.partial(foobar))
+            def bazquux(foo, fn):
+                # fn: injector.partial(foobar)
+                return
+
+        Keyword arguments are treated as `maybe` when using partial, in order
+        to allow partial application of only the notes which can be provided,
+        where the caller could then apply arguments known to be unavailable in
+        the injector. Note that with Python 3 function annotations, all
+        annotations are injected as keyword arguments.
+
+        Injections on the partial function are lazy and not applied until the
+        injected partial function is called. See `eager_partial` to inject
+        eagerly.
+        """
+        return (PARTIAL, (__fn, a, tuple(kw.items())))
+
+    @staticmethod
+    def partial_regardless(__fn, *a, **kw):
+        """Wrap a note for injection of a partially applied function, or don't.
+
+        Use this instead of `partial` when binding a callable that may or may
+        not have annotations.
+        """
+        return (PARTIAL_REGARDLESS, (__fn, a, tuple(kw.items())))
+
+    @staticmethod
+    def eager_partial(__fn, *a, **kw):
+        """Wrap a note for injection of an eagerly partially applied function.
+
         Use this instead of `partial` when eager injection is needed in place
         of lazy injection.
         """
@@ -353,6 +1968,10 @@ class Annotator(object):
         return (EAGER_PARTIAL_REGARDLESS, (__fn, a, tuple(kw.items())))
 
 annotate = Annotator()
+annotators = {Annotator: annotate} # annotator_class -> shared instance
+memory_local = threading.local() # stack of `Injector.measure_memory`
+flight_lock = threading.Lock() # calls in flight, see `Injector.coalesce`
+instantiating_local = threading.local() # see `Injector.instantiating`
 wraps = annotate.wraps
 maybe = annotate.maybe
 partial = annotate.partial
@@ -363,9 +1982,56 @@ class Injector(object):
     """Collects dependencies and reads annotations to inject them."""
     annotator_class = Annotator
     factory_provider = FactoryProvider
+    refreshing_factory_provider = RefreshingFactoryProvider
+    breaker_provider = BreakerProvider
     generator_provider = GeneratorProvider
+    pooled_generator_provider = PooledGeneratorProvider
     re_note = re.compile(r'^(.*?)(?::(.*))?$') # annotation is 'object:name'
 
+    # Set in vars of a class on first use, such that None here means that
+    # no class in the method resolution order has one; see `prepare_notes`.
+    prefetch_registry = None # basenotes of providers which can prefetch
+    apply_plans = None # fn -> plan, see `apply_plan`
+
+    #: Record counts in `stats` on every get. See `seal` for production mode.
+    record_stats = True
+
+    #: Most get-by-name notes counted in `stats`, see `NoteStats`.
+    stats_maxnames = 1024
+
+    #: Also record time spent in providers, in `metrics`.
+    record_latency = False
+
+    #: Record memory retained by providers, see `memory_report`.
+    record_memory = False
+
+    #: Default time budget of providers, in seconds; see `register`.
+    provider_timeout = None
+
+    #: Coalesce concurrent calls of the same get-by-name note, see `coalesce`.
+    singleflight = False
+
+    #: `StatsAggregator` to flush statistics into on close, if any.
+    stats_aggregator = None
+
+    #: `Sampler` to time a sample of calls to `get` and `apply`, if any.
+    sampler = None
+
+    #: Budget of values provided with ``cache='lru'``, per injector instance.
+    #: None is unbounded. Bytes are measured with `lru_sizeof`.
+    lru_maxcount = 128
+    lru_maxbytes = None
+    lru_sizeof = staticmethod(sys.getsizeof)
+
+    # Keep instances compact, as an application may create one per request.
+    # Subclasses which do not declare __slots__ have a __dict__ as usual.
+    __slots__ = (
+        'closed', 'instances', 'values',
+        '_stats', '_finalizers',
+        '_weak_values', '_lru_values', '_cache_stats', '_dependencies',
+        '_metrics', '_flights', '_instantiate_lock', '_annotator',
+        '__weakref__')
+
     def __init__(self, provide_self=True):
         """A subclass could take arguments, but should pass keywords to super.
 
@@ -401,21 +2067,27 @@ class Injector(object):
                 injector.get('injector')
         """
 
-        self.annotator = self.annotator_class()
-
         self.closed = False
-        self.instances = {}
-        self.values = {}
-
-        self.finalizers = []
-
-        #: Statistics for resolved notes, note -> count.
-        #: Records counts as soon as get is called, even if unset or error.
-        self.stats = collections.defaultdict(int)
-
-        #: Collection of note tuples which are currently being instantiated.
-        #: This allows for dependency cycle checks.
-        self.instantiating = []
+        slot_table = vars(type(self)).get('slot_table')
+        if slot_table is None:
+            self.instances = {}
+            self.values = {}
+        else:
+            # Sealed with slots=True, see `seal`.
+            self.instances = SlotValues(slot_table)
+            self.values = SlotValues(slot_table)
+
+        # Allocated on first use, see properties below.
+        self._stats = None
+        self._finalizers = None
+        self._weak_values = None
+        self._lru_values = None
+        self._cache_stats = None
+        self._dependencies = None
+        self._metrics = None
+        self._flights = None
+        self._instantiate_lock = None
+        self._annotator = None
 
         if provide_self:
             self.values['injector'] = self
@@ -423,8 +2095,167 @@ class Injector(object):
             warnings.warn(
                     DeprecationWarning('provide_self=False is not supported'))
 
+    @property
+    def annotator(self):
+        """Shared instance of `annotator_class`; annotators are stateless.
+
+        Assign to use another annotator for this injector.
+        """
+        if self._annotator is not None:
+            return self._annotator
+        cls = self.annotator_class
+        if cls not in annotators:
+            annotators[cls] = cls()
+        return annotators[cls]
+
+    @annotator.setter
+    def annotator(self, annotator):
+        self._annotator = annotator
+
+    @property
+    def stats(self):
+        """Statistics for resolved notes, note -> count.
+
+        Records counts as soon as get is called, even if unset or error.
+        Counts are exact per basenote, but approximate for get-by-name notes
+        once there are more than `stats_maxnames` distinct names; see
+        `NoteStats` for the most requested names.
+        """
+        if self._stats is None:
+            self._stats = NoteStats(self.stats_maxnames)
+        return self._stats
+
+    @stats.setter
+    def stats(self, stats):
+        self._stats = stats
+
+    @property
+    def metrics(self):
+        """Counters of resolution, (basenote, metric) -> number.
+
+        Metrics are 'lookup_errors' for notes without a provider, 'unset' for
+        providers which raise `UnsetError`, 'timeouts' for providers which
+        exceed their time budget (see `register`), and with `record_latency`,
+        'provider_calls' and 'provider_seconds' for calls into providers
+        (including time spent resolving their dependencies). These metrics
+        are not recorded without `record_stats`. See `record_memory` for
+        metrics of memory.
+        """
+        if self._metrics is None:
+            self._metrics = collections.defaultdict(int)
+        return self._metrics
+
+    @property
+    def finalizers(self):
+        """List of close methods of instantiated providers, in open order."""
+        if self._finalizers is None:
+            self._finalizers = []
+        return self._finalizers
+
+    @finalizers.setter
+    def finalizers(self, finalizers):
+        self._finalizers = finalizers
+
+    @property
+    def instantiate_lock(self):
+        """Lock held while creating a provider, see `create_instance`."""
+        if self._instantiate_lock is None:
+            with flight_lock:
+                if self._instantiate_lock is None:
+                    self._instantiate_lock = threading.RLock()
+        return self._instantiate_lock
+
+    @property
+    def instantiating(self):
+        """Collection of note tuples which are currently being instantiated.
+
+        This allows for dependency cycle checks. Each thread has its own
+        collection, such that threads sharing an injector do not see each
+        other's notes as a cycle.
+        """
+        stacks = getattr(instantiating_local, 'stacks', None)
+        stack = stacks.get(id(self)) if stacks else None
+        if stack is None:
+            # Not stored, see `push_instantiating`.
+            return []
+        return stack
+
+    @instantiating.setter
+    def instantiating(self, instantiating):
+        stacks = instantiating_local.__dict__.setdefault('stacks', {})
+        if instantiating:
+            stacks[id(self)] = instantiating
+        else:
+            stacks.pop(id(self), None)
+
+    def instantiating_note(self):
+        """(basenote, name) being instantiated on this thread, else None."""
+        stacks = getattr(instantiating_local, 'stacks', None)
+        stack = stacks.get(id(self)) if stacks else None
+        if not stack:
+            return None
+        return stack[-1]
+
+    def push_instantiating(self, basenote, name):
+        """Push note tuple onto `instantiating`, checking for a cycle.
+
+        Call in a try block, with `pop_instantiating` in its finally block,
+        as the tuple is pushed even if it makes a cycle.
+        """
+        try:
+            stacks = instantiating_local.stacks
+        except AttributeError:
+            stacks = instantiating_local.stacks = {}
+        key = id(self)
+        instantiating = stacks.get(key)
+        if instantiating is None:
+            instantiating = stacks[key] = []
+        note = (basenote, name)
+        cycle = note in instantiating
+        instantiating.append(note)
+        if cycle:
+            stack = ' <- '.join(repr(note) for note in instantiating)
+            notes = tuple(instantiating)
+            raise DependencyCycleError(stack, notes=notes)
+
+    def pop_instantiating(self):
+        """Pop note tuple from `instantiating`, forgetting it once empty."""
+        stacks = instantiating_local.stacks
+        key = id(self)
+        stack = stacks[key]
+        stack.pop()
+        if not stack:
+            del stacks[key]
+
+    @property
+    def cache_stats(self):
+        """Statistics for caching policies, (basenote, policy, event) -> count.
+
+        Events are 'hit' and 'miss' when getting a value, 'evict' when an
+        'lru' value is dropped to stay within budget, and 'skip' when a value
+        cannot be cached (not weakly referenceable, or larger than budget).
+        Values cached with the default 'always' policy are counted in `stats`.
+        """
+        if self._cache_stats is None:
+            self._cache_stats = collections.defaultdict(int)
+        return self._cache_stats
+
+    @property
+    def dependencies(self):
+        """Dependencies between base notes, basenote -> set of basenotes.
+
+        Records which notes were resolved while instantiating the provider of
+        a note (or getting its value), as used by ``close(parallel=True)``.
+        Instances of a sealed class resolve without recording, and use the
+        provider graph checked by `seal` instead.
+        """
+        if self._dependencies is None:
+            self._dependencies = {}
+        return self._dependencies
+
     @classmethod
-    def provider(cls, note, provider=None, name=False):
+    def provider(cls, note, provider=None, name=False, cache=ALWAYS,
+                 pool=None, timeout=None, breaker=None):
         """Register a provider, either a Provider class or a generator.
 
         Provider class::
@@ -456,27 +2287,55 @@ class Injector(object):
                 while True:
                     count_str = yield 'spam' * int(count_str)
 
+        To handle get-by-name concurrently, e.g. with one connection per
+        generator, give the maximum number of generators to run as `pool`::
+
+            @Injector.provider('record', pool=8)
+            def record():
+                connection = connect()
+                key = yield connection
+                while True:
+                    key = yield connection.fetch(key)
+
         Registration can be a decorator or a direct method call::
 
             Injector.provider('hello', HelloProvider)
+
+        To defer importing a provider until it is first needed, register its
+        import path, as ``'module:attribute'``::
+
+            Injector.provider('search', 'myapp.search:SearchProvider')
+
+        See `register` for the `cache` policy of provided values, the
+        `timeout` budget and the circuit `breaker` of the provider.
         """
-        def decorator(provider):
+        def adapt(provider):
             if inspect.isgeneratorfunction(provider):
                 # Automatically adapt generator functions
-                provider = cls.generator_provider.bind(
+                if pool is not None:
+                    return cls.pooled_generator_provider.bind(
+                            provider, maxsize=pool)
+                return cls.generator_provider.bind(
                         provider, support_name=name)
-                return decorator(provider)
+            return provider
 
-            cls.register(note, provider)
+        def decorator(provider):
+            provider = adapt(provider)
+            cls.register(note, provider, cache=cache, timeout=timeout,
+                         breaker=breaker)
             return provider
 
-        if provider is not None:
+        if isinstance(provider, six.string_types):
+            cls.register(note, LazyProvider(provider, adapt),
+                         cache=cache, timeout=timeout, breaker=breaker)
+        elif provider is not None:
             decorator(provider)
         else:
             return decorator
 
     @classmethod
-    def factory(cls, note, fn=None):
+    def factory(cls, note, fn=None, cache=ALWAYS, timeout=None, ttl=None,
+                breaker=None):
         """Register a function as a provider.
 
         Function (name support is optional)::
@@ -494,28 +2353,81 @@ class Injector(object):
         Registration can be a decorator or a direct method call::
 
             Injector.factory('echo', echo)
+
+        As with `provider`, the function can be given as an import path, to
+        import on first use::
+
+            Injector.factory('echo', 'myapp.util:echo')
+
+        See `register` for the `cache` policy of provided values, the
+        `timeout` budget and the circuit `breaker` of the factory. With any
+        policy other than 'always',
+        the factory is called each time the injector needs the value, instead
+        of once per injector.
+
+        With a `ttl` in seconds, the value is refreshed in the background once
+        it is older than `ttl`, for use in long-lived injectors, e.g. for
+        remote configuration or rotated credentials::
+
+            Injector.factory('feature_flags', load_feature_flags, ttl=30)
+
+        See `RefreshingFactoryProvider`. The provider holds the value, so
+        the injector does not cache it (the 'transient' policy).
         """
+        if ttl is not None:
+            if cache not in (ALWAYS, TRANSIENT):
+                msg = 'ttl is not supported with cache policy {!r}'
+                raise ValueError(msg.format(cache))
+            cache = TRANSIENT
+
+        def adapt(f):
+            if ttl is not None:
+                return cls.refreshing_factory_provider.bind(f, ttl=ttl)
+            if cache == ALWAYS:
+                return cls.factory_provider.bind(f)
+            return cls.factory_provider.bind(f, retain=False)
+
         def decorator(f):
-            provider = cls.factory_provider.bind(f)
-            cls.register(note, provider)
+            cls.register(note, adapt(f), cache=cache, timeout=timeout,
+                         breaker=breaker)
             return f
 
-        if fn is not None:
+        if isinstance(fn, six.string_types):
+            cls.register(note, LazyProvider(fn, adapt),
+                         cache=cache, timeout=timeout, breaker=breaker)
+        elif fn is not None:
             decorator(fn)
         else:
             return decorator
 
     @classmethod
-    def value(cls, note, scalar):
+    def value(cls, note, scalar, lazy=False):
         """Register a single value to be provided.
 
         Supports base notes only, does not support get-by-name notes.
+
+        With `lazy`, the scalar is an import path of the value, as
+        ``'module:attribute'``, imported on first use::
+
+            Injector.value('settings', 'myapp.config:SETTINGS', lazy=True)
         """
-        cls.factory(note, lambda: scalar)
+        if lazy:
+            def adapt(obj):
+                return cls.factory_provider.bind(lambda: obj)
+            cls.register(note, LazyProvider(scalar, adapt))
+        else:
+            cls.factory(note, lambda: scalar)
 
     def apply(self, fn, *a, **kw):
         """Fully apply annotated callable, returning callable's result."""
-        args, kwargs = self.prepare_callable(fn)
+        sampler = self.sampler
+        if sampler is None or sampler.active():
+            args, kwargs = self.prepare_callable(fn)
+        elif sampler.tick():
+            args, kwargs = sampler.measure(
+                fn, 'apply', self.prepare_callable, fn)
+        else:
+            args, kwargs = sampler.skip(self.prepare_callable, fn)
         args += a; kwargs.update(kw)
         return fn(*args, **kwargs)
 
@@ -578,6 +2490,110 @@ class Injector(object):
         args += a; kwargs.update(kw)
         return functools.partial(fn, *args, **kwargs)
 
+    def map(self, fn, *iterables, **kw):
+        """Apply annotated callable to each item, like the builtin `map`.
+
+        Injections are resolved once and reused for every item::
+
+            results = injector.map(process_record, records)
+
+        Pass an `executor` keyword argument to map across a pool of worker
+        processes, e.g. a ``concurrent.futures.ProcessPoolExecutor``::
+
+            with Injector.worker_pool(max_workers=4) as executor:
+                results = injector.map(process_record, records,
+                                       executor=executor, chunksize=100)
+
+        Only the injector class, callable and items are sent to workers, so
+        each must be picklable (e.g. defined at module level). Each worker
+        process creates one instance of the injector class, taking no
+        arguments, resolves injections for the callable once, and closes the
+        injector when the worker exits at pool shutdown. Use `worker_pool` to
+        create the worker injector on pool start instead of on first item.
+
+        Returns an iterator of results, in order.
+        """
+        executor = kw.pop('executor', None)
+        chunksize = kw.pop('chunksize', 1)
+        if kw:
+            msg = 'unexpected keyword arguments: {}'
+            raise TypeError(msg.format(', '.join(sorted(kw))))
+
+        if executor is None:
+            return self.apply_many(fn, six.moves.zip(*iterables))
+
+        return executor.map(
+            apply_in_worker, itertools.repeat(type(self)),
+            itertools.repeat(fn), *iterables, chunksize=chunksize)
+
+    def apply_many(self, fn, iterable, star=True, chunksize=None):
+        """Apply annotated callable across many argument sets, injecting once.
+
+        Equivalent to calling `apply` for each item, but injections are
+        resolved only once, before the first call::
+
+            for result in injector.apply_many(fn, [(1, 2), (3, 4)]):
+                ...
+
+        With `star`, each item is a tuple of positional arguments, as in
+        ``fn(*item)``, otherwise each item is a single argument. Returns a
+        generator of results, or of lists of up to `chunksize` results.
+        """
+        results = self.iter_prepared(fn, iterable, star)
+        if chunksize is None:
+            return results
+        if chunksize < 1:
+            raise ValueError('chunksize must be at least 1')
+        return self.iter_chunks(results, chunksize)
+
+    def iter_prepared(self, fn, iterable, star=True):
+        """Generate results of `apply_many`, one by one."""
+        args, kwargs = self.prepare_callable(fn)
+        if star:
+            for a in iterable:
+                yield fn(*(args + tuple(a)), **kwargs)
+        else:
+            for a in iterable:
+                yield fn(*(args + (a,)), **kwargs)
+
+    @staticmethod
+    def iter_chunks(iterable, chunksize):
+        """Generate lists of up to chunksize items of iterable."""
+        iterator = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(iterator, chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+    def pipeline(self, *stages, **kw):
+        """Create a `Pipeline` of annotated callables, applied in sequence.
+
+        Each stage is a callable, or a ``(callable, workers)`` tuple::
+
+            pipeline = injector.pipeline(parse, (enrich, 4), write)
+            for result in pipeline.run(lines):
+                ...
+
+        Keyword arguments are passed to `Pipeline`. With ``close=True``, the
+        pipeline closes this injector when it is drained or cancelled.
+        """
+        return Pipeline(self, stages, **kw)
+
+    @classmethod
+    def worker_pool(cls, max_workers=None, scope=None, **kw):
+        """Create a process pool which creates an injector in each worker.
+
+        Keyword arguments are passed to
+        ``concurrent.futures.ProcessPoolExecutor`` (Python 3.7+).
+        See `map`. With a `ProcessScope`, worker injectors get its values
+        from shared memory instead of their providers.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker, initargs=(cls, scope), **kw)
+
     def apply_regardless(self, fn, *a, **kw):
         """Like `apply`, but applies if callable is not annotated."""
         if self.has_annotations(fn):
@@ -599,11 +2615,47 @@ class Injector(object):
 
     def get(self, note):
         """Resolve a single note into an object."""
+        sampler = self.sampler
+        if sampler is None:
+            return self.resolve(note)
+        if not sampler.tick():
+            return sampler.skip(self.resolve, note)
+        if isinstance(note, tuple):
+            return self.resolve(note)
+        return sampler.measure(note, 'get', self.resolve, note)
+
+    def get_or(self, note, default=None):
+        """Resolve a single note, or return default if missing or unset.
+
+        Unlike `get`, the injector does not raise (then catch) an exception if
+        no provider is registered for the note or if the provider does not
+        re-raise `UnsetError`. Errors resolving dependencies of the provider
+        are raised as usual.
+        """
+        value = self.resolve(note, strict=False)
+        if value is MISSING:
+            return default
+        return value
+
+    def has(self, note):
+        """True if note resolves to a value, else False. See `get_or`."""
+        return self.resolve(note, strict=False) is not MISSING
+
+    def resolve(self, note, strict=True):
+        """Implementation of `get`.
+
+        Return `MISSING` instead of raising `LookupError` or `UnsetError` for
+        the note itself if not `strict`.
+        """
         if self.closed:
             raise RuntimeError('{!r} already closed'.format(self))
 
         # Record request for note even if it fails to resolve.
-        self.stats[note] += 1
+        if self.record_stats:
+            stats = self._stats
+            if stats is None:
+                stats = self.stats
+            stats.add(note)
 
         # Handle injection of partially applied annotated functions.
         if isinstance(note, tuple) and len(note) == 2:
@@ -621,26 +2673,35 @@ class Injector(object):
                 return self.eager_partial_regardless(fn, *a, **dict(kw_items))
 
         basenote, name = self.parse_note(note)
+        if getattr(instantiating_local, 'stacks', None):
+            instantiating = self.instantiating_note()
+            if instantiating is not None:
+                # Record that the provider being instantiated depends on note.
+                dependent = instantiating[0]
+                self.dependencies.setdefault(dependent, set()).add(basenote)
         if name is None and basenote in self.values:
             return self.values[basenote]
-        try:
-            provider_factory = self.lookup(basenote)
-        except LookupError:
+        provider_factory = self.find_provider(basenote)
+        if provider_factory is MISSING:
+            self.unresolvable_notes().add(basenote)
+            if self.record_stats:
+                self.metrics[(basenote, 'lookup_errors')] += 1
+            if not strict:
+                return MISSING
             msg = "Unable to resolve '{}'"
             raise LookupError(msg.format(note))
 
-        self.instantiating.append((basenote, name))
-        try:
-            if self.instantiating.count((basenote, name)) > 1:
-                stack = ' <- '.join(repr(note) for note in self.instantiating)
-                notes = tuple(self.instantiating)
-                raise DependencyCycleError(stack, notes=notes)
+        if self.is_sealed():
+            # Provider graph is validated on seal; skip runtime cycle checks.
+            return self.handle_provider(provider_factory, note, strict=strict)
 
-            return self.handle_provider(provider_factory, note)
+        try:
+            self.push_instantiating(basenote, name)
+            return self.handle_provider(provider_factory, note, strict=strict)
         finally:
-            self.instantiating.pop()
+            self.pop_instantiating()
 
-    def close(self):
+    def close(self, parallel=False, timeout=None):
         """Close injector & injected Provider instances, including generators.
 
         Providers are closed in the reverse order in which they were opened,
@@ -648,42 +2709,426 @@ class Injector(object):
         by the injector, even if a dependency is not successfully provided. As
         such, providers should determine whether or not anything needs to be
         done in the close method.
+
+        With `parallel`, providers which do not depend on each other (see
+        `dependencies`) are closed concurrently, each on its own thread, while
+        every provider is still closed before the providers it depends on.
+        Each close may take up to `timeout` seconds, after which the injector
+        moves on to the providers it depends on. All providers are closed
+        even if some fail, then `CloseError` is raised listing the failures
+        (including `FinalizerTimeoutError` for timeouts).
+        """
+        if self.closed:
+            raise RuntimeError('{!r} already closed'.format(self))
+        errors = None
+        if parallel:
+            errors = self.close_parallel(timeout)
+        else:
+            for finalizer in reversed(self._finalizers or ()):
+                # Note: Unable to apply injector on close method.
+                finalizer()
+        self.closed = True
+        if self.stats_aggregator is not None:
+            self.flush_stats()
+        self.instances.clear()
+        self.values.clear()
+        if self._weak_values is not None:
+            self._weak_values.clear()
+        if self._lru_values is not None:
+            self._lru_values.clear()
+        if errors:
+            msg = '{} provider(s) failed to close'.format(len(errors))
+            raise CloseError(msg, errors=errors)
+
+    def flush_stats(self, aggregator=None):
+        """Add statistics of this injector to an aggregator, in one batch.
+
+        Called on close if the class has a `stats_aggregator`::
+
+            Injector.stats_aggregator = StatsAggregator()
+
+        Counts of `stats` are summed by basenote, as 'gets', along with
+        'instantiations' of providers and all `metrics`.
+        """
+        if aggregator is None:
+            aggregator = self.stats_aggregator
+        totals = collections.defaultdict(int)
+        stats = self._stats or {}
+        if isinstance(stats, NoteStats):
+            # Exact counts, even if names have been dropped.
+            stats = stats.basenotes
+        for note, count in stats.items():
+            try:
+                basenote, _ = self.parse_note(note)
+            except ValueError:
+                basenote = note
+            totals[(basenote, 'gets')] += count
+        for basenote in self.instances:
+            totals[(basenote, 'instantiations')] += 1
+        for key, value in (self._metrics or {}).items():
+            totals[key] += value
+        aggregator.add(totals)
+
+    def get_async(self, note, loop=None):
+        """Resolve note from asyncio, returning an awaitable::
+
+            value = await injector.get_async('kv:user:1')
+
+        The note is resolved on the default executor of the event loop, such
+        that slow providers do not block the loop. With `singleflight`,
+        concurrent calls for the same get-by-name note on the loop share one
+        call, counted as 'coalesced' in `metrics`.
+        """
+        import asyncio
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        if not self.singleflight or self.parse_note(note)[1] is None:
+            return loop.run_in_executor(None, self.get, note)
+        key = (loop, note)
+        with flight_lock:
+            if self._flights is None:
+                self._flights = {}
+            future = self._flights.get(key)
+            if future is None:
+                future = loop.run_in_executor(None, self.get, note)
+                self._flights[key] = future
+                future.add_done_callback(
+                    lambda _: self.end_async_flight(key))
+                return future
+            if self.record_stats:
+                basenote, _ = self.parse_note(note)
+                self.metrics[(basenote, 'coalesced')] += 1
+        return future
+
+    def end_async_flight(self, key):
+        with flight_lock:
+            self._flights.pop(key, None)
+
+    def close_async(self, timeout=None, loop=None):
+        """Close in parallel from asyncio, returning an awaitable::
+
+            await injector.close_async()
+
+        The close runs on the default executor of the event loop, such that
+        slow providers do not block the loop. See `close`.
+        """
+        import asyncio
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        close = functools.partial(self.close, parallel=True, timeout=timeout)
+        return loop.run_in_executor(None, close)
+
+    def close_parallel(self, timeout=None):
+        """Run finalizers concurrently in dependency order, returning errors.
+
+        Implementation of ``close(parallel=True)``.
+        """
+        finalizers = list(self._finalizers or ())
+        waits = self.finalizer_waits(finalizers)
+        results = six.moves.queue.Queue()
+        pending = set(range(len(finalizers)))
+        running = {} # index -> deadline or None
+        done = set()
+        errors = []
+
+        def run(index):
+            try:
+                finalizers[index]()
+            except Exception:
+                results.put((index, sys.exc_info()[1]))
+            else:
+                results.put((index, None))
+
+        while pending or running:
+            ready = [i for i in pending if waits[i] <= done]
+            if not ready and not running:
+                # Only possible with out-of-order edges; fall back to order.
+                ready = [max(pending)]
+            for index in sorted(ready, reverse=True):
+                pending.remove(index)
+                running[index] = None
+                if timeout is not None:
+                    running[index] = time.time() + timeout
+                thread = threading.Thread(target=run, args=(index,))
+                thread.daemon = True
+                thread.start()
+
+            wait = None
+            if timeout is not None:
+                wait = max(0, min(running.values()) - time.time())
+            try:
+                index, error = results.get(timeout=wait)
+            except six.moves.queue.Empty:
+                now = time.time()
+                for index, deadline in list(running.items()):
+                    if deadline <= now:
+                        del running[index]
+                        done.add(index)
+                        msg = '{!r} did not close within {} seconds'
+                        error = FinalizerTimeoutError(
+                            msg.format(finalizers[index], timeout))
+                        errors.append((finalizers[index], error))
+                continue
+            if index not in running:
+                continue # Finished after timing out.
+            del running[index]
+            done.add(index)
+            if error is not None:
+                errors.append((finalizers[index], error))
+        return errors
+
+    def finalizer_waits(self, finalizers):
+        """Map index of each finalizer to set of indexes to close before it.
+
+        A provider closes before the providers it depends on, directly or
+        not. Finalizers not bound to a provider instance of this injector
+        keep the default order, closing after finalizers added later.
         """
-        if self.closed:
-            raise RuntimeError('{!r} already closed'.format(self))
-        for finalizer in reversed(self.finalizers):
-            # Note: Unable to apply injector on close method.
-            finalizer()
-        self.closed = True
-        self.instances.clear()
-        self.values.clear()
+        basenotes = dict(
+            (id(provider), basenote)
+            for basenote, provider in self.instances.items())
+        notes = [basenotes.get(id(getattr(finalizer, '__self__', None)))
+                 for finalizer in finalizers]
+
+        graph = dict(
+            (basenote, set(dependencies))
+            for basenote, dependencies in (self._dependencies or {}).items())
+        sealed_graph = vars(type(self)).get('dependency_graph', {})
+        for basenote, dependencies in sealed_graph.items():
+            graph.setdefault(basenote, set()).update(dependencies)
+
+        def reachable(basenote):
+            seen, stack = set(), [basenote]
+            while stack:
+                for dependency in graph.get(stack.pop(), ()):
+                    if dependency not in seen:
+                        seen.add(dependency)
+                        stack.append(dependency)
+            return seen
+
+        waits = dict((i, set()) for i in range(len(finalizers)))
+        for i, note in enumerate(notes):
+            if note is None:
+                # Keep default order relative to all other finalizers.
+                for j in range(len(finalizers)):
+                    if j > i:
+                        waits[i].add(j)
+                    elif j < i:
+                        waits[j].add(i)
+                continue
+            dependencies = reachable(note)
+            for j, other in enumerate(notes):
+                if j != i and other is not None and other in dependencies:
+                    waits[j].add(i)
+        return waits
 
     def prepare_callable(self, fn, partial=False):
         """Prepare arguments required to apply function."""
+        if not partial and self.apply_plans is not None:
+            plans = vars(type(self)).get('apply_plans')
+            if plans is not None and self._annotator is None:
+                plan = self.apply_plan(fn, plans)
+                if plan is not None:
+                    return self.prepare_plan(plan)
         notes, keyword_notes = self.get_annotations(fn)
         return self.prepare_notes(*notes, __partial=partial, **keyword_notes)
 
+    @classmethod
+    def apply_plan(cls, fn, plans=None):
+        """Get precompiled plan to apply fn, if class is sealed.
+
+        A plan is a pair of a tuple of (key, note) for positional notes and a
+        tuple of (arg, key, note) for keyword notes, where key is the slot of
+        the note's value in `values` if sealed with slots (else its
+        basenote), or None if the note is not a registered basenote. Return
+        None if the class is not sealed or if fn has notes which need
+        `prepare_notes`, i.e. `maybe`, or names to `prefetch`.
+        """
+        if plans is None:
+            plans = vars(cls).get('apply_plans')
+            if plans is None:
+                return None
+        fn = getattr(fn, '__func__', fn)
+        try:
+            return plans[fn]
+        except KeyError:
+            pass
+        except TypeError:
+            # Callable does not support weak references.
+            return None
+
+        slot_table = vars(cls).get('slot_table')
+        def key(note):
+            if isinstance(note, tuple):
+                return None
+            basenote, name = cls.parse_note(note)
+            if name is not None or basenote not in cls.dispatch_table:
+                return None
+            if slot_table is None:
+                return basenote
+            return slot_table[basenote]
+
+        notes, keyword_notes = cls.annotator_class.get_annotations(fn)
+        plan = None
+        has_maybe = any(
+            isinstance(note, tuple) and len(note) == 2 and note[0] == MAYBE
+            for note in keyword_notes.values())
+        if not has_maybe and not cls.has_prefetch(
+                list(notes) + list(keyword_notes.values())):
+            plan = (
+                tuple((key(note), note) for note in notes),
+                tuple((arg, key(note), note)
+                      for arg, note in keyword_notes.items()))
+        plans[fn] = plan
+        return plan
+
+    @classmethod
+    def has_prefetch(cls, notes):
+        """True if `prefetch` would batch two or more of the given notes."""
+        prefetch_notes = cls.prefetch_notes()
+        if not prefetch_notes:
+            return False
+        seen = set()
+        for note in notes:
+            if not isinstance(note, six.string_types):
+                continue
+            basenote, name = cls.parse_note(note)
+            if name is not None and basenote in prefetch_notes:
+                if basenote in seen:
+                    return True
+                seen.add(basenote)
+        return False
+
+    def prepare_plan(self, plan):
+        """Get injection values by an `apply_plan`, reading values by key."""
+        positional, keyword = plan
+        values = self.values
+        slots = values.slots if isinstance(values, SlotValues) else None
+        stats = self.stats if self.record_stats else None
+        args = []
+        for key, note in positional:
+            if key is None:
+                value = MISSING
+            elif slots is None:
+                value = values.get(key, MISSING)
+            else:
+                value = slots[key]
+            if value is MISSING:
+                value = self.get(note)
+            elif stats is not None:
+                stats.add(note)
+            args.append(value)
+        kwargs = {}
+        for arg, key, note in keyword:
+            if key is None:
+                value = MISSING
+            elif slots is None:
+                value = values.get(key, MISSING)
+            else:
+                value = slots[key]
+            if value is MISSING:
+                value = self.get(note)
+            elif stats is not None:
+                stats.add(note)
+            kwargs[arg] = value
+        return tuple(args), kwargs
+
     def prepare_notes(self, *notes, **keyword_notes):
-        """Get injection values for all given notes."""
+        """Get injection values for all given notes.
+
+        Optional notes (`maybe`, and keywords when partial) which are known to
+        have no registered provider are skipped without calling `get`, and as
+        such are not counted in `stats`. See `unresolvable_notes`.
+        """
         __partial = keyword_notes.pop('__partial', False)
-        args = tuple(self.get(note) for note in notes)
+        if (self.prefetch_registry is not None and
+                len(notes) + len(keyword_notes) > 1 and
+                self.prefetch_notes()):
+            strict_notes = list(notes)
+            if not __partial:
+                strict_notes.extend(
+                    note for note in keyword_notes.values()
+                    if not (isinstance(note, tuple) and note[0] == MAYBE))
+            if len(strict_notes) > 1:
+                self.prefetch(strict_notes)
+        # Gets are sampled, see `get`, else resolve directly.
+        get = self.resolve if self.sampler is None else self.get
+        args = tuple([get(note) for note in notes])
         kwargs = {}
+        unresolvable = None
         for arg in keyword_notes:
             note = keyword_notes[arg]
             if isinstance(note, tuple) and len(note) == 2 and note[0] == MAYBE:
-                try:
-                    kwargs[arg] = self.get(note[1])
-                except LookupError:
-                    continue
-            elif __partial:
-                try:
-                    kwargs[arg] = self.get(note)
-                except LookupError:
-                    continue
-            else:
-                kwargs[arg] = self.get(note)
+                note = note[1]
+            elif not __partial:
+                kwargs[arg] = get(note)
+                continue
+            if unresolvable is None:
+                unresolvable = self.unresolvable_notes()
+            if self.parse_note(note)[0] in unresolvable:
+                continue
+            try:
+                value = self.resolve(note, strict=False)
+            except (LookupError, ProviderTimeoutError):
+                # A dependency of the note's provider is missing, unset or
+                # timed out.
+                continue
+            if value is not MISSING:
+                kwargs[arg] = value
         return args, kwargs
 
+    def prefetch(self, notes):
+        """Let providers batch get-by-name notes, before each note is got.
+
+        Names of string notes are grouped by basenote. Where two or more
+        names share a provider which has a `prefetch` method, e.g.
+        `KVProvider`, it is called once with all of the names, such that the
+        gets which follow need not each make a round trip. Called by
+        `prepare_notes` with notes which must resolve, only if the class has
+        such providers (see `prefetch_notes`); sealed classes compile no
+        `apply_plan` for callables with such notes, so as to prefetch them.
+        """
+        prefetch_notes = self.prefetch_notes()
+        groups = collections.OrderedDict() # basenote -> (note, names)
+        for note in notes:
+            if not isinstance(note, six.string_types):
+                continue
+            basenote, name = self.parse_note(note)
+            if name is not None and basenote in prefetch_notes:
+                groups.setdefault(basenote, (note, []))[1].append(name)
+        for basenote, (note, names) in groups.items():
+            if len(names) > 1:
+                self.ensure_provider(note).prefetch(names)
+
+    def ensure_provider(self, note):
+        """Get provider instance of note, instantiating it as `resolve` would.
+
+        Dependencies and cycles are tracked as for a get of the note, but the
+        provider's get is not called. See `prefetch`.
+        """
+        basenote, name = self.parse_note(note)
+        if basenote in self.instances:
+            return self.instances[basenote]
+        instantiating = self.instantiating_note()
+        if instantiating is not None:
+            dependent = instantiating[0]
+            self.dependencies.setdefault(dependent, set()).add(basenote)
+        provider_factory = self.lookup(basenote)
+        _, timeout = self.lookup_options(basenote)
+        sampler = self.sampler
+        if sampler is not None and not sampler.active():
+            sampler = None
+        if self.is_sealed():
+            return self.create_instance(
+                provider_factory, note, timeout, sampler)
+
+        try:
+            self.push_instantiating(basenote, name)
+            return self.create_instance(
+                provider_factory, note, timeout, sampler)
+        finally:
+            self.pop_instantiating()
+
     @classmethod
     def parse_note(cls, note):
         """Parse string annotation into object reference with optional name."""
@@ -692,43 +3137,94 @@ class Injector(object):
                 raise ValueError('tuple annotations must be length 2')
             return note
         try:
+            if ':' not in note:
+                return note, None
             match = cls.re_note.match(note)
         except TypeError:
             # Note is not a string. Support any Python object as a note.
             return note, None
         return match.groups()
 
-    def handle_provider(self, provider_factory, note):
-        """Get value from provider as requested by note."""
+    def handle_provider(self, provider_factory, note, strict=True):
+        """Get value from provider as requested by note.
+
+        Return `MISSING` instead of raising `UnsetError` if not `strict`.
+        """
+        if self.record_latency and self.record_stats:
+            start = timeit.default_timer()
+            try:
+                return self.call_provider(provider_factory, note, strict)
+            finally:
+                basenote, _ = self.parse_note(note)
+                elapsed = timeit.default_timer() - start
+                self.metrics[(basenote, 'provider_calls')] += 1
+                self.metrics[(basenote, 'provider_seconds')] += elapsed
+        return self.call_provider(provider_factory, note, strict)
+
+    def call_provider(self, provider_factory, note, strict=True):
+        """Implementation of `handle_provider`, without latency book-keeping.
+        """
         # Implementation in separate method to support accurate book-keeping.
         basenote, name = self.parse_note(note)
 
-        # _handle_provider could be even shorter if
-        # Injector.apply() worked with classes, issue #9.
+        policy, timeout = self.lookup_options(basenote)
+        if name is not None:
+            policy = ALWAYS
+        elif policy != ALWAYS:
+            value = self.get_cached(basenote, policy)
+            if value is not MISSING:
+                return value
+
+        sampler = self.sampler
+        sampling = sampler is not None and sampler.active()
         if basenote not in self.instances:
-            if (isinstance(provider_factory, type) and
-                    self.has_annotations(provider_factory.__init__)):
-                args, kwargs = self.prepare_callable(provider_factory.__init__)
-                self.instances[basenote] = provider_factory(*args, **kwargs)
-
-            else:
-                self.instances[basenote] = self.apply_regardless(
-                        provider_factory)
-
-            provider = self.instances[basenote]
-            if hasattr(provider, 'close'):
-                self.finalizers.append(self.instances[basenote].close)
+            try:
+                self.create_instance(provider_factory, note, timeout,
+                                     sampler if sampling else None)
+            except ProviderTimeoutError as error:
+                if not strict and error.note == note:
+                    return MISSING
+                raise
 
         provider = self.instances[basenote]
-        get = self.partial_regardless(provider.get)
+        within = None
+        if timeout is not None:
+            # Provider applies the budget itself, see `BreakerProvider`.
+            within = getattr(provider, 'get_within', None)
+        if within is not None:
+            get = functools.partial(within, note, timeout)
+        elif timeout is not None:
+            # Inject get on this thread, see `create_provider_within`.
+            get = self.eager_partial_regardless(provider.get)
+        else:
+            get = self.partial_regardless(provider.get)
+        if self.record_memory and name is None:
+            get = functools.partial(
+                self.measure_memory, basenote, 'value_bytes', get)
+        if timeout is not None and within is None:
+            get = functools.partial(self.call_with_timeout, note, timeout, get)
+        if self.singleflight and name is not None:
+            get = functools.partial(self.coalesce, note, get)
+        if sampling:
+            get = functools.partial(sampler.measure, note, 'provider_get', get)
 
         try:
             if name is not None:
                 return get(name=name)
-            self.values[basenote] = get()
-            return self.values[basenote]
+            value = get()
+            self.set_cached(basenote, policy, value)
+            return value
+
+        except ProviderTimeoutError as error:
+            if not strict and error.note == note:
+                return MISSING
+            raise
 
         except UnsetError:
+            if self.record_stats:
+                self.metrics[(basenote, 'unset')] += 1
+            if not strict:
+                return MISSING
             # Use sys.exc_info to support both Python 2 and Python 3.
             exc_type, exc_value, tb = sys.exc_info()
             exc_msg = str(exc_value)
@@ -738,17 +3234,410 @@ class Injector(object):
                 msg = repr(note)
             six.reraise(exc_type, exc_type(msg, note=note), tb)
 
+    def create_instance(self, provider_factory, note, timeout=None,
+                        sampler=None):
+        """Create provider of note and keep it in `instances`.
+
+        Creation is measured with `record_memory`, bounded by the timeout
+        budget and timed by the (active) sampler, if any. Threads sharing the
+        injector create providers one at a time, such that a provider which
+        another thread created in the meantime is returned instead.
+        """
+        basenote, _ = self.parse_note(note)
+        with self.instantiate_lock:
+            if basenote in self.instances:
+                return self.instances[basenote]
+            return self.create_instance_locked(
+                provider_factory, note, timeout, sampler)
+
+    def create_instance_locked(self, provider_factory, note, timeout,
+                               sampler):
+        """Implementation of `create_instance`, holding its lock."""
+        basenote, _ = self.parse_note(note)
+        create = self.create_provider
+        if timeout is not None:
+            create = functools.partial(
+                self.create_provider_within, note, timeout)
+        if self.record_memory:
+            create = functools.partial(
+                self.measure_memory, basenote, 'provider_bytes', create)
+        if sampler is not None:
+            provider = sampler.measure(
+                basenote, 'instantiate', create, provider_factory)
+        else:
+            provider = create(provider_factory)
+        self.keep_provider(basenote, provider)
+        return provider
+
+    def keep_provider(self, basenote, provider):
+        """Keep created provider in `instances`, to close with injector."""
+        self.instances[basenote] = provider
+        if hasattr(provider, 'close'):
+            self.finalizers.append(provider.close)
+
+    @staticmethod
+    def close_provider(provider):
+        """Close a provider which is not kept by the injector, if closable."""
+        if hasattr(provider, 'close'):
+            provider.close()
+
+    def create_provider(self, provider_factory):
+        """Create provider, injecting its annotated factory or __init__."""
+        # create_provider could be even shorter if
+        # Injector.apply() worked with classes, issue #9.
+        if (isinstance(provider_factory, type) and
+                self.has_annotations(provider_factory.__init__)):
+            args, kwargs = self.prepare_callable(provider_factory.__init__)
+            return provider_factory(*args, **kwargs)
+        return self.apply_regardless(provider_factory)
+
+    def create_provider_within(self, note, timeout, provider_factory):
+        """Like `create_provider`, within a budget of timeout seconds.
+
+        Notes injected into the provider are resolved on this thread first,
+        each within its own budget. Only the provider itself is then created
+        on the worker thread, such that the worker never uses the injector. A
+        provider created after the budget is closed there, never kept in
+        instances.
+        """
+        create = self.prepare_factory(provider_factory)
+        return self.call_with_timeout(
+            note, timeout, create, abandon=self.close_provider)
+
+    def prepare_factory(self, provider_factory):
+        """Inject provider factory now, returning a callable to create it.
+
+        Partially applied notes are injected eagerly, as by `eager_partial`,
+        such that no note is resolved when the provider is created.
+        """
+        fn = provider_factory
+        if isinstance(provider_factory, type):
+            fn = provider_factory.__init__
+        if not self.has_annotations(fn):
+            return provider_factory
+        notes, keyword_notes = self.get_annotations(fn)
+        notes = [self.eager_note(note) for note in notes]
+        keyword_notes = dict((arg, self.eager_note(note))
+                             for arg, note in keyword_notes.items())
+        args, kwargs = self.prepare_notes(*notes, **keyword_notes)
+        return functools.partial(provider_factory, *args, **kwargs)
+
+    @staticmethod
+    def eager_note(note):
+        """Eager equivalent of a partially applied note, else the note."""
+        if isinstance(note, tuple) and len(note) == 2:
+            if note[0] == PARTIAL:
+                return EAGER_PARTIAL, note[1]
+            elif note[0] == PARTIAL_REGARDLESS:
+                return EAGER_PARTIAL_REGARDLESS, note[1]
+        return note
+
+    def coalesce(self, note, fn, *a, **kw):
+        """Call fn, unless a call for the same note is already in flight.
+
+        With `singleflight`, an injector shared by many threads calls the
+        provider of a get-by-name note once for all threads which get the
+        same note at the same time, e.g. after a cache expiry. Threads which
+        find a call in flight wait for it and share its result or error,
+        counted as 'coalesced' in `metrics`. See also `get_async`.
+        """
+        key = (None, note)
+        basenote, _ = self.parse_note(note)
+        with flight_lock:
+            if self._flights is None:
+                self._flights = {}
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.waiters += 1
+                if self.record_stats:
+                    self.metrics[(basenote, 'coalesced')] += 1
+        if not leader:
+            flight.event.wait()
+            if flight.exc_info is not None:
+                six.reraise(*flight.exc_info)
+            return flight.result
+        try:
+            flight.result = fn(*a, **kw)
+        except BaseException:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with flight_lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.result
+
+    def call_with_timeout(self, note, timeout, fn, *a, **kw):
+        """Call fn on a worker thread, waiting up to timeout seconds.
+
+        Raise `ProviderTimeoutError` if fn does not return in time. With an
+        `abandon` keyword argument, it is called on the worker thread with
+        the result of fn if fn returns after the caller stopped waiting.
+        """
+        abandon = kw.pop('abandon', None)
+        results = six.moves.queue.Queue(maxsize=1)
+        lock = threading.Lock()
+        abandoned = [False]
+
+        def target():
+            try:
+                ok, result = True, fn(*a, **kw)
+            except BaseException:
+                ok, result = False, sys.exc_info()
+            with lock:
+                if not abandoned[0]:
+                    results.put((ok, result))
+                    return
+            if ok and abandon is not None:
+                abandon(result)
+
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        try:
+            ok, result = results.get(timeout=timeout)
+        except six.moves.queue.Empty:
+            with lock:
+                # The result could arrive between the timeout and the lock.
+                abandoned[0] = results.empty()
+            if not abandoned[0]:
+                ok, result = results.get()
+        if abandoned[0]:
+            basenote, _ = self.parse_note(note)
+            if self.record_stats:
+                self.metrics[(basenote, 'timeouts')] += 1
+            msg = '{!r} exceeded budget of {} seconds'
+            raise ProviderTimeoutError(msg.format(note, timeout), note=note)
+        if not ok:
+            six.reraise(*result)
+        return result
+
+    def measure_memory(self, basenote, metric, fn, *a, **kw):
+        """Call fn, adding the bytes it retains to `metrics` of basenote.
+
+        Bytes are measured with `tracemalloc` (Python 3.4+), which is started
+        if it is not already tracing. Bytes retained by nested measurements,
+        e.g. dependencies of a provider, are attributed to their own basenote
+        only. Allocations of other threads during the call are included.
+        """
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stack = memory_local.__dict__.setdefault('stack', [])
+        stack.append(0) # bytes retained by nested measurements
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            return fn(*a, **kw)
+        finally:
+            size = tracemalloc.get_traced_memory()[0] - before
+            nested = stack.pop()
+            if stack:
+                stack[-1] += size
+            self.metrics[(basenote, metric)] += size - nested
+            if metric == 'value_bytes':
+                self.metrics[(basenote, 'values_measured')] += 1
+
+    def memory_report(self):
+        """Report memory retained by providers and values, largest first.
+
+        With `record_memory`, the injector measures the bytes retained when
+        instantiating each provider and when getting each value (of base
+        notes, not get-by-name notes), as allocated and not yet freed by the
+        time the call returns. Use in staging, not production, to find
+        providers which could use a 'weak' or 'transient' cache policy; see
+        `register`. Return a list of dicts, one per basenote, with keys:
+
+        * 'note': basenote.
+        * 'cache': cache policy of basenote.
+        * 'provider_bytes': bytes retained by instantiating the provider.
+        * 'value_bytes': bytes retained by getting values, in total.
+        * 'values': number of values measured.
+        """
+        report = {}
+        for (basenote, metric), value in (self._metrics or {}).items():
+            if metric not in ('provider_bytes', 'value_bytes',
+                              'values_measured'):
+                continue
+            if basenote not in report:
+                report[basenote] = {
+                    'note': basenote,
+                    'cache': self.lookup_cache(basenote),
+                    'provider_bytes': 0,
+                    'value_bytes': 0,
+                    'values': 0,
+                }
+            if metric == 'values_measured':
+                metric = 'values'
+            report[basenote][metric] += value
+        return sorted(
+            report.values(),
+            key=lambda row: row['provider_bytes'] + row['value_bytes'],
+            reverse=True)
+
+    def get_cached(self, basenote, policy):
+        """Get value cached according to policy, else `MISSING`."""
+        value = MISSING
+        if policy == WEAK and self._weak_values is not None:
+            ref = self._weak_values.get(basenote)
+            if ref is not None:
+                value = ref()
+                if value is None:
+                    value = MISSING
+        elif policy == LRU and self._lru_values is not None:
+            value = self._lru_values.get(basenote, MISSING)
+        if self.record_stats:
+            event = 'miss' if value is MISSING else 'hit'
+            self.cache_stats[(basenote, policy, event)] += 1
+        return value
+
+    def set_cached(self, basenote, policy, value):
+        """Cache value of basenote according to policy."""
+        if policy == ALWAYS:
+            self.values[basenote] = value
+            return
+        skipped, evicted = False, ()
+        if policy == WEAK:
+            if self._weak_values is None:
+                self._weak_values = {}
+            try:
+                self._weak_values[basenote] = weakref.ref(value)
+            except TypeError:
+                # Value does not support weak references, e.g. a dict.
+                skipped = True
+        elif policy == LRU:
+            if self._lru_values is None:
+                self._lru_values = LRUValues(
+                    self.lru_maxcount, self.lru_maxbytes, self.lru_sizeof)
+            evicted = self._lru_values.put(basenote, value)
+            if basenote in evicted:
+                evicted.remove(basenote)
+                skipped = True
+        if self.record_stats:
+            if skipped:
+                self.cache_stats[(basenote, policy, 'skip')] += 1
+            for evicted_note in evicted:
+                self.cache_stats[(evicted_note, policy, 'evict')] += 1
+
     @classmethod
-    def register(cls, note, provider):
-        """Implementation to register provider via `provider` & `factory`."""
+    def register(cls, note, provider, cache=ALWAYS, timeout=None,
+                 breaker=None):
+        """Implementation to register provider via `provider` & `factory`.
+
+        The `cache` policy determines how an injector instance keeps the value
+        of a base note (i.e. not get-by-name) once provided:
+
+        * 'always': keep the value until the injector is closed (default).
+        * 'transient': never keep the value, get it from provider every time.
+        * 'weak': keep a weak reference to the value, if supported.
+        * 'lru': keep the value within the `lru_maxcount` & `lru_maxbytes`
+          budget of the injector, evicting least recently used values first.
+
+        Policies apply to values only; provider instances are kept until
+        close, so a provider which holds on to its value keeps it alive.
+        Statistics for policies other than 'always' are in `cache_stats`.
+
+        The `timeout` is a budget in seconds for instantiating the provider
+        and, separately, for each call to its get method (default
+        `provider_timeout`). Calls with a budget run on a worker thread; if
+        a call exceeds its budget, the injector stops waiting for it and
+        raises `ProviderTimeoutError`, counting 'timeouts' in `metrics`. As
+        with unset values, `maybe` notes which time out are not injected,
+        such that the default of the keyword argument is used, and `get_or`
+        returns its default. The worker thread cannot be interrupted, and is
+        left to finish in the background. Notes injected into the provider
+        are resolved beforehand, on the calling thread, each within its own
+        budget; see `create_provider_within`.
+
+        A `CircuitBreaker` guards instantiation and get of the provider, to
+        fail fast with `CircuitOpenError` while the provider is failing; see
+        `BreakerProvider`. Rejected calls and fallback values are counted in
+        `metrics` as 'breaker_rejected' and 'breaker_fallbacks'. With both a
+        timeout and a breaker, calls which exceed their budget count as
+        failures of the breaker.
+        """
         basenote, name = cls.parse_note(note)
+        if cls.is_sealed():
+            raise RuntimeError('{!r} is sealed'.format(cls))
+        if cache not in CACHE_POLICIES:
+            raise ValueError('unknown cache policy: {!r}'.format(cache))
+        if breaker is not None:
+            provider = cls.guard_provider(basenote, provider, breaker)
         if 'provider_registry' not in vars(cls):
             cls.provider_registry = {}
         cls.provider_registry[basenote] = provider
+        if cache != ALWAYS:
+            if 'cache_registry' not in vars(cls):
+                cls.cache_registry = {}
+            cls.cache_registry[basenote] = cache
+        elif basenote in vars(cls).get('cache_registry', ()):
+            del cls.cache_registry[basenote]
+        if timeout is not None:
+            if 'timeout_registry' not in vars(cls):
+                cls.timeout_registry = {}
+            cls.timeout_registry[basenote] = timeout
+        elif basenote in vars(cls).get('timeout_registry', ()):
+            del cls.timeout_registry[basenote]
+        if cls.can_prefetch(provider):
+            cls.add_prefetch_note(basenote)
+        else:
+            (vars(cls).get('prefetch_registry') or set()).discard(basenote)
+            cls.forget_prefetch_notes()
+        cls.forget_registrations()
+        cls.forget_unresolvable()
+
+    @classmethod
+    def guard_provider(cls, basenote, provider, breaker):
+        """Wrap provider in a `BreakerProvider`, see `register`."""
+        if isinstance(provider, LazyProvider):
+            adapt = provider.adapt
+            return LazyProvider(
+                provider.path,
+                lambda obj: cls.breaker_provider.bind(
+                    basenote, adapt(obj), breaker))
+        return cls.breaker_provider.bind(basenote, provider, breaker)
 
     @classmethod
     def lookup(cls, basenote):
         """Look up note in registered annotations, walking class tree."""
+        provider = cls.find_provider(basenote)
+        if provider is MISSING:
+            raise LookupError(repr(basenote))
+        return provider
+
+    @classmethod
+    def find_provider(cls, basenote):
+        """Like `lookup`, but return `MISSING` if note is not registered."""
+        namespace = vars(cls)
+        dispatch_table = namespace.get('dispatch_table')
+        if dispatch_table is not None:
+            # Sealed class, registry is frozen into a single dict.
+            return dispatch_table.get(basenote, MISSING)
+        registration = (namespace.get('registrations') or {}).get(basenote)
+        if registration is None:
+            registration = cls.registration(basenote)
+        return registration[0]
+
+    @classmethod
+    def registration(cls, basenote):
+        """Look up (provider, cache policy, timeout) of note, cached per class.
+
+        The class tree is walked once per basenote, for both `find_provider`
+        and `lookup_options`. Provider is `MISSING` if the note is not
+        registered, and timeout is None unless registered with the note. The
+        cache is cleared when a provider is registered on this class or any
+        of its base classes.
+        """
+        registrations = vars(cls).get('registrations')
+        if registrations is None:
+            registrations = cls.registrations = {}
+        registration = registrations.get(basenote)
+        if registration is not None:
+            return registration
+
+        registration = MISSING, ALWAYS, None
         # Walk method resolution order, which includes current class.
         for c in cls.mro():
             if 'provider_registry' not in vars(c):
@@ -756,8 +3645,260 @@ class Injector(object):
                 continue
             if basenote in c.provider_registry:
                 # note is in the registry.
-                return c.provider_registry[basenote]
-        raise LookupError(repr(basenote))
+                provider = c.provider_registry[basenote]
+                if isinstance(provider, LazyProvider):
+                    # Import on first lookup, then keep the provider.
+                    provider = provider.load()
+                    c.provider_registry[basenote] = provider
+                    if c.can_prefetch(provider):
+                        c.add_prefetch_note(basenote)
+                registry = vars(c)
+                registration = (
+                    provider,
+                    registry.get('cache_registry', {}).get(basenote, ALWAYS),
+                    registry.get('timeout_registry', {}).get(basenote))
+                break
+        registrations[basenote] = registration
+        return registration
+
+    @classmethod
+    def forget_registrations(cls):
+        """Clear cache of `registration`, of this class and its subclasses."""
+        if 'registrations' in vars(cls):
+            del cls.registrations
+        for subclass in cls.__subclasses__():
+            subclass.forget_registrations()
+
+    @classmethod
+    def unresolvable_notes(cls):
+        """Set of basenotes which failed lookup, cached per injector class.
+
+        Basenotes are added when no provider is registered for them, such
+        that get-by-name notes do not grow the set one name at a time. Notes
+        with a provider which raises `UnsetError` are not included, as such
+        providers could provide a value on a later get. The set is cleared when a
+        provider is registered on this class or any of its base classes.
+        """
+        unresolvable = vars(cls).get('unresolvable')
+        if unresolvable is None:
+            unresolvable = cls.unresolvable = set()
+        return unresolvable
+
+    @classmethod
+    def forget_unresolvable(cls):
+        """Clear `unresolvable_notes` of this class and its subclasses."""
+        unresolvable = vars(cls).get('unresolvable')
+        if unresolvable:
+            unresolvable.clear()
+        for subclass in cls.__subclasses__():
+            subclass.forget_unresolvable()
+
+    @staticmethod
+    def can_prefetch(provider):
+        """True if provider is a class with a `prefetch` method."""
+        return isinstance(provider, type) and hasattr(provider, 'prefetch')
+
+    @classmethod
+    def add_prefetch_note(cls, basenote):
+        """Record that the provider registered for basenote can prefetch."""
+        if vars(cls).get('prefetch_registry') is None:
+            cls.prefetch_registry = set()
+        cls.prefetch_registry.add(basenote)
+        cls.forget_prefetch_notes()
+
+    @classmethod
+    def prefetch_notes(cls):
+        """Set of basenotes whose provider can prefetch, cached per class.
+
+        Built from registrations on this class and its base classes, such
+        that `prepare_notes` skips `prefetch` when the set is empty.
+        """
+        basenotes = vars(cls).get('prefetch_basenotes')
+        if basenotes is None:
+            candidates = set()
+            for c in cls.mro():
+                candidates.update(vars(c).get('prefetch_registry') or ())
+            basenotes = cls.prefetch_basenotes = frozenset(
+                basenote for basenote in candidates
+                if cls.can_prefetch(cls.find_provider(basenote)))
+        return basenotes
+
+    @classmethod
+    def forget_prefetch_notes(cls):
+        """Clear `prefetch_notes` of this class and its subclasses."""
+        if 'prefetch_basenotes' in vars(cls):
+            del cls.prefetch_basenotes
+        for subclass in cls.__subclasses__():
+            subclass.forget_prefetch_notes()
+
+    @classmethod
+    def lookup_options(cls, basenote):
+        """Look up (cache policy, timeout) of registered note, in one walk."""
+        namespace = vars(cls)
+        option_table = namespace.get('option_table')
+        if option_table is not None:
+            return option_table.get(basenote, (ALWAYS, cls.provider_timeout))
+        registration = (namespace.get('registrations') or {}).get(basenote)
+        if registration is None:
+            registration = cls.registration(basenote)
+        _, policy, timeout = registration
+        if timeout is None:
+            timeout = cls.provider_timeout
+        return policy, timeout
+
+    @classmethod
+    def lookup_cache(cls, basenote):
+        """Look up cache policy of registered note, walking class tree."""
+        return cls.lookup_options(basenote)[0]
+
+    @classmethod
+    def lookup_timeout(cls, basenote):
+        """Look up timeout of registered note, walking class tree."""
+        return cls.lookup_options(basenote)[1]
+
+    @classmethod
+    def seal(cls, stats=True, slots=False):
+        """Validate the provider graph, then freeze the registry of this class.
+
+        Intended for production, where all providers are registered at import
+        time::
+
+            class Injector(BaseInjector):
+                pass
+
+            # ... register providers ...
+
+            Injector.seal()
+
+        Sealing checks that every note annotated on a registered provider
+        (including notes of partially applied functions) can be resolved and
+        that no provider depends on itself, raising `LookupError` or
+        `DependencyCycleError` respectively. The registry, including providers
+        inherited from base classes, is then frozen into a single dispatch
+        table; later calls to `register` on this class raise `RuntimeError`.
+
+        Providers registered by import path are imported when sealing.
+
+        Instances of a sealed class resolve notes without runtime dependency
+        cycle checks, and `apply` injects values already provided by a plan
+        compiled once per annotated callable (see `apply_plan`). Pass
+        ``stats=False`` to also stop recording `stats`; subclasses inherit
+        this setting, but are not themselves sealed.
+
+        Pass ``slots=True`` to assign each registered basenote an integer
+        slot, then store `values` and `instances` of each injector in lists
+        indexed by slot (see `SlotValues`; both remain usable as dicts), such
+        that plans read values by slot instead of by basenote.
+        """
+        if cls.is_sealed():
+            raise RuntimeError('{!r} already sealed'.format(cls))
+
+        dispatch_table = {}
+        for c in reversed(cls.mro()):
+            dispatch_table.update(vars(c).get('provider_registry', {}))
+        for basenote, provider in dispatch_table.items():
+            if isinstance(provider, LazyProvider):
+                # Import now, as the provider graph cannot be checked without.
+                dispatch_table[basenote] = cls.find_provider(basenote)
+
+        cls.dependency_graph = cls.check_dependencies(dispatch_table)
+
+        cls.option_table = dict(
+            (basenote, cls.lookup_options(basenote))
+            for basenote in dispatch_table)
+        if slots:
+            cls.slot_table = dict(
+                (basenote, slot) for slot, basenote in
+                enumerate(['injector'] + sorted(
+                    (basenote for basenote in dispatch_table
+                     if basenote != 'injector'), key=repr)))
+        cls.apply_plans = weakref.WeakKeyDictionary()
+        cls.dispatch_table = dispatch_table
+        if not stats:
+            cls.record_stats = False
+
+    @classmethod
+    def is_sealed(cls):
+        """True if `seal` has been called on this class, else False."""
+        return 'dispatch_table' in vars(cls)
+
+    @classmethod
+    def check_dependencies(cls, dispatch_table):
+        """Check provider graph of given basenote -> provider dict.
+
+        Raise `LookupError` if a required note is not registered, and
+        `DependencyCycleError` if a provider depends on itself. Return the
+        graph, basenote -> list of registered basenotes it depends on.
+        """
+        graph = {}
+        for basenote, provider in dispatch_table.items():
+            graph[basenote] = dependencies = []
+            for note, required in cls.provider_notes(provider):
+                depnote, _ = cls.parse_note(note)
+                if depnote in dispatch_table:
+                    dependencies.append(depnote)
+                elif required and depnote != 'injector':
+                    msg = "Unable to resolve '{}', required by '{}'"
+                    raise LookupError(msg.format(note, basenote))
+
+        # Depth-first search, with notes of the current path on a stack.
+        done = set()
+        def visit(basenote, stack):
+            if basenote in done:
+                return
+            if basenote in stack:
+                notes = tuple((n, None) for n in stack + [basenote])
+                path = ' <- '.join(repr(note) for note in notes)
+                raise DependencyCycleError(path, notes=notes)
+            stack.append(basenote)
+            for depnote in graph[basenote]:
+                visit(depnote, stack)
+            stack.pop()
+            done.add(basenote)
+
+        for basenote in graph:
+            visit(basenote, [])
+        return graph
+
+    @classmethod
+    def provider_notes(cls, provider):
+        """Generate (note, required) pairs needed to instantiate provider."""
+        # Look through a `BreakerProvider` to the provider it guards.
+        provider = getattr(provider, 'guarded_provider', provider)
+        # (target, partial): get is applied as a partial, see call_provider.
+        targets = [(provider, False)]
+        if isinstance(provider, type):
+            targets = [(provider.__init__, False),
+                       (getattr(provider, 'get', None), True)]
+        annotator = cls.annotator_class
+        for target, partial in targets:
+            if target is None or not annotator.has_annotations(target):
+                continue
+            notes, keyword_notes = annotator.get_annotations(target)
+            for pair in cls.expand_notes(notes, keyword_notes, partial):
+                yield pair
+
+    @classmethod
+    def expand_notes(cls, notes, keyword_notes, partial=False):
+        """Generate (note, required) pairs, including partial dependencies."""
+        keyword_notes = [(keyword_notes[arg], not partial)
+                         for arg in keyword_notes]
+        for note, required in [(n, True) for n in notes] + keyword_notes:
+            if isinstance(note, tuple) and len(note) == 2:
+                if note[0] == MAYBE:
+                    yield note[1], False
+                    continue
+                elif note[0] in (PARTIAL, PARTIAL_REGARDLESS,
+                                 EAGER_PARTIAL, EAGER_PARTIAL_REGARDLESS):
+                    fn = note[1][0]
+                    if not cls.annotator_class.has_annotations(fn):
+                        # Regardless modes allow callables without annotations.
+                        continue
+                    partial_notes = cls.annotator_class.get_annotations(fn)
+                    for pair in cls.expand_notes(*partial_notes, partial=True):
+                        yield pair
+                    continue
+            yield note, required
 
     def __enter__(self):
         """Support for context manager, returning self."""
@@ -841,10 +3982,505 @@ class InjectorProxy(object):
 
     def __contains__(self, item):
         try:
-            self.injector.get(item)
+            return self.injector.has(item)
         except LookupError:
             return False
-        return True
+
+
+class SharedProvider(Provider):
+    """Provide a note by getting it from a shared injector, under a lock.
+
+    `InjectorLocal` uses this class to delegate notes to its parent injector.
+    """
+
+    def __init__(self, injector, basenote, lock):
+        self.injector = injector
+        self.basenote = basenote
+        self.lock = lock
+
+    def get(self, name=None):
+        note = self.basenote
+        if name is not None:
+            if isinstance(note, six.string_types):
+                note = '{}:{}'.format(note, name)
+            else:
+                note = (note, name)
+        with self.lock:
+            return self.injector.get(note)
+
+
+class InjectorLocal(object):
+    """Manage one injector per thread, sharing designated notes.
+
+    Each thread (and each `contextvars` context, where available) gets its own
+    instance of a subclass of the given injector class, for request-scoped
+    state. Notes listed in `shared` are delegated to a single parent injector
+    so that their providers are instantiated once per application::
+
+        from jeni import InjectorLocal
+
+        local = InjectorLocal(Injector, shared=['db', 'config'])
+
+        def worker():
+            local.injector.apply(handle_request)
+
+    The injector of a thread is closed when the thread exits, or more
+    precisely when the context holding it is garbage collected. Contexts
+    copied after the injector is created (e.g. asyncio tasks) share it.
+
+    The parent injector is only accessed under a lock. A local injector keeps
+    shared values once provided, but get-by-name notes of shared providers are
+    serialized through the parent. Call `close` to close the local injectors
+    which are still open, then the parent.
+    """
+
+    def __init__(self, injector_class, shared=(), parent=None):
+        if parent is None:
+            parent = injector_class()
+        self.parent = parent
+        self.lock = threading.RLock()
+        self.closed = False
+
+        #: Map of weakref to context-held token -> open local injector.
+        self.injectors = {}
+
+        class LocalInjector(injector_class):
+            pass
+        for note in shared:
+            basenote, _ = LocalInjector.parse_note(note)
+            LocalInjector.provider(
+                basenote, self.shared_provider(basenote))
+        self.injector_class = LocalInjector
+
+        if contextvars is not None:
+            self.storage = contextvars.ContextVar(
+                'jeni.InjectorLocal.{}'.format(id(self)), default=None)
+        else:
+            self.storage = threading.local()
+
+    def shared_provider(self, basenote):
+        """Create a Provider class delegating basenote to the parent."""
+        parent, lock = self.parent, self.lock
+        class LocalSharedProvider(SharedProvider):
+            def __init__(self):
+                super(LocalSharedProvider, self).__init__(
+                    parent, basenote, lock)
+        return LocalSharedProvider
+
+    @property
+    def injector(self):
+        """Injector of the current thread or context, created on first use."""
+        if contextvars is not None:
+            token = self.storage.get()
+        else:
+            token = getattr(self.storage, 'value', None)
+        if token is not None:
+            return token.injector
+
+        if self.closed:
+            raise RuntimeError('{!r} already closed'.format(self))
+        token = LocalToken(self.injector_class())
+        ref = weakref.ref(token, self.release)
+        with self.lock:
+            self.injectors[ref] = token.injector
+        if contextvars is not None:
+            self.storage.set(token)
+        else:
+            self.storage.value = token
+        return token.injector
+
+    def release(self, ref):
+        """Close the injector of a context which no longer exists."""
+        with self.lock:
+            injector = self.injectors.pop(ref, None)
+        if injector is not None and not injector.closed:
+            injector.close()
+
+    def close(self):
+        """Close all open local injectors, then the parent injector."""
+        if self.closed:
+            raise RuntimeError('{!r} already closed'.format(self))
+        self.closed = True
+        with self.lock:
+            refs = list(self.injectors)
+        for ref in refs:
+            self.release(ref)
+        self.parent.close()
+
+    def __enter__(self):
+        """Support for context manager, returning self."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Support for context manager, close on exit."""
+        self.close()
+
+
+class LocalToken(object):
+    """Hold an injector in thread-local or context-local storage.
+
+    When the token is garbage collected, `InjectorLocal` closes its injector.
+    """
+    __slots__ = ('injector', '__weakref__')
+
+    def __init__(self, injector):
+        self.injector = injector
+
+
+class PipelineError(object):
+    """Carry an error through `Pipeline` queues to the consuming thread."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+PIPELINE_DONE = object() # sentinel for end of items in a pipeline
+
+
+class Pipeline(object):
+    """Stream items through stages of callables, injecting each stage once.
+
+    Each stage is an annotated callable (or not, in which case it is called
+    as-is) taking an item as its last positional argument and returning the
+    item for the next stage. Injections for all stages are resolved once, in
+    the thread calling `run`, before any item is processed.
+
+    When `threaded`, each stage runs in its own worker threads (one by
+    default, or as given in a ``(callable, workers)`` stage tuple), and items
+    flow between stages through queues bounded by `maxsize`, such that a slow
+    stage blocks the stages feeding it. Results are in order of the input
+    only if every stage has a single worker. Otherwise, stages are chained
+    generators applied lazily in the thread consuming the results.
+
+    When the results are drained, or the pipeline is cancelled (including by
+    an error in a stage or by closing the results generator early), worker
+    threads are stopped, then the injector is closed if `close` is true,
+    running its provider finalizers. Pass ``close=True`` only if the
+    injector is not used outside of the pipeline. A pipeline runs once;
+    create another to run it again.
+    """
+
+    #: Seconds to wait on a queue before checking for cancellation.
+    poll_interval = 0.05
+
+    def __init__(self, injector, stages, maxsize=16, threaded=True,
+                 close=False):
+        self.injector = injector
+        self.stages = []
+        for stage in stages:
+            if isinstance(stage, tuple):
+                fn, workers = stage
+            else:
+                fn, workers = stage, 1
+            if workers < 1:
+                msg = 'stage needs at least 1 worker: {!r}'
+                raise ValueError(msg.format(fn))
+            self.stages.append((fn, workers))
+        self.maxsize = maxsize
+        self.threaded = threaded
+        self.close_injector = close
+        self.cancelled = threading.Event()
+        self.started = False
+        self.threads = []
+
+    def prepare(self):
+        """Bind each stage to its injections, returning list of callables."""
+        prepared = []
+        for fn, _ in self.stages:
+            if self.injector.has_annotations(fn):
+                args, kwargs = self.injector.prepare_callable(fn)
+                fn = functools.partial(fn, *args, **kwargs)
+            prepared.append(fn)
+        return prepared
+
+    def run(self, iterable):
+        """Generate results of feeding each item of iterable through stages.
+
+        Raise `RuntimeError` if the pipeline already ran or was cancelled.
+        """
+        if self.started or self.cancelled.is_set():
+            raise RuntimeError('{!r} already ran'.format(self))
+        self.started = True
+        return self.run_stages(iterable)
+
+    def run_stages(self, iterable):
+        """Implementation of `run`, cancelling when done."""
+        try:
+            functions = self.prepare()
+            if self.threaded:
+                results = self.run_threads(functions, iterable)
+            else:
+                results = self.run_generators(functions, iterable)
+            for result in results:
+                yield result
+        finally:
+            self.cancel()
+
+    def run_generators(self, functions, iterable):
+        """Chain stages as lazy maps, in the thread consuming results."""
+        for fn in functions:
+            iterable = six.moves.map(fn, iterable)
+        return iterable
+
+    def run_threads(self, functions, iterable):
+        """Start worker threads for each stage, then generate results."""
+        queues = [six.moves.queue.Queue(self.maxsize)
+                  for _ in range(len(functions) + 1)]
+        self.start(self.feed, iterable, queues[0])
+        for i, fn in enumerate(functions):
+            workers = self.stages[i][1]
+            remaining = [workers] # workers of this stage still running
+            lock = threading.Lock()
+            for _ in range(workers):
+                self.start(self.work, fn, queues[i], queues[i + 1],
+                           remaining, lock)
+        while True:
+            item = self.get(queues[-1])
+            if item is PIPELINE_DONE or item is MISSING:
+                return
+            if isinstance(item, PipelineError):
+                six.reraise(*item.exc_info)
+            yield item
+
+    def start(self, target, *args):
+        """Start a daemon thread, to be joined on `cancel`."""
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+
+    def feed(self, iterable, queue):
+        """Put each item of iterable on the queue of the first stage."""
+        try:
+            for item in iterable:
+                if not self.put(queue, item):
+                    return
+        except Exception:
+            self.put(queue, PipelineError(sys.exc_info()))
+        self.put(queue, PIPELINE_DONE)
+
+    def work(self, fn, inbox, outbox, remaining, lock):
+        """Apply stage to items from inbox, putting results on outbox."""
+        while True:
+            item = self.get(inbox)
+            if item is MISSING:
+                return
+            if item is PIPELINE_DONE:
+                # Let sibling workers see the end, and the last one forward it.
+                self.put(inbox, PIPELINE_DONE)
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self.put(outbox, PIPELINE_DONE)
+                return
+            if not isinstance(item, PipelineError):
+                try:
+                    item = fn(item)
+                except Exception:
+                    item = PipelineError(sys.exc_info())
+            if not self.put(outbox, item):
+                return
+
+    def put(self, queue, item):
+        """Put item on queue, blocking until space; False if cancelled."""
+        while not self.cancelled.is_set():
+            try:
+                queue.put(item, timeout=self.poll_interval)
+                return True
+            except six.moves.queue.Full:
+                continue
+        return False
+
+    def get(self, queue):
+        """Get item from queue, blocking; `MISSING` if cancelled."""
+        while not self.cancelled.is_set():
+            try:
+                return queue.get(timeout=self.poll_interval)
+            except six.moves.queue.Empty:
+                continue
+        return MISSING
+
+    def cancel(self):
+        """Stop all stages, then close the injector if configured to."""
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        if self.close_injector and not self.injector.closed:
+            self.injector.close()
+
+
+class ProcessScope(object):
+    """Publish values of designated notes once, for all worker processes.
+
+    Values of notes listed in `shared` are provided by a single parent
+    injector in the coordinating process, then copied into
+    ``multiprocessing.shared_memory`` segments (Python 3.8+). Values must
+    support the buffer protocol and be contiguous, e.g. bytes, `array.array`
+    or NumPy arrays. Pass the scope to `Injector.worker_pool`, such that the
+    injector of each worker gets a read-only `memoryview` of the shared
+    segment, without copying it and without calling the provider::
+
+        with ProcessScope(Injector, shared=['model']) as scope:
+            with Injector.worker_pool(max_workers=4, scope=scope) as pool:
+                results = injector.map(predict, records, executor=pool)
+
+    Views keep the format and shape of the value, e.g. use
+    ``numpy.asarray(model)`` for an array. Only segment names and layout are
+    pickled to workers. Use `attach` for injectors created otherwise.
+
+    Call `close` when workers are done, to close the parent injector and
+    unlink the segments. Segments are not unlinked from a worker.
+    """
+
+    def __init__(self, injector_class, shared=(), parent=None):
+        from multiprocessing import shared_memory
+        if parent is None:
+            parent = injector_class()
+        self.parent = parent
+        self.closed = False
+
+        #: Map of basenote -> (segment name, nbytes, format, shape).
+        self.segments = collections.OrderedDict()
+
+        #: Segments created or attached by this process.
+        self.handles = []
+
+        try:
+            for note in shared:
+                basenote, _ = parent.parse_note(note)
+                value = parent.get(basenote)
+                try:
+                    view = memoryview(value)
+                except TypeError:
+                    msg = 'value of {!r} does not support the buffer protocol'
+                    raise TypeError(msg.format(note))
+                if not view.c_contiguous:
+                    raise ValueError(
+                        'value of {!r} is not contiguous'.format(note))
+                segment = shared_memory.SharedMemory(
+                    create=True, size=max(view.nbytes, 1))
+                self.handles.append(segment)
+                segment.buf[:view.nbytes] = view.cast('B')
+                self.segments[basenote] = (
+                    segment.name, view.nbytes, view.format, view.shape)
+                view.release()
+        except Exception:
+            self.close()
+            raise
+
+    def __getstate__(self):
+        return {'segments': self.segments}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.parent = None
+        self.closed = False
+        self.handles = []
+
+    def attach(self, injector):
+        """Set shared values on injector, mapping segments as needed."""
+        from multiprocessing import shared_memory
+        if not self.handles:
+            for name, _, _, _ in self.segments.values():
+                self.handles.append(shared_memory.SharedMemory(name=name))
+        for segment, basenote in zip(self.handles, self.segments):
+            _, nbytes, fmt, shape = self.segments[basenote]
+            # Release intermediate views, so only the read-only view holds
+            # the buffer of the segment.
+            with segment.buf[:nbytes] as view:
+                if fmt != 'B' or len(shape) != 1:
+                    try:
+                        with view.cast(fmt, shape) as cast:
+                            readonly = cast.toreadonly()
+                    except (TypeError, ValueError):
+                        # Format not supported by memoryview, keep bytes.
+                        readonly = view.toreadonly()
+                else:
+                    readonly = view.toreadonly()
+            injector.values[basenote] = readonly
+
+    def detach(self):
+        """Unmap segments in this process, if no views are still in use."""
+        handles, self.handles = self.handles, []
+        for segment in handles:
+            try:
+                segment.close()
+            except BufferError:
+                pass # Unmapped on process exit instead.
+
+    def close(self):
+        """Close the parent injector, then unlink shared segments."""
+        if self.parent is None:
+            raise RuntimeError('{!r} is attached, not published'.format(self))
+        if self.closed:
+            raise RuntimeError('{!r} already closed'.format(self))
+        self.closed = True
+        handles = list(self.handles)
+        self.detach()
+        for segment in handles:
+            segment.unlink()
+        self.parent.close()
+
+    def __enter__(self):
+        """Support for context manager, returning self."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Support for context manager, close on exit."""
+        self.close()
+
+
+#: Injector per class in a worker process, see `Injector.map`.
+#: Injector class -> (injector, dict of callable -> prepared arguments).
+worker_injectors = {}
+
+#: `ProcessScope` per class attached in a worker process.
+worker_scopes = {}
+
+
+def init_worker(injector_class, scope=None):
+    """Create injector of given class in a worker process, close on exit.
+
+    With a `ProcessScope`, shared values are attached to the injector.
+    """
+    import multiprocessing.util
+    injector = injector_class()
+    if scope is not None:
+        scope.attach(injector)
+        worker_scopes[injector_class] = scope
+    worker_injectors[injector_class] = (injector, {})
+    # Finalizers with an exit priority run when a pool worker process exits.
+    multiprocessing.util.Finalize(
+        None, close_worker, args=(injector_class,), exitpriority=10)
+    return injector
+
+
+def close_worker(injector_class):
+    """Close injector of given class in a worker process, if any."""
+    injector, prepared = worker_injectors.pop(injector_class, (None, None))
+    if injector is not None and not injector.closed:
+        injector.close()
+    if prepared:
+        # Prepared arguments hold shared views, see `ProcessScope.detach`.
+        prepared.clear()
+    scope = worker_scopes.pop(injector_class, None)
+    if scope is not None:
+        scope.detach()
+
+
+def apply_in_worker(injector_class, fn, *a):
+    """Apply annotated callable with the injector of a worker process."""
+    if injector_class not in worker_injectors:
+        init_worker(injector_class)
+    injector, prepared = worker_injectors[injector_class]
+    if fn not in prepared:
+        prepared[fn] = injector.prepare_callable(fn)
+    args, kwargs = prepared[fn]
+    return fn(*(args + a), **kwargs)
 
 
 def class_in_progress(stack=None):
@@ -56,6 +56,6 @@ setup(
     long_description=long_description,
     py_modules=['jeni'],
     install_requires=[
-        'six',
+        'six>=1.13',
     ],
     classifiers=CLASSIFIERS)
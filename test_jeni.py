@@ -1,9 +1,20 @@
+import collections
 from collections import OrderedDict as odict
 from decimal import Decimal
 from fractions import Fraction
+import gc
+import itertools
+import os
+import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
 import unittest
 
+from six.moves import socketserver
+
 import jeni
 
 
@@ -1185,4 +1196,2277 @@ class TestClassInProgress(unittest.TestCase):
         self.assertFalse(jeni.class_in_progress(stack=stack))
 
 
+class SealTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(BasicInjector):
+            pass
+
+        @Injector.factory('spam_eggs')
+        @jeni.annotate('spam', 'eggs', hello=jeni.maybe('nothing'))
+        def spam_eggs(spam, eggs, hello=None):
+            return spam + eggs
+
+        self.Injector = Injector
+
+    def test_seal(self):
+        self.Injector.seal()
+        self.assertTrue(self.Injector.is_sealed())
+        self.assertFalse(BasicInjector.is_sealed())
+        injector = self.Injector()
+        self.assertEqual('spameggs!', injector.get('spam_eggs'))
+        self.assertEqual('Hello, thing!', injector.get('hello:thing'))
+        self.assertEqual(1, injector.stats['spam_eggs'])
+        self.assertRaises(LookupError, injector.get, 'nothing')
+
+    def test_register_after_seal(self):
+        self.Injector.seal()
+        self.assertRaises(
+            RuntimeError, self.Injector.value, 'zero', 1)
+        self.assertRaises(RuntimeError, self.Injector.seal)
+
+    def test_frozen_dispatch_table(self):
+        class Base(jeni.Injector):
+            pass
+        class Sealed(Base):
+            pass
+        Sealed.seal()
+        # Registering on a base class does not alter the sealed class.
+        Base.value('late', 'late')
+        self.assertEqual('late', Base().get('late'))
+        self.assertRaises(LookupError, Sealed().get, 'late')
+
+    def test_subclass_not_sealed(self):
+        self.Injector.seal()
+        injector = self.Injector.sub(zero=1)
+        self.assertFalse(type(injector).is_sealed())
+        self.assertEqual(1, injector.get('zero'))
+
+    def test_no_stats(self):
+        self.Injector.seal(stats=False)
+        injector = self.Injector()
+        injector.get('spam_eggs')
+        self.assertEqual({}, injector.stats)
+        self.assertTrue(BasicInjector.record_stats)
+
+    def test_unresolvable(self):
+        @self.Injector.factory('broken')
+        @jeni.annotate('nothing')
+        def broken(nothing):
+            "unused"
+        with self.assertRaises(LookupError) as raises:
+            self.Injector.seal()
+        self.assertIn('broken', str(raises.exception))
+        self.assertFalse(self.Injector.is_sealed())
+
+    def test_unresolvable_partial(self):
+        @jeni.annotate('nothing')
+        def needs_nothing(nothing):
+            "unused"
+        @self.Injector.factory('broken')
+        @jeni.annotate(jeni.partial(needs_nothing))
+        def broken(fn):
+            "unused"
+        self.assertRaises(LookupError, self.Injector.seal)
+
+    def test_cycle(self):
+        class Injector(jeni.Injector):
+            pass
+
+        @Injector.provider('one')
+        class OneProvider(jeni.Provider):
+            @jeni.annotate('two')
+            def __init__(self, two):
+                "unused"
+            def get(self, name=None):
+                "unused"
+
+        @Injector.factory('two')
+        @jeni.annotate(one=jeni.maybe('one'))
+        def two(one=None):
+            "unused"
+
+        with self.assertRaises(jeni.DependencyCycleError) as raises:
+            Injector.seal()
+        self.assertEqual(3, len(raises.exception.notes))
+        self.assertEqual(
+            raises.exception.notes[0], raises.exception.notes[-1])
+
+    def test_optional_get_keyword(self):
+        @self.Injector.provider('extra')
+        class ExtraProvider(jeni.Provider):
+            @jeni.annotate(extra='nothing')
+            def get(self, name=None, extra=None):
+                return extra
+
+        # Keyword notes of get are optional, as get is applied as a partial.
+        self.assertIsNone(self.Injector().get('extra'))
+        self.Injector.seal()
+        self.assertIsNone(self.Injector().get('extra'))
+
+
+class CompactInjectorTestCase(unittest.TestCase):
+    def test_no_dict(self):
+        injector = jeni.Injector()
+        self.assertFalse(hasattr(injector, '__dict__'))
+        self.assertIs(jeni.annotate, injector.annotator)
+
+    def test_subclass_attributes(self):
+        class Injector(BasicInjector):
+            def __init__(self, config):
+                self.config = config
+                super(Injector, self).__init__()
+        injector = Injector({'debug': True})
+        self.assertEqual({'debug': True}, injector.config)
+        self.assertEqual('eggs!', injector.get('eggs'))
+
+    def test_custom_annotator(self):
+        class Annotator(jeni.Annotator):
+            pass
+        class Injector(jeni.Injector):
+            annotator_class = Annotator
+        self.assertIsInstance(Injector().annotator, Annotator)
+        self.assertIs(Injector().annotator, Injector().annotator)
+
+    def test_assign_annotator(self):
+        class Injector(BasicInjector):
+            def __init__(self):
+                super(Injector, self).__init__()
+                self.annotator = jeni.Annotator()
+        injector = Injector()
+        self.assertIsNot(jeni.annotate, injector.annotator)
+        self.assertEqual('eggs!', injector.get('eggs'))
+
+    def test_lazy_containers(self):
+        injector = BasicInjector()
+        self.assertEqual([], injector.finalizers)
+        self.assertEqual([], injector.instantiating)
+        injector.get('answer')
+        self.assertEqual(1, len(injector.finalizers))
+        self.assertEqual(1, injector.stats['answer'])
+        injector.close()
+
+    def test_instantiating_not_stored(self):
+        for _ in range(100):
+            self.assertEqual([], BasicInjector().instantiating)
+        self.assertFalse(getattr(jeni.instantiating_local, 'stacks', None))
+
+
+class Blob(object):
+    "Weakly referenceable value."
+
+    def __init__(self, size=0):
+        self.data = 'x' * size
+
+
+class CachePolicyTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            lru_maxcount = 2
+
+        self.calls = calls = []
+
+        def factory(note, cache):
+            @Injector.factory(note, cache=cache)
+            def blob():
+                calls.append(note)
+                return Blob()
+
+        factory('always', 'always')
+        factory('transient', 'transient')
+        factory('weak', 'weak')
+        for note in ('lru1', 'lru2', 'lru3'):
+            factory(note, 'lru')
+
+        @Injector.factory('weak_dict', cache='weak')
+        def weak_dict():
+            calls.append('weak_dict')
+            return {}
+
+        self.Injector = Injector
+        self.injector = Injector()
+
+    def test_always(self):
+        blob = self.injector.get('always')
+        self.assertIs(blob, self.injector.get('always'))
+        self.assertEqual(['always'], self.calls)
+        self.assertIs(blob, self.injector.values['always'])
+
+    def test_transient(self):
+        self.assertIsNot(
+            self.injector.get('transient'), self.injector.get('transient'))
+        self.assertEqual(['transient', 'transient'], self.calls)
+        self.assertNotIn('transient', self.injector.values)
+        self.assertEqual(
+            2, self.injector.cache_stats[('transient', 'transient', 'miss')])
+
+    def test_weak(self):
+        blob = self.injector.get('weak')
+        self.assertIs(blob, self.injector.get('weak'))
+        self.assertEqual(['weak'], self.calls)
+        del blob
+        self.injector.get('weak')
+        self.assertEqual(['weak', 'weak'], self.calls)
+        self.assertEqual(
+            {('weak', 'weak', 'miss'): 2, ('weak', 'weak', 'hit'): 1},
+            self.injector.cache_stats)
+
+    def test_weak_unsupported(self):
+        self.injector.get('weak_dict')
+        self.injector.get('weak_dict')
+        self.assertEqual(['weak_dict', 'weak_dict'], self.calls)
+        self.assertEqual(
+            2, self.injector.cache_stats[('weak_dict', 'weak', 'skip')])
+
+    def test_lru_count(self):
+        lru1 = self.injector.get('lru1')
+        self.injector.get('lru2')
+        self.assertIs(lru1, self.injector.get('lru1'))
+        self.injector.get('lru3') # Evicts lru2, the least recently used.
+        self.assertIs(lru1, self.injector.get('lru1'))
+        self.injector.get('lru2')
+        self.assertEqual(['lru1', 'lru2', 'lru3', 'lru2'], self.calls)
+        self.assertEqual(
+            1, self.injector.cache_stats[('lru2', 'lru', 'evict')])
+
+    def test_lru_bytes(self):
+        class Injector(self.Injector):
+            lru_maxcount = None
+            lru_maxbytes = 100
+            lru_sizeof = staticmethod(lambda blob: len(blob.data))
+
+        @Injector.factory('big', cache='lru')
+        def big():
+            self.calls.append('big')
+            return Blob(size=60)
+
+        injector = Injector()
+        injector.get('big')
+        injector.get('big')
+        self.assertEqual(['big'], self.calls)
+        injector.get('lru1') # Size 0 fits with 'big'.
+        self.assertEqual(0, injector.cache_stats[('big', 'lru', 'evict')])
+
+        Injector.lru_maxbytes = 50
+        injector = Injector()
+        injector.get('big')
+        injector.get('big')
+        self.assertEqual(['big', 'lru1', 'big', 'big'], self.calls)
+        self.assertEqual(2, injector.cache_stats[('big', 'lru', 'skip')])
+
+    def test_override_policy(self):
+        class Injector(self.Injector):
+            pass
+        Injector.factory('transient', Blob)
+        injector = Injector()
+        self.assertIs(injector.get('transient'), injector.get('transient'))
+        self.assertEqual('always', Injector.lookup_cache('transient'))
+        self.assertEqual('transient', self.Injector.lookup_cache('transient'))
+
+    def test_register_after_lookup(self):
+        class Injector(self.Injector):
+            pass
+        injector = Injector()
+        self.assertIsNot(injector.get('transient'), injector.get('transient'))
+        self.Injector.factory('transient', Blob)
+        self.assertEqual('always', Injector.lookup_cache('transient'))
+        injector = Injector()
+        self.assertIs(injector.get('transient'), injector.get('transient'))
+
+    def test_sealed(self):
+        self.Injector.seal()
+        self.assertEqual('lru', self.Injector.lookup_cache('lru1'))
+        self.assertEqual('always', self.Injector.lookup_cache('injector'))
+
+    def test_unknown_policy(self):
+        self.assertRaises(
+            ValueError, self.Injector.factory, 'bogus', Blob, cache='bogus')
+
+    def test_close(self):
+        self.injector.get('lru1')
+        self.injector.get('weak')
+        self.injector.close()
+        self.assertEqual(0, len(self.injector._lru_values))
+        self.assertEqual({}, self.injector._weak_values)
+
+
+class LRUValuesTestCase(unittest.TestCase):
+    def test_count(self):
+        values = jeni.LRUValues(maxcount=2)
+        self.assertEqual([], values.put('a', 1))
+        self.assertEqual([], values.put('b', 2))
+        self.assertEqual(1, values.get('a'))
+        self.assertEqual(['b'], values.put('c', 3))
+        self.assertEqual(None, values.get('b'))
+        self.assertEqual(2, len(values))
+
+    def test_bytes(self):
+        values = jeni.LRUValues(maxbytes=10, sizeof=len)
+        self.assertEqual([], values.put('a', 'x' * 6))
+        self.assertEqual([], values.put('a', 'x' * 6)) # Replace.
+        self.assertEqual(['a'], values.put('b', 'x' * 6))
+        self.assertEqual(['c'], values.put('c', 'x' * 11))
+        self.assertIn('b', values)
+        self.assertNotIn('c', values)
+        self.assertEqual(6, values.nbytes)
+        values.clear()
+        self.assertEqual(0, values.nbytes)
+
+
+class UnresolvableNotesTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(BasicInjector):
+            pass
+
+        @jeni.annotate('hello', extra=jeni.maybe('extra'))
+        def fn(hello, extra=None):
+            return hello, extra
+
+        self.Injector = Injector
+        self.fn = fn
+
+    def test_maybe(self):
+        injector = self.Injector()
+        self.assertEqual(('Hello, world!', None), injector.apply(self.fn))
+        self.assertEqual({'extra'}, self.Injector.unresolvable_notes())
+        self.assertEqual(('Hello, world!', None), injector.apply(self.fn))
+        self.assertEqual(1, injector.stats['extra'])
+
+    def test_partial_keyword(self):
+        @jeni.annotate(extra='extra')
+        def fn(extra=None):
+            return extra
+        injector = self.Injector()
+        self.assertEqual(None, injector.partial(fn)())
+        self.assertEqual(None, injector.partial(fn)())
+        self.assertEqual(1, injector.stats['extra'])
+
+    def test_register_invalidates(self):
+        injector = self.Injector()
+        injector.apply(self.fn)
+        self.assertIn('extra', self.Injector.unresolvable_notes())
+        self.Injector.value('extra', 'extra!')
+        self.assertEqual(set(), self.Injector.unresolvable_notes())
+        self.assertEqual(('Hello, world!', 'extra!'), injector.apply(self.fn))
+
+    def test_base_register_invalidates(self):
+        class Base(jeni.Injector):
+            pass
+        class Injector(Base):
+            pass
+        injector = Injector()
+        self.assertRaises(LookupError, injector.get, 'extra')
+        self.assertIn('extra', Injector.unresolvable_notes())
+        Base.value('extra', 'extra!')
+        self.assertNotIn('extra', Injector.unresolvable_notes())
+        self.assertEqual('extra!', injector.get('extra'))
+
+    def test_basenotes(self):
+        @jeni.annotate(extra=jeni.maybe('extra:one'))
+        def fn(extra=None):
+            return extra
+        injector = self.Injector()
+        for i in range(10):
+            self.assertFalse(injector.has('feature:{}'.format(i)))
+        self.assertEqual({'feature'}, self.Injector.unresolvable_notes())
+        self.assertEqual(None, injector.apply(fn))
+        self.assertEqual(None, injector.apply(fn))
+        self.assertEqual(1, injector.stats['extra:one'])
+        self.assertEqual({'feature', 'extra'},
+                         self.Injector.unresolvable_notes())
+
+    def test_unset_not_cached(self):
+        @jeni.annotate(error=jeni.maybe('error'))
+        def fn(error=None):
+            return error
+        injector = self.Injector()
+        injector.apply(fn)
+        injector.apply(fn)
+        self.assertEqual(2, injector.stats['error'])
+        self.assertNotIn('error', self.Injector.unresolvable_notes())
+
+
+class OptionalResolutionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.injector = BasicInjector()
+
+    def test_get_or(self):
+        self.assertEqual('eggs!', self.injector.get_or('eggs'))
+        self.assertEqual('Hello, x!', self.injector.get_or('hello:x', 'no'))
+        self.assertEqual(None, self.injector.get_or('nothing'))
+        self.assertEqual('no', self.injector.get_or('nothing', 'no'))
+        self.assertEqual('no', self.injector.get_or('error', 'no'))
+        self.assertEqual(2, self.injector.stats['nothing'])
+
+    def test_has(self):
+        self.assertTrue(self.injector.has('eggs'))
+        self.assertTrue(self.injector.has('injector'))
+        self.assertFalse(self.injector.has('nothing'))
+        self.assertFalse(self.injector.has('error'))
+
+    def test_falsy_value(self):
+        self.assertTrue(self.injector.has('zero'))
+        self.assertEqual(0, self.injector.get_or('zero', 'no'))
+
+    def test_dependency_error(self):
+        class Injector(BasicInjector):
+            pass
+        @Injector.factory('needs_nothing')
+        @jeni.annotate('nothing')
+        def needs_nothing(nothing):
+            "unused"
+        injector = Injector()
+        self.assertRaises(LookupError, injector.get_or, 'needs_nothing')
+        @jeni.annotate(value=jeni.maybe('needs_nothing'))
+        def fn(value='default'):
+            return value
+        self.assertEqual('default', injector.apply(fn))
+
+    def test_no_exception(self):
+        class Injector(jeni.Injector):
+            def handle_provider(self, *a, **kw):
+                try:
+                    return super(Injector, self).handle_provider(*a, **kw)
+                except LookupError:
+                    raise AssertionError('raised LookupError')
+        Injector.factory('error', error)
+        injector = Injector()
+        self.assertEqual('no', injector.get_or('error', 'no'))
+        self.assertRaises(AssertionError, injector.get, 'error')
+
+    def test_closed(self):
+        self.injector.close()
+        self.assertRaises(RuntimeError, self.injector.get_or, 'eggs')
+
+
+class InjectorLocalTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            pass
+
+        self.opened = opened = []
+
+        @Injector.factory('app')
+        def app():
+            opened.append('app')
+            return CloseMe('app')
+
+        @Injector.provider('request')
+        def request():
+            thing = CloseMe('request')
+            thing.open()
+            opened.append(thing)
+            yield thing
+            thing.close()
+
+        Injector.factory('echo', echo)
+
+        self.local = jeni.InjectorLocal(Injector, shared=['app', 'echo'])
+
+    def run_threads(self, target, count=4):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_per_thread(self):
+        results = []
+        def target():
+            injector = self.local.injector
+            self.assertIs(injector, self.local.injector)
+            results.append((
+                injector, injector.get('app'), injector.get('request'),
+                injector.get('echo:name')))
+        self.run_threads(target)
+        gc.collect()
+
+        self.assertEqual(4, len(set(id(r[0]) for r in results)))
+        self.assertEqual(1, len(set(id(r[1]) for r in results)))
+        self.assertEqual(4, len(set(id(r[2]) for r in results)))
+        self.assertEqual(['name'] * 4, [r[3] for r in results])
+        self.assertEqual(['app'], [x for x in self.opened if x == 'app'])
+
+        # Thread injectors are closed on thread exit.
+        self.assertTrue(all(r[0].closed for r in results))
+        self.assertTrue(all(r[2].closed for r in results))
+        self.assertEqual({}, self.local.injectors)
+        self.assertFalse(self.local.parent.closed)
+
+    def test_close(self):
+        injector = self.local.injector
+        thing = injector.get('request')
+        self.assertIs(self.local.parent.get('app'), injector.get('app'))
+        self.local.close()
+        self.assertTrue(injector.closed)
+        self.assertTrue(thing.closed)
+        self.assertTrue(self.local.parent.closed)
+        self.assertRaises(RuntimeError, self.local.close)
+
+    def test_closed(self):
+        with self.local:
+            pass
+        def target():
+            self.assertRaises(RuntimeError, lambda: self.local.injector)
+        self.run_threads(target, count=1)
+
+    def test_non_string_note(self):
+        note = object()
+        class Injector(jeni.Injector):
+            pass
+        Injector.provider(note, HelloProvider)
+        with jeni.InjectorLocal(Injector, shared=[note]) as local:
+            self.assertEqual('Hello, x!', local.injector.get((note, 'x')))
+            self.assertIn(note, local.parent.instances)
+
+
+class MapTestCase(unittest.TestCase):
+    def test_map(self):
+        calls = []
+        class Injector(BasicInjector):
+            def prepare_callable(self, fn, partial=False):
+                calls.append(fn)
+                return super(Injector, self).prepare_callable(fn, partial)
+        @jeni.annotate('eggs')
+        def fn(eggs, a, b):
+            return eggs, a + b
+        injector = Injector()
+        results = injector.map(fn, [1, 2, 3], [10, 20, 30])
+        self.assertEqual(
+            [('eggs!', 11), ('eggs!', 22), ('eggs!', 33)], list(results))
+        self.assertEqual(1, calls.count(fn))
+
+    def test_bad_keyword(self):
+        injector = BasicInjector()
+        self.assertRaises(TypeError, injector.map, len, [], bogus=True)
+
+    def test_apply_in_worker(self):
+        @jeni.annotate('eggs')
+        def fn(eggs, a):
+            return eggs * a
+        self.assertEqual('eggs!', jeni.apply_in_worker(BasicInjector, fn, 1))
+        injector, prepared = jeni.worker_injectors[BasicInjector]
+        self.assertIn(fn, prepared)
+        jeni.close_worker(BasicInjector)
+        self.assertTrue(injector.closed)
+        self.assertNotIn(BasicInjector, jeni.worker_injectors)
+
+
+class ApplyManyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = calls = []
+        class Injector(BasicInjector):
+            pass
+        @Injector.factory('counted')
+        def counted():
+            calls.append('counted')
+            return 'counted'
+        @jeni.annotate('eggs', counted=jeni.maybe('counted'))
+        def fn(eggs, *a, **kw):
+            return (eggs,) + a + (kw['counted'],)
+        self.injector = Injector()
+        self.fn = fn
+
+    def test_star(self):
+        results = self.injector.apply_many(self.fn, [(1, 2), [3], ()])
+        self.assertEqual([], self.calls) # Lazy until iterated.
+        self.assertEqual([
+            ('eggs!', 1, 2, 'counted'),
+            ('eggs!', 3, 'counted'),
+            ('eggs!', 'counted'),
+        ], list(results))
+        self.assertEqual(['counted'], self.calls)
+        self.assertEqual(1, self.injector.stats['eggs'])
+
+    def test_no_star(self):
+        results = self.injector.apply_many(self.fn, [(1, 2), 3], star=False)
+        self.assertEqual([
+            ('eggs!', (1, 2), 'counted'),
+            ('eggs!', 3, 'counted'),
+        ], list(results))
+
+    def test_chunks(self):
+        results = self.injector.apply_many(
+            self.fn, range(5), star=False, chunksize=2)
+        self.assertEqual(
+            [[0, 1], [2, 3], [4]], [[r[1] for r in c] for c in results])
+        results = self.injector.apply_many(self.fn, [], chunksize=2)
+        self.assertEqual([], list(results))
+        self.assertRaises(
+            ValueError, self.injector.apply_many, self.fn, [], chunksize=0)
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.injector = CloseTestInjector()
+
+        @jeni.annotate('via_class')
+        def tag(thing, item):
+            return (thing.note, item)
+        self.tag = tag
+
+        @jeni.annotate('echo:!')
+        def shout(bang, item):
+            return item[1] + bang
+        self.shout = shout
+
+    def test_threaded(self):
+        pipeline = self.injector.pipeline(self.tag, self.shout, maxsize=2)
+        self.assertEqual(
+            ['a!', 'b!', 'c!'], list(pipeline.run(['a', 'b', 'c'])))
+        self.assertFalse(self.injector.closed)
+        self.assertTrue(all(not t.is_alive() for t in pipeline.threads))
+        self.assertEqual(1, self.injector.stats['via_class'])
+
+    def test_generators(self):
+        pipeline = self.injector.pipeline(
+            self.tag, self.shout, str.upper, threaded=False, close=True)
+        self.assertEqual(['A!', 'B!'], list(pipeline.run('ab')))
+        self.assertTrue(self.injector.closed)
+
+    def test_workers(self):
+        pipeline = self.injector.pipeline(
+            (self.tag, 3), (self.shout, 2), maxsize=1)
+        items = [str(x) for x in range(50)]
+        results = list(pipeline.run(items))
+        self.assertEqual(sorted(x + '!' for x in items), sorted(results))
+        self.assertFalse(self.injector.closed)
+
+    def test_cancel(self):
+        thing = self.injector.get('via_class')
+        pipeline = self.injector.pipeline(self.tag, maxsize=1, close=True)
+        results = pipeline.run(itertools.count())
+        self.assertEqual(('via_class', 0), next(results))
+        results.close()
+        self.assertTrue(pipeline.cancelled.is_set())
+        self.assertTrue(all(not t.is_alive() for t in pipeline.threads))
+        self.assertTrue(thing.closed)
+
+    def test_error(self):
+        def fail(item):
+            if item == 2:
+                raise ValueError(item)
+            return item
+        pipeline = self.injector.pipeline(fail, (str, 2), close=True)
+        results = pipeline.run(range(5))
+        self.assertEqual('0', next(results))
+        self.assertRaises(ValueError, list, results)
+        self.assertTrue(self.injector.closed)
+
+    def test_source_error(self):
+        def source():
+            yield 1
+            raise KeyError('source')
+        pipeline = self.injector.pipeline(str)
+        self.assertRaises(KeyError, list, pipeline.run(source()))
+
+    def test_prepare_error(self):
+        @jeni.annotate('nothing')
+        def missing(nothing, item):
+            return item
+        pipeline = self.injector.pipeline(self.tag, missing)
+        self.assertRaises(LookupError, list, pipeline.run('ab'))
+        # The injector is not closed by default, and remains usable.
+        self.assertFalse(self.injector.closed)
+        self.assertEqual('via_class', self.injector.get('via_class').note)
+
+    def test_no_workers(self):
+        self.assertRaises(ValueError, self.injector.pipeline, (str, 0))
+
+    def test_run_once(self):
+        for threaded in (True, False):
+            pipeline = self.injector.pipeline(str, threaded=threaded)
+            self.assertEqual(['1'], list(pipeline.run([1])))
+            self.assertRaises(RuntimeError, pipeline.run, [2])
+        pipeline = self.injector.pipeline(str)
+        pipeline.cancel()
+        self.assertRaises(RuntimeError, pipeline.run, [1])
+
+
+class ParallelCloseTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            pass
+
+        self.log = log = []
+        self.events = events = collections.defaultdict(threading.Event)
+
+        def closing(note, dependency=None, wait_for=None, error=None):
+            class ClosingProvider(jeni.Provider):
+                def __init__(self, dependency=None):
+                    self.dependency = dependency
+                def get(self, name=None):
+                    return note
+                def close(self):
+                    events[note + ' started'].set()
+                    if wait_for is not None:
+                        if not events[wait_for + ' started'].wait(5):
+                            log.append('timeout')
+                    log.append(note)
+                    if error is not None:
+                        raise error
+            if dependency is not None:
+                jeni.annotate(dependency)(ClosingProvider.__init__)
+            Injector.provider(note, ClosingProvider)
+
+        closing('db')
+        closing('cache', wait_for='app', error=ValueError('cache'))
+        closing('app', dependency='db', wait_for='cache')
+
+        @Injector.factory('service')
+        @jeni.annotate('app', 'cache')
+        def service(app, cache):
+            return app, cache
+
+        self.Injector = Injector
+        self.closing = closing
+
+    def test_dependencies(self):
+        injector = self.Injector()
+        injector.get('service')
+        self.assertEqual({
+            'service': set(['app', 'cache']),
+            'app': set(['db']),
+        }, injector.dependencies)
+
+    def test_parallel(self):
+        injector = self.Injector()
+        injector.get('service')
+        with self.assertRaises(jeni.CloseError) as raises:
+            injector.close(parallel=True, timeout=5)
+        # 'app' & 'cache' wait on each other, so must run concurrently.
+        self.assertEqual(set(['app', 'cache', 'db']), set(self.log))
+        self.assertLess(self.log.index('app'), self.log.index('db'))
+        self.assertTrue(injector.closed)
+        [(finalizer, error)] = raises.exception.errors
+        self.assertEqual('cache', str(error))
+
+    def test_timeout(self):
+        self.closing('slow', wait_for='never')
+        @self.Injector.factory('slow_service')
+        @jeni.annotate('slow', 'db')
+        def slow_service(slow, db):
+            "unused"
+        injector = self.Injector()
+        injector.get('slow_service')
+        injector.get('db')
+        with self.assertRaises(jeni.CloseError) as raises:
+            injector.close(parallel=True, timeout=0.05)
+        [(finalizer, error)] = raises.exception.errors
+        self.assertIsInstance(error, jeni.FinalizerTimeoutError)
+        self.assertEqual(['db'], self.log)
+        self.events['never started'].set()
+
+    def test_sealed(self):
+        self.Injector.seal()
+        injector = self.Injector()
+        injector.get('app')
+        injector.get('cache')
+        self.events['cache started'].set()
+        self.assertEqual({}, injector.dependencies)
+        self.assertRaises(jeni.CloseError, injector.close, parallel=True)
+        self.assertLess(self.log.index('app'), self.log.index('db'))
+
+    def test_unbound_finalizer(self):
+        injector = self.Injector()
+        injector.get('db')
+        injector.finalizers.append(lambda: self.log.append('unbound'))
+        injector.close(parallel=True)
+        self.assertEqual(['unbound', 'db'], self.log)
+
+    def test_sequential(self):
+        injector = self.Injector()
+        injector.get('db')
+        injector.close()
+        self.assertEqual(['db'], self.log)
+
+
+class PooledGeneratorProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.started = started = []
+        self.closed = closed = []
+        self.busy = busy = threading.Semaphore(0)
+        self.release = release = threading.Event()
+
+        def connection():
+            conn = len(started)
+            started.append(conn)
+            try:
+                name = yield conn
+                while True:
+                    if name == 'block':
+                        busy.release()
+                        release.wait(5)
+                    elif name == 'stop':
+                        return
+                    elif name == 'error':
+                        raise ValueError(name)
+                    name = yield (conn, name)
+            finally:
+                closed.append(conn)
+        self.connection = connection
+
+    def test_get(self):
+        provider = jeni.PooledGeneratorProvider(self.connection, maxsize=2)
+        self.assertEqual(0, provider.get())
+        self.assertEqual((0, 'a'), provider.get('a'))
+        self.assertEqual((0, 'b'), provider.get('b'))
+        self.assertEqual([0], self.started)
+        provider.close()
+        self.assertEqual([0], self.closed)
+
+    def test_concurrent(self):
+        provider = jeni.PooledGeneratorProvider(self.connection, maxsize=2)
+        results = []
+        def target():
+            results.append(provider.get('block'))
+        threads = [threading.Thread(target=target) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        # Two generators handle names at once, the third caller waits.
+        self.busy.acquire()
+        self.busy.acquire()
+        self.assertEqual([0, 1], sorted(self.started))
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, len(results))
+        self.assertEqual(set([0, 1]), set(conn for conn, _ in results))
+        provider.close()
+        self.assertEqual([0, 1], sorted(self.closed))
+
+    def test_finished_generator(self):
+        provider = jeni.PooledGeneratorProvider(self.connection, maxsize=1)
+        self.assertRaises(RuntimeError, provider.get, 'stop')
+        self.assertRaises(ValueError, provider.get, 'error')
+        self.assertEqual((2, 'a'), provider.get('a'))
+        self.assertEqual([0, 1], self.closed)
+
+    def test_start_error(self):
+        def fail_second():
+            if self.started:
+                raise IOError('second')
+            self.started.append(0)
+            name = yield
+            while True:
+                name = yield name
+        provider = jeni.PooledGeneratorProvider(fail_second, maxsize=2)
+        generator = provider.checkout() # Only generator is now busy.
+        self.assertRaises(IOError, provider.get, 'a')
+        self.assertEqual(0, provider.starting)
+        provider.checkin(generator)
+        self.assertEqual('a', provider.get('a'))
+        self.assertRaises(ValueError, jeni.PooledGeneratorProvider,
+                          fail_second, maxsize=0)
+
+    def test_register(self):
+        class Injector(jeni.Injector):
+            pass
+        Injector.provider('conn', self.connection, pool=2)
+        with Injector() as injector:
+            self.assertEqual(0, injector.get('conn'))
+            self.assertEqual((0, 'x'), injector.get('conn:x'))
+        self.assertEqual([0], self.closed)
+
+    def test_concurrent_injector(self):
+        class Injector(jeni.Injector):
+            pass
+        Injector.provider('conn', self.connection, pool=2)
+        injector = Injector()
+        injector.get('conn')
+        results, errors = [], []
+        def target():
+            try:
+                results.append(injector.get('conn:block'))
+            except Exception as error:
+                errors.append(error)
+                self.busy.release()
+        threads = [threading.Thread(target=target) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.busy.acquire()
+        self.busy.acquire()
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(set([0, 1]), set(conn for conn, _ in results))
+        self.assertEqual([], injector.instantiating)
+        injector.close()
+        self.assertEqual([0, 1], sorted(self.closed))
+
+    def test_concurrent_first_get(self):
+        def slow_connection():
+            time.sleep(0.01)
+            for value in self.connection():
+                yield value
+
+        class Injector(jeni.Injector):
+            pass
+        Injector.provider('conn', slow_connection, pool=2)
+        injector = Injector()
+        start = threading.Event()
+        results, errors = [], []
+        def target():
+            start.wait()
+            try:
+                results.append(injector.get('conn:x'))
+            except Exception as error:
+                errors.append(error)
+        threads = [threading.Thread(target=target) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(8, len(results))
+        self.assertTrue(len(self.started) <= 2)
+        self.assertEqual(1, len(injector.finalizers))
+        injector.close()
+        self.assertEqual(sorted(self.started), sorted(self.closed))
+
+
+class PooledProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            pass
+
+        @Injector.provider('db')
+        class DatabaseProvider(jeni.PooledProvider):
+            maxsize = 2
+            checkout_timeout = 0.05
+
+            def create(self):
+                return sqlite3.connect(':memory:', check_same_thread=False)
+
+            def check(self, connection):
+                return connection.execute('select 1').fetchone() == (1,)
+
+        @jeni.annotate('db')
+        def query(db):
+            return db.execute('select 42').fetchone()[0]
+
+        self.Injector = Injector
+        self.Provider = DatabaseProvider
+        self.query = query
+
+    def tearDown(self):
+        self.Provider.close_pool()
+
+    def test_reuse(self):
+        with self.Injector() as injector:
+            self.assertEqual(42, injector.apply(self.query))
+            connection = injector.get('db')
+        with self.Injector() as injector:
+            self.assertIs(connection, injector.get('db'))
+        stats = self.Provider.pool().stats
+        self.assertEqual(1, stats['created'])
+        self.assertEqual(2, stats['checkouts'])
+
+    def test_concurrent_and_timeout(self):
+        one, two, three = [self.Injector() for _ in range(3)]
+        self.assertIsNot(one.get('db'), two.get('db'))
+        self.assertRaises(jeni.PoolTimeoutError, three.get, 'db')
+        stats = self.Provider.pool().stats
+        self.assertEqual(1, stats['waits'])
+        self.assertEqual(1, stats['timeouts'])
+        one.close()
+        self.assertEqual(42, three.apply(self.query))
+        two.close()
+        three.close()
+
+    def test_wait(self):
+        self.Provider.checkout_timeout = 5
+        one, two, three = [self.Injector() for _ in range(3)]
+        one.get('db')
+        two.get('db')
+        timer = threading.Timer(0.05, one.close)
+        timer.start()
+        self.assertEqual(42, three.apply(self.query))
+        timer.join()
+        self.assertEqual(1, self.Provider.pool().stats['waits'])
+        two.close()
+        three.close()
+
+    def test_health_check(self):
+        with self.Injector() as injector:
+            connection = injector.get('db')
+        connection.close()
+        with self.Injector() as injector:
+            self.assertIsNot(connection, injector.get('db'))
+        stats = self.Provider.pool().stats
+        self.assertEqual(1, stats['unhealthy'])
+        self.assertEqual(1, stats['destroyed'])
+
+    def test_idle_timeout(self):
+        self.Provider.idle_timeout = 0
+        with self.Injector() as injector:
+            connection = injector.get('db')
+        with self.Injector() as injector:
+            self.assertIsNot(connection, injector.get('db'))
+        self.assertEqual(1, self.Provider.pool().stats['expired'])
+        self.assertRaises(sqlite3.ProgrammingError, connection.execute, '')
+
+    def test_discard(self):
+        injector = self.Injector()
+        provider_connection = injector.get('db')
+        injector.instances['db'].close(discard=True)
+        self.assertEqual(0, self.Provider.pool().size)
+        injector.close()
+        self.assertRaises(
+            sqlite3.ProgrammingError, provider_connection.execute, '')
+
+    def test_close_pool(self):
+        injector = self.Injector()
+        in_use = injector.get('db')
+        with self.Injector() as other:
+            idle = other.get('db')
+        pool = self.Provider.pool()
+        self.Provider.close_pool()
+        self.assertRaises(sqlite3.ProgrammingError, idle.execute, '')
+        injector.close() # Destroyed on release to the closed pool.
+        self.assertRaises(sqlite3.ProgrammingError, in_use.execute, '')
+        self.assertEqual(0, pool.size)
+        self.assertRaises(RuntimeError, pool.acquire, None)
+        self.assertIsNot(pool, self.Provider.pool())
+
+    def test_create_error(self):
+        class BrokenProvider(jeni.PooledProvider):
+            maxsize = 1
+        # create is abstract, as is Provider.get.
+        self.assertRaises(TypeError, BrokenProvider)
+        self.assertEqual(0, BrokenProvider.pool().size)
+
+
+def lazy_answer():
+    yield 42
+
+
+class LazyRegistrationTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            pass
+        self.Injector = Injector
+
+    def test_provider(self):
+        self.Injector.provider('hello', __name__ + ':HelloProvider')
+        registry = self.Injector.provider_registry
+        self.assertIsInstance(registry['hello'], jeni.LazyProvider)
+        injector = self.Injector()
+        self.assertEqual('Hello, world!', injector.get('hello'))
+        self.assertEqual('Hello, lazy!', injector.get('hello:lazy'))
+        self.assertIs(HelloProvider, registry['hello'])
+
+    def test_generator(self):
+        self.Injector.provider('answer', __name__ + ':lazy_answer')
+        self.assertEqual(42, self.Injector().get('answer'))
+
+    def test_factory(self):
+        self.Injector.factory('echo', __name__ + '.echo')
+        self.assertEqual('hi', self.Injector().get('echo:hi'))
+
+    def test_value(self):
+        sys.modules.pop('colorsys', None)
+        self.Injector.value('convert', 'colorsys:rgb_to_hsv', lazy=True)
+        self.Injector.value('path', 'colorsys:rgb_to_hsv')
+        self.assertNotIn('colorsys', sys.modules)
+        injector = self.Injector()
+        self.assertEqual('colorsys:rgb_to_hsv', injector.get('path'))
+        self.assertEqual((0, 0, 1), injector.get('convert')(1, 1, 1))
+        self.assertIn('colorsys', sys.modules)
+
+    def test_subclass_loads_once(self):
+        self.Injector.value('odict', 'collections:OrderedDict', lazy=True)
+        class SubInjector(self.Injector):
+            pass
+        self.assertIs(odict, SubInjector().get('odict'))
+        self.assertNotIsInstance(
+            self.Injector.provider_registry['odict'], jeni.LazyProvider)
+        self.assertNotIn(
+            'odict', vars(SubInjector).get('provider_registry', {}))
+
+    def test_import_error(self):
+        self.Injector.factory('missing', 'jeni:does_not_exist')
+        with self.assertRaises(AttributeError):
+            self.Injector().get('missing')
+        self.Injector.factory('missing', 'jeni_does_not_exist:fn')
+        with self.assertRaises(ImportError):
+            self.Injector().get('missing')
+
+    def test_seal(self):
+        self.Injector.factory('echo', __name__ + ':echo')
+        self.Injector.seal()
+        self.assertNotIsInstance(
+            self.Injector.provider_registry['echo'], jeni.LazyProvider)
+        self.assertEqual('hi', self.Injector().get('echo:hi'))
+
+    def test_import_string(self):
+        self.assertIs(Decimal, jeni.import_string('decimal:Decimal'))
+        self.assertIs(Decimal, jeni.import_string('decimal.Decimal'))
+        self.assertEqual(
+            odict.fromkeys,
+            jeni.import_string('collections:OrderedDict.fromkeys'))
+        with self.assertRaises(ValueError):
+            jeni.import_string('decimal')
+
+
+class SlotValuesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.values = jeni.SlotValues({'a': 0, 'b': 1})
+
+    def test_mapping(self):
+        values = self.values
+        values['a'] = 1
+        values['other'] = 2
+        self.assertEqual({'a': 1, 'other': 2}, dict(values))
+        self.assertEqual([1, jeni.MISSING], values.slots)
+        self.assertIn('a', values)
+        self.assertNotIn('b', values)
+        self.assertEqual(2, len(values))
+        self.assertRaises(KeyError, values.__getitem__, 'b')
+        self.assertRaises(KeyError, values.__delitem__, 'b')
+        del values['a']
+        self.assertEqual({'other': 2}, dict(values))
+
+    def test_clear(self):
+        self.values['b'] = None
+        self.values['other'] = None
+        self.values.clear()
+        self.assertEqual(0, len(self.values))
+        self.assertEqual([jeni.MISSING, jeni.MISSING], self.values.slots)
+
+
+class SlotInjectorTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(BasicInjector):
+            pass
+
+        @jeni.annotate('spam', 'eggs', hello='hello:slot')
+        def fn(spam, eggs, hello):
+            return spam + eggs, hello
+
+        self.Injector = Injector
+        self.fn = fn
+
+    def test_values(self):
+        self.Injector.seal(slots=True)
+        injector = self.Injector()
+        self.assertIsInstance(injector.values, jeni.SlotValues)
+        self.assertEqual({'injector': injector}, dict(injector.values))
+        self.assertEqual('eggs!', injector.get('eggs'))
+        self.assertEqual('eggs!', injector.values['eggs'])
+        self.assertIn('eggs', injector.instances)
+        self.assertEqual(0, self.Injector.slot_table['injector'])
+        injector.close()
+        self.assertEqual({}, dict(injector.values))
+
+    def test_apply(self):
+        self.Injector.seal(slots=True)
+        injector = self.Injector()
+        expected = ('spameggs!', 'Hello, slot!')
+        self.assertEqual(expected, injector.apply(self.fn))
+        self.assertEqual(expected, injector.apply(self.fn))
+        self.assertEqual(2, injector.stats['eggs'])
+        self.assertEqual(2, injector.stats['hello:slot'])
+        plan = self.Injector.apply_plan(self.fn)
+        slot_table = self.Injector.slot_table
+        self.assertEqual(
+            ((slot_table['spam'], 'spam'), (slot_table['eggs'], 'eggs')),
+            plan[0])
+        self.assertEqual((('hello', None, 'hello:slot'),), plan[1])
+
+    def test_apply_no_stats(self):
+        self.Injector.seal(stats=False, slots=True)
+        injector = self.Injector()
+        injector.apply(self.fn)
+        self.assertEqual(
+            ('spameggs!', 'Hello, slot!'), injector.apply(self.fn))
+        self.assertEqual({}, injector.stats)
+
+    def test_maybe(self):
+        @jeni.annotate('eggs', nothing=jeni.maybe('nothing'))
+        def fn(eggs, nothing=None):
+            return eggs, nothing
+        self.Injector.seal(slots=True)
+        self.assertIsNone(self.Injector.apply_plan(fn))
+        self.assertEqual(('eggs!', None), self.Injector().apply(fn))
+
+    def test_not_slotted(self):
+        self.assertIsNone(self.Injector.apply_plan(self.fn))
+        self.Injector.seal()
+        injector = self.Injector()
+        self.assertIsInstance(injector.values, dict)
+        expected = ('spameggs!', 'Hello, slot!')
+        self.assertEqual(expected, injector.apply(self.fn))
+        self.assertEqual(expected, injector.apply(self.fn))
+        self.assertEqual(2, injector.stats['eggs'])
+        plan = self.Injector.apply_plan(self.fn)
+        self.assertEqual((('spam', 'spam'), ('eggs', 'eggs')), plan[0])
+        self.assertEqual((('hello', None, 'hello:slot'),), plan[1])
+
+        class Subclass(self.Injector):
+            pass
+        self.assertIsNone(Subclass.apply_plan(self.fn))
+        self.assertEqual(expected, Subclass().apply(self.fn))
+
+    def test_closed(self):
+        self.Injector.seal(slots=True)
+        injector = self.Injector()
+        injector.apply(self.fn)
+        injector.close()
+        self.assertRaises(RuntimeError, injector.apply, self.fn)
+
+
+class StatsAggregatorTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(BasicInjector):
+            stats_aggregator = jeni.StatsAggregator()
+
+        @Injector.factory('unset')
+        def unset():
+            raise jeni.UnsetError()
+
+        self.Injector = Injector
+        self.aggregator = Injector.stats_aggregator
+
+    def run_request(self):
+        with self.Injector() as injector:
+            injector.get('hello')
+            injector.get('hello:thing')
+            injector.get('eggs')
+            injector.get_or('unset')
+            injector.get_or('nothing')
+
+    def test_flush_on_close(self):
+        self.run_request()
+        self.run_request()
+        snapshot = self.aggregator.snapshot()
+        self.assertEqual(2, snapshot['injectors'])
+        notes = snapshot['notes']
+        self.assertEqual({'gets': 4, 'instantiations': 2}, notes['hello'])
+        self.assertEqual({'gets': 2, 'instantiations': 2}, notes['eggs'])
+        self.assertEqual(
+            {'gets': 2, 'instantiations': 2, 'unset': 2}, notes['unset'])
+        self.assertEqual({'gets': 2, 'lookup_errors': 2}, notes['nothing'])
+
+    def test_no_flush_per_get(self):
+        injector = self.Injector()
+        injector.get('hello')
+        self.assertEqual({'injectors': 0, 'notes': {}},
+                         self.aggregator.snapshot())
+        self.assertEqual(1, injector.stats['hello'])
+        injector.close()
+        self.assertEqual(1, self.aggregator.snapshot()['injectors'])
+
+    def test_latency(self):
+        self.Injector.record_latency = True
+        self.run_request()
+        notes = self.aggregator.snapshot()['notes']
+        self.assertEqual(2, notes['hello']['provider_calls'])
+        self.assertGreaterEqual(notes['hello']['provider_seconds'], 0)
+        self.assertNotIn('provider_calls', notes['nothing'])
+
+    def test_prometheus(self):
+        self.run_request()
+        self.Injector.stats_aggregator.add({('say "hi"\n', 'gets'): 1})
+        text = self.aggregator.to_prometheus()
+        self.assertIn('# TYPE jeni_gets_total counter\n', text)
+        self.assertIn('jeni_gets_total{note="hello"} 2\n', text)
+        self.assertIn('jeni_unset_total{note="unset"} 1\n', text)
+        self.assertIn('jeni_gets_total{note="say \\"hi\\"\\n"} 1\n', text)
+        self.assertIn('jeni_injectors_total 2\n', text)
+        self.assertNotIn('provider_seconds', text)
+
+    def test_json(self):
+        import json
+        self.run_request()
+        snapshot = json.loads(self.aggregator.to_json())
+        self.assertEqual(self.aggregator.snapshot(), snapshot)
+        self.aggregator.reset()
+        self.assertEqual({'injectors': 0, 'notes': {}},
+                         self.aggregator.snapshot())
+
+    def test_no_stats(self):
+        self.Injector.seal(stats=False)
+        self.run_request()
+        notes = self.aggregator.snapshot()['notes']
+        self.assertEqual({'instantiations': 1}, notes['hello'])
+
+
+class TopCountsTestCase(unittest.TestCase):
+    def test_exact(self):
+        top = jeni.TopCounts(maxsize=4)
+        for key in 'aaabbc':
+            top.add(key)
+        self.assertEqual([('a', 3), ('b', 2), ('c', 1)], top.most_common())
+        self.assertEqual(0, top.get('d'))
+        self.assertEqual(0, top.error('a'))
+
+    def test_bounded(self):
+        top = jeni.TopCounts(maxsize=10)
+        for i in range(1000):
+            top.add('hot', 5)
+            top.add('warm')
+            top.add(i)
+            self.assertLessEqual(len(top), 10)
+        self.assertEqual(
+            ['hot', 'warm'], [key for key, _ in top.most_common(2)])
+        self.assertEqual(5000, top.get('hot'))
+        self.assertEqual(1000, top.get('warm'))
+        self.assertGreater(top.floor, 0)
+        self.assertLessEqual(top.error(999), top.floor)
+        self.assertLessEqual(top.get(999) - top.error(999), 1)
+
+    def test_maxsize(self):
+        self.assertRaises(ValueError, jeni.TopCounts, 1)
+
+
+class NoteStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(BasicInjector):
+            stats_maxnames = 8
+        self.injector = Injector()
+
+    def test_stats(self):
+        stats = self.injector.stats
+        self.assertIsInstance(stats, jeni.NoteStats)
+        self.assertEqual({}, stats)
+        self.injector.get('hello')
+        self.injector.get('hello:thing')
+        self.injector.get('hello:thing')
+        self.assertEqual({'hello': 1, 'hello:thing': 2}, stats)
+        self.assertEqual(0, stats['eggs'])
+        self.assertNotIn('eggs', stats)
+        self.assertEqual({'hello': 3}, stats.basenotes)
+        del stats['hello:thing']
+        self.assertEqual({'hello': 1}, stats.basenotes)
+        self.assertEqual({'hello': 1}, stats)
+
+    def test_add(self):
+        stats = jeni.NoteStats(maxnames=8)
+        stats.add('hello')
+        stats.add('hello', 2)
+        stats.add('hello:thing')
+        stats['hello:thing'] += 1
+        self.assertEqual({'hello': 3, 'hello:thing': 2}, stats)
+        self.assertEqual({'hello': 5}, stats.basenotes)
+
+    def test_bounded_names(self):
+        for i in range(100):
+            self.injector.get('echo:popular')
+            self.injector.get('echo:{}'.format(i))
+            self.injector.get('hello:{}'.format(i % 2))
+        stats = self.injector.stats
+        self.assertLessEqual(len(stats.names), 8)
+        self.assertEqual(200, stats.basenotes['echo'])
+        self.assertEqual(100, stats.basenotes['hello'])
+        self.assertEqual(
+            [('echo:popular', 100)], stats.most_common_names(1, 'echo'))
+        self.assertEqual(
+            ['hello:0', 'hello:1'],
+            sorted(note for note, _ in stats.most_common_names(2, 'hello')))
+
+    def test_bounded_tuple_names(self):
+        stats = jeni.NoteStats(maxnames=16)
+        for i in range(1000):
+            stats.add((7, i))
+        stats.add((7, None))
+        stats.add(jeni.maybe('echo:x'))
+        self.assertLessEqual(len(stats.names), 16)
+        self.assertEqual(
+            {(7, None): 1, jeni.maybe('echo:x'): 1}, stats.counts)
+        self.assertEqual(1000, stats.basenotes[7])
+        self.assertIn((7, 999), stats)
+
+    def test_flush(self):
+        aggregator = jeni.StatsAggregator()
+        for i in range(100):
+            self.injector.get('echo:{}'.format(i))
+        self.injector.flush_stats(aggregator)
+        self.assertEqual(
+            100, aggregator.snapshot()['notes']['echo']['gets'])
+
+
+class SamplerTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(BasicInjector):
+            sampler = jeni.Sampler(every=3)
+
+        @Injector.factory('spam_eggs')
+        @jeni.annotate('spam', 'eggs')
+        def spam_eggs(spam, eggs):
+            return spam + eggs
+
+        self.Injector = Injector
+        self.sampler = Injector.sampler
+
+    def test_one_in_n(self):
+        injector = self.Injector()
+        for _ in range(6):
+            injector.get('zero')
+        samples = self.sampler.drain()
+        # First get instantiates the provider, fourth reads value.
+        self.assertEqual(
+            [('zero', 'instantiate'), ('zero', 'provider_get'),
+             ('zero', 'get'), ('zero', 'get')],
+            [(sample.note, sample.phase) for sample in samples])
+        self.assertEqual([], self.sampler.drain())
+        for sample in samples:
+            self.assertGreaterEqual(sample.wall, 0)
+            self.assertGreaterEqual(sample.cpu, 0)
+
+    def test_dependencies(self):
+        self.assertEqual('spameggs!', self.Injector().get('spam_eggs'))
+        notes = set(sample.note for sample in self.sampler.drain())
+        self.assertEqual(set(['spam_eggs', 'spam', 'eggs']), notes)
+        self.assertFalse(self.sampler.active())
+
+    def test_apply(self):
+        @jeni.annotate('hello')
+        def fn(hello):
+            return hello
+        injector = self.Injector()
+        self.assertEqual('Hello, world!', injector.apply(fn))
+        samples = self.sampler.drain()
+        self.assertEqual((fn, 'apply'), samples[-1][:2])
+        self.assertIn(('hello', 'get'), [s[:2] for s in samples])
+
+    def test_apply_one_in_n(self):
+        self.Injector.sampler = sampler = jeni.Sampler(every=4)
+        @jeni.annotate('hello', 'eggs', 'spam_eggs')
+        def fn(hello, eggs, spam_eggs):
+            return hello
+        injector = self.Injector()
+        for _ in range(8):
+            injector.apply(fn)
+        # Gets of an apply which is not sampled are not counted.
+        phases = [sample.phase for sample in sampler.drain()]
+        self.assertEqual(2, phases.count('apply'))
+        # Three notes each, plus 'spam' & 'eggs' for 'spam_eggs' at first.
+        self.assertEqual(8, phases.count('get'))
+        self.assertEqual(1, sampler.skip(len, 'x'))
+        self.assertFalse(sampler.active())
+
+    def test_interval(self):
+        self.Injector.sampler = sampler = jeni.Sampler(interval=3600)
+        injector = self.Injector()
+        for _ in range(10):
+            injector.get('eggs')
+        self.assertEqual(
+            ['instantiate', 'provider_get', 'get'],
+            [sample.phase for sample in sampler.drain()])
+
+    def test_ring_buffer(self):
+        self.Injector.sampler = sampler = jeni.Sampler(every=1, size=4)
+        injector = self.Injector()
+        for i in range(10):
+            injector.get('echo:{}'.format(i))
+        samples = sampler.drain()
+        self.assertEqual(4, len(samples))
+        self.assertEqual('echo:9', samples[-1].note)
+
+    def test_error(self):
+        self.assertRaises(LookupError, self.Injector().get, 'nothing')
+        self.assertEqual(
+            [('nothing', 'get')],
+            [sample[:2] for sample in self.sampler.drain()])
+        self.assertFalse(self.sampler.active())
+
+
+class ProviderTimeoutTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(BasicInjector):
+            pass
+
+        self.release = release = threading.Event()
+
+        @Injector.provider('hangs_init', timeout=0.05)
+        class HangsInitProvider(jeni.Provider):
+            def __init__(self):
+                release.wait()
+
+            def get(self):
+                return 'late'
+
+        @Injector.factory('hangs_get', cache='transient', timeout=0.05)
+        def hangs_get():
+            release.wait()
+            return 'late'
+
+        @Injector.factory('uses_hangs_get')
+        @jeni.annotate('hangs_get')
+        def uses_hangs_get(hangs_get):
+            return hangs_get
+
+        self.Injector = Injector
+
+    def tearDown(self):
+        self.release.set()
+
+    def test_instantiate(self):
+        injector = self.Injector()
+        with self.assertRaises(jeni.ProviderTimeoutError) as raises:
+            injector.get('hangs_init')
+        self.assertEqual('hangs_init', raises.exception.note)
+        self.assertEqual(1, injector.metrics[('hangs_init', 'timeouts')])
+
+    def test_instantiate_late(self):
+        closed = threading.Event()
+
+        @self.Injector.provider('late', timeout=0.05)
+        class LateProvider(jeni.Provider):
+            def __init__(self):
+                self.release.wait()
+
+            def get(self):
+                return 'late'
+
+            def close(self):
+                closed.set()
+
+        LateProvider.release = self.release
+        injector = self.Injector()
+        self.assertRaises(jeni.ProviderTimeoutError, injector.get, 'late')
+        injector.close()
+        self.release.set()
+        # Created after its budget, the provider is closed, never kept.
+        self.assertTrue(closed.wait(5))
+        self.assertNotIn('late', injector.instances)
+        self.assertEqual([], injector.finalizers)
+
+    def test_dependencies(self):
+        threads = []
+        closed = threading.Event()
+        release = self.release
+
+        @self.Injector.provider('slow', timeout=0.05)
+        def slow():
+            threads.append(threading.current_thread())
+            release.wait()
+            yield 'slow'
+            closed.set()
+
+        @self.Injector.provider('outer', timeout=5)
+        class OuterProvider(jeni.Provider):
+            @jeni.annotate('slow')
+            def __init__(self, slow):
+                self.slow = slow
+
+            def get(self):
+                return self.slow
+
+        @self.Injector.factory('quick', timeout=5)
+        @jeni.annotate('hello')
+        def quick(hello):
+            return hello
+
+        @self.Injector.provider('unbounded')
+        def unbounded():
+            threads.append(threading.current_thread())
+            time.sleep(0.1)
+            yield 'unbounded'
+
+        @self.Injector.provider('bounded', timeout=0.05)
+        class BoundedProvider(jeni.Provider):
+            @jeni.annotate('unbounded')
+            def __init__(self, unbounded):
+                self.unbounded = unbounded
+
+            def get(self):
+                return self.unbounded
+
+        injector = self.Injector()
+        self.assertEqual('Hello, world!', injector.get('quick'))
+        # Dependencies resolve on this thread, outside of the budget.
+        self.assertEqual('unbounded', injector.get('bounded'))
+        self.assertEqual([threading.current_thread()], threads)
+        del threads[:]
+        with self.assertRaises(jeni.ProviderTimeoutError) as raises:
+            injector.get('outer')
+        self.assertEqual('slow', raises.exception.note)
+        self.assertEqual([], injector.instantiating)
+        injector.close()
+        self.release.set()
+        # Only the late provider of 'slow' was on the worker thread.
+        self.assertTrue(closed.wait(5))
+        threads[0].join(5)
+        self.assertNotIn('slow', injector.instances)
+        # Only finalizers of 'hello', 'quick', 'unbounded' and 'bounded'.
+        self.assertEqual(4, len(injector.finalizers))
+
+    def test_get(self):
+        injector = self.Injector()
+        self.assertRaises(jeni.ProviderTimeoutError, injector.get, 'hangs_get')
+        self.assertRaises(
+            jeni.ProviderTimeoutError, injector.get, 'uses_hangs_get')
+        self.assertEqual(2, injector.metrics[('hangs_get', 'timeouts')])
+        self.release.set()
+        self.assertEqual('late', injector.get('hangs_get'))
+
+    def test_maybe(self):
+        @jeni.annotate(
+            value=jeni.maybe('hangs_get'), other=jeni.maybe('uses_hangs_get'))
+        def fn(value='fallback', other='other fallback'):
+            return value, other
+        injector = self.Injector()
+        self.assertEqual(('fallback', 'other fallback'), injector.apply(fn))
+        self.assertEqual('default', injector.get_or('hangs_init', 'default'))
+
+    def test_within_budget(self):
+        self.Injector.factory('quick', lambda: 'quick', timeout=5)
+        injector = self.Injector()
+        self.assertEqual('quick', injector.get('quick'))
+        self.assertEqual({}, dict(injector.metrics))
+
+    def test_errors(self):
+        @self.Injector.factory('error', timeout=5)
+        def error():
+            raise ValueError('error')
+        self.assertRaises(ValueError, self.Injector().get, 'error')
+
+    def test_default_timeout(self):
+        class Injector(jeni.Injector):
+            provider_timeout = 0.05
+        release = self.release
+        @Injector.factory('hangs')
+        def hangs():
+            release.wait()
+        Injector.factory('patient', hangs, timeout=5)
+        self.assertEqual(0.05, Injector.lookup_timeout('hangs'))
+        self.assertEqual(5, Injector.lookup_timeout('patient'))
+        self.assertRaises(jeni.ProviderTimeoutError, Injector().get, 'hangs')
+        Injector.seal()
+        self.assertEqual(5, Injector.lookup_timeout('patient'))
+
+
+class Closeable(object):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClockProvider(jeni.RefreshingFactoryProvider):
+    now = 0
+    clock = staticmethod(lambda: FakeClockProvider.now)
+
+
+class RefreshingFactoryTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            refreshing_factory_provider = FakeClockProvider
+
+        FakeClockProvider.now = 0
+        self.calls = calls = []
+        self.release = release = threading.Event()
+        release.set()
+
+        @Injector.factory('config', ttl=10)
+        def config():
+            release.wait()
+            calls.append(len(calls))
+            return Closeable()
+
+        self.Injector = Injector
+
+    def provider(self, injector):
+        return injector.instances['config']
+
+    def test_fresh(self):
+        injector = self.Injector()
+        value = injector.get('config')
+        FakeClockProvider.now = 9
+        self.assertIs(value, injector.get('config'))
+        self.assertEqual([0], self.calls)
+        self.assertEqual('transient', self.Injector.lookup_cache('config'))
+
+    def test_stale_while_revalidate(self):
+        injector = self.Injector()
+        old = injector.get('config')
+        FakeClockProvider.now = 10
+        self.release.clear()
+        # Stale value is served while one refresh is in flight.
+        self.assertIs(old, injector.get('config'))
+        self.assertIs(old, injector.get('config'))
+        self.release.set()
+        self.provider(injector).wait()
+        self.assertEqual([0, 1], self.calls)
+        new = injector.get('config')
+        self.assertIsNot(old, new)
+        self.assertTrue(old.closed)
+        self.assertFalse(new.closed)
+        self.assertEqual(20, self.provider(injector).expires)
+
+    def test_refresh_error(self):
+        @self.Injector.factory('flaky', ttl=10)
+        def flaky():
+            if FakeClockProvider.now:
+                raise ValueError('down')
+            return 'ok'
+        injector = self.Injector()
+        self.assertEqual('ok', injector.get('flaky'))
+        FakeClockProvider.now = 10
+        self.assertEqual('ok', injector.get('flaky'))
+        provider = injector.instances['flaky']
+        provider.wait()
+        self.assertIsInstance(provider.refresh_error, ValueError)
+        self.assertEqual('ok', injector.get('flaky'))
+
+    def test_unset(self):
+        @self.Injector.factory('unset', ttl=10)
+        def unset():
+            self.release.wait()
+            if not FakeClockProvider.now:
+                raise jeni.UnsetError()
+            return 'set'
+        injector = self.Injector()
+        self.assertRaises(jeni.UnsetError, injector.get, 'unset')
+        FakeClockProvider.now = 10
+        self.release.clear()
+        self.assertRaises(jeni.UnsetError, injector.get, 'unset')
+        self.release.set()
+        injector.instances['unset'].wait()
+        self.assertEqual('set', injector.get('unset'))
+
+    def test_close_waits(self):
+        injector = self.Injector()
+        old = injector.get('config')
+        FakeClockProvider.now = 10
+        injector.get('config')
+        injector.close()
+        self.assertTrue(old.closed)
+
+    def test_cache_policy(self):
+        self.assertRaises(
+            ValueError, self.Injector.factory, 'x', lambda: 1,
+            cache='lru', ttl=1)
+
+
+class FakeClockBreaker(jeni.CircuitBreaker):
+    now = 0
+    clock = staticmethod(lambda: FakeClockBreaker.now)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            pass
+
+        FakeClockBreaker.now = 0
+        self.up = up = [True]
+        self.calls = calls = []
+        self.breaker = FakeClockBreaker(failures=2, cooldown=10)
+
+        @Injector.factory('rates', cache='transient', breaker=self.breaker)
+        def rates():
+            calls.append(None)
+            if not up[0]:
+                raise IOError('down')
+            return len(calls)
+
+        self.Injector = Injector
+
+    def test_open(self):
+        self.up[0] = False
+        for _ in range(2):
+            self.assertRaises(IOError, self.Injector().get, 'rates')
+        self.assertEqual('open', self.breaker.state)
+        injector = self.Injector()
+        with self.assertRaises(jeni.CircuitOpenError) as raises:
+            injector.get('rates')
+        self.assertEqual('rates', raises.exception.note)
+        self.assertEqual(2, len(self.calls))
+        self.assertEqual(1, injector.metrics[('rates', 'breaker_rejected')])
+        self.assertEqual(
+            {'state': 'open', 'failure_count': 2,
+             'failures': 2, 'opened': 1, 'rejected': 1},
+            self.breaker.snapshot())
+
+    def test_half_open(self):
+        self.up[0] = False
+        injector = self.Injector()
+        for _ in range(2):
+            self.assertRaises(IOError, injector.get, 'rates')
+        FakeClockBreaker.now = 10
+        # Probe fails, breaker opens again.
+        self.assertRaises(IOError, injector.get, 'rates')
+        self.assertEqual('open', self.breaker.state)
+        self.assertRaises(jeni.CircuitOpenError, injector.get, 'rates')
+        FakeClockBreaker.now = 20
+        self.up[0] = True
+        self.assertEqual(4, injector.get('rates'))
+        self.assertEqual('closed', self.breaker.state)
+        self.assertEqual(2, self.breaker.stats['probes'])
+
+    def test_single_probe(self):
+        release = threading.Event()
+        breaker = FakeClockBreaker(failures=1, cooldown=10)
+        results = []
+
+        @self.Injector.factory('slow', cache='transient', breaker=breaker)
+        def slow():
+            if not FakeClockBreaker.now:
+                raise IOError('down')
+            release.wait()
+            return 'ok'
+
+        self.assertRaises(IOError, self.Injector().get, 'slow')
+        FakeClockBreaker.now = 10
+        probe = threading.Thread(
+            target=lambda: results.append(self.Injector().get('slow')))
+        probe.start()
+        while not breaker.probing:
+            time.sleep(0.001)
+        self.assertRaises(jeni.CircuitOpenError, self.Injector().get, 'slow')
+        release.set()
+        probe.join()
+        self.assertEqual(['ok'], results)
+        self.assertEqual('closed', breaker.state)
+
+    def test_fallback(self):
+        self.breaker.fallback = True
+        injector = self.Injector()
+        self.assertEqual(1, injector.get('rates'))
+        self.up[0] = False
+        for _ in range(3):
+            self.assertEqual(1, injector.get('rates'))
+        self.assertEqual(3, len(self.calls))
+        self.assertEqual('open', self.breaker.state)
+        self.assertEqual(1, self.Injector().get('rates'))
+        self.assertEqual(4, self.breaker.stats['fallbacks'])
+        self.assertEqual(3, injector.metrics[('rates', 'breaker_fallbacks')])
+
+    def test_fallback_without_value(self):
+        self.breaker.fallback = True
+        self.up[0] = False
+        self.assertRaises(IOError, self.Injector().get, 'rates')
+
+    def test_unset(self):
+        breaker = jeni.CircuitBreaker(failures=1)
+
+        @self.Injector.factory('unset', breaker=breaker)
+        def unset():
+            raise jeni.UnsetError()
+
+        injector = self.Injector()
+        self.assertRaises(jeni.UnsetError, injector.get, 'unset')
+        self.assertEqual('closed', breaker.state)
+
+    def test_provider_class(self):
+        breaker = jeni.CircuitBreaker()
+        self.Injector.provider('hello', HelloProvider, breaker=breaker)
+        with self.Injector() as injector:
+            self.assertEqual('Hello, thing!', injector.get('hello:thing'))
+            self.assertIsInstance(
+                injector.instances['hello'].provider, HelloProvider)
+
+    def test_lazy(self):
+        breaker = jeni.CircuitBreaker()
+        self.Injector.factory('echo', __name__ + ':echo', breaker=breaker)
+        self.assertEqual('hi', self.Injector().get('echo:hi'))
+
+    def test_no_stats(self):
+        self.breaker.fallback = True
+        self.Injector.record_stats = False
+        injector = self.Injector()
+        injector.get('rates')
+        self.up[0] = False
+        for _ in range(3):
+            self.assertEqual(1, injector.get('rates'))
+        self.assertEqual('open', self.breaker.state)
+        self.assertEqual({}, dict(injector.metrics))
+
+    def test_timeout(self):
+        breaker = jeni.CircuitBreaker(failures=1)
+        threads = []
+        release = threading.Event()
+
+        @self.Injector.factory('dep')
+        def dep():
+            threads.append(threading.current_thread())
+            return 'dep'
+
+        @self.Injector.factory('slow', cache='transient', timeout=0.05,
+                               breaker=breaker)
+        @jeni.annotate('dep')
+        def slow(dep, name=None):
+            release.wait(5)
+            return dep
+
+        injector = self.Injector()
+        self.assertRaises(jeni.ProviderTimeoutError, injector.get, 'slow')
+        self.assertEqual([threading.current_thread()], threads)
+        self.assertEqual('open', breaker.state)
+        self.assertEqual(1, injector.metrics[('slow', 'timeouts')])
+        self.assertRaises(jeni.CircuitOpenError, injector.get, 'slow')
+        release.set()
+        breaker.clock = lambda: time.time() + 60
+        self.assertEqual('dep', injector.get('slow'))
+        self.assertEqual('closed', breaker.state)
+
+    def test_seal_unresolvable(self):
+        @self.Injector.factory('broken', breaker=jeni.CircuitBreaker())
+        @jeni.annotate('nothing')
+        def broken(nothing):
+            "unused"
+        self.assertRaises(LookupError, self.Injector.seal)
+
+    def test_seal_cycle(self):
+        @self.Injector.factory('x', breaker=jeni.CircuitBreaker())
+        @jeni.annotate('y')
+        def x(y):
+            "unused"
+
+        @self.Injector.factory('y', breaker=jeni.CircuitBreaker())
+        @jeni.annotate('x')
+        def y(x):
+            "unused"
+
+        self.assertRaises(jeni.DependencyCycleError, self.Injector.seal)
+
+
+class SingleflightTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            singleflight = True
+
+        self.release = release = threading.Event()
+        self.calls = calls = []
+
+        @Injector.factory('kv')
+        def kv(name=None):
+            if name is None:
+                return 'KV'
+            calls.append(name)
+            release.wait()
+            if name == 'error':
+                raise KeyError(name)
+            return name.upper()
+
+        self.Injector = Injector
+        self.injector = Injector()
+
+    def get_all(self, note, count=4):
+        results = []
+        def target():
+            try:
+                results.append(self.injector.get(note))
+            except KeyError as err:
+                results.append(err)
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        # Wait for one thread to call the provider, and the others to wait
+        # for its call.
+        key = (None, note)
+        while not self.release.is_set():
+            with jeni.flight_lock:
+                flight = (self.injector._flights or {}).get(key)
+                if flight is not None and flight.waiters == count - 1:
+                    break
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesce(self):
+        self.assertEqual(['KEY'] * 4, self.get_all('kv:key'))
+        self.assertEqual(['key'], self.calls)
+        self.assertEqual(3, self.injector.metrics[('kv', 'coalesced')])
+        # Later calls are not coalesced with finished calls.
+        self.assertEqual('KEY', self.injector.get('kv:key'))
+        self.assertEqual(['key', 'key'], self.calls)
+        self.assertEqual({}, self.injector._flights)
+
+    def test_sealed(self):
+        class Sealed(self.Injector):
+            pass
+        Sealed.seal()
+        self.injector = Sealed()
+        self.assertEqual(['KEY'] * 4, self.get_all('kv:key'))
+        self.assertEqual(['key'], self.calls)
+        self.assertEqual(3, self.injector.metrics[('kv', 'coalesced')])
+
+    def test_error(self):
+        results = self.get_all('kv:error')
+        self.assertEqual(['error'], self.calls)
+        self.assertEqual(4, len(results))
+        for result in results:
+            self.assertIsInstance(result, KeyError)
+
+    def test_disabled(self):
+        self.Injector.singleflight = False
+        self.release.set()
+        self.assertEqual(['KEY'] * 2, self.get_all('kv:key', count=2))
+        self.assertEqual(['key', 'key'], self.calls)
+
+
+class FakeRespHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                size = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(size + 2)[:-2])
+            self.wfile.write(self.server.reply(args))
+
+
+class FakeRespServer(socketserver.ThreadingTCPServer):
+    """In-process server speaking enough RESP for `jeni.KVProvider`."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ('127.0.0.1', 0), FakeRespHandler)
+        self.data = {}
+        self.commands = []
+        self.thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def reply(self, args):
+        self.commands.append(args)
+        command = args[0].upper()
+        if command == b'PING':
+            return b'+PONG\r\n'
+        if command == b'SET':
+            self.data[args[1]] = args[2]
+            return b'+OK\r\n'
+        if command == b'GET':
+            value = self.data.get(args[1])
+            if value is None:
+                return b'$-1\r\n'
+            return b'$' + str(len(value)).encode('ascii') + b'\r\n' + \
+                value + b'\r\n'
+        return b'-ERR unknown command\r\n'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class KVProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRespServer()
+        self.server.data.update({b'a': b'1', b'b': b'2', b'c': b'3'})
+
+        class Injector(jeni.Injector):
+            pass
+
+        @Injector.provider('kv')
+        class Store(jeni.KVProvider):
+            port = self.server.port
+            now = 0
+            clock = staticmethod(lambda: Store.now)
+
+        self.Injector = Injector
+        self.Store = Store
+
+    def tearDown(self):
+        self.Store.close_pool()
+        self.server.stop()
+
+    def gets(self):
+        return [args for args in self.server.commands if args[0] == b'GET']
+
+    def test_get(self):
+        with self.Injector() as injector:
+            self.assertEqual(b'1', injector.get('kv:a'))
+            self.assertEqual(b'1', injector.get('kv:a'))
+            self.assertRaises(jeni.UnsetError, injector.get, 'kv:missing')
+            self.assertEqual('OK', injector.get('kv').execute('SET', 'd', 4))
+        self.assertEqual(b'4', self.server.data[b'd'])
+        self.assertEqual(2, len(self.gets()))
+
+    def test_prepare_notes_pipelines(self):
+        @jeni.annotate('kv:a', 'kv:b', c='kv:c')
+        def fn(a, b, c):
+            return a + b + c
+
+        with self.Injector() as injector:
+            self.assertEqual(b'123', injector.apply(fn))
+            self.assertEqual(1, injector.get('kv').round_trips)
+        self.assertEqual(3, len(self.gets()))
+
+    def test_sealed_pipelines(self):
+        @jeni.annotate('kv:a', 'kv:b', 'kv:c')
+        def fn(a, b, c):
+            return a + b + c
+
+        for slots in (False, True):
+            class Injector(self.Injector):
+                pass
+            Injector.seal(slots=slots)
+
+            with Injector() as injector:
+                connection = injector.get('kv')
+                round_trips = connection.round_trips
+                self.assertEqual(b'123', injector.apply(fn))
+                self.assertEqual(b'123', injector.apply(fn))
+                self.assertEqual(1, connection.round_trips - round_trips)
+
+    def test_prefetch_notes(self):
+        self.assertEqual({'kv'}, self.Injector.prefetch_notes())
+        self.assertEqual(frozenset(), BasicInjector.prefetch_notes())
+
+        class Injector(self.Injector):
+            pass
+        self.assertEqual({'kv'}, Injector.prefetch_notes())
+        Injector.value('kv', 'not a provider')
+        self.assertEqual(frozenset(), Injector.prefetch_notes())
+        self.assertEqual({'kv'}, self.Injector.prefetch_notes())
+
+    def test_prefetch_in_provider(self):
+        @self.Injector.provider('app')
+        class AppProvider(jeni.Provider):
+            @jeni.annotate('kv:a', 'kv:b')
+            def __init__(self, a, b):
+                self.value = a + b
+
+            def get(self):
+                return self.value
+
+        with self.Injector() as injector:
+            self.assertEqual(b'12', injector.get('app'))
+            self.assertEqual({'app': {'kv'}}, injector.dependencies)
+            self.assertEqual(1, injector.get('kv').round_trips)
+
+    def test_maybe_not_prefetched(self):
+        @jeni.annotate('kv:a', 'kv:b', c=jeni.maybe('kv:missing'))
+        def fn(a, b, c=None):
+            return a, b, c
+
+        with self.Injector() as injector:
+            self.assertEqual((b'1', b'2', None), injector.apply(fn))
+
+    def test_error_reply(self):
+        with self.Injector() as injector:
+            connection = injector.get('kv')
+            self.assertRaises(jeni.RespError, connection.execute, 'NOPE')
+            self.assertEqual('PONG', connection.execute('PING'))
+
+    def test_pool(self):
+        with self.Injector() as injector:
+            connection = injector.get('kv')
+        with self.Injector() as injector:
+            self.assertIs(connection, injector.get('kv'))
+
+    def test_check_idle(self):
+        for _ in range(2):
+            with self.Injector() as injector:
+                injector.get('kv:a')
+        self.assertNotIn([b'PING'], self.server.commands)
+        self.Store.close_pool()
+        self.Store.check_idle = 0
+        for _ in range(2):
+            with self.Injector() as injector:
+                injector.get('kv:a')
+        self.assertEqual(1, self.server.commands.count([b'PING']))
+
+    def test_client_cache(self):
+        self.Store.cache_ttl = 10
+        with self.Injector() as injector:
+            injector.get('kv:a')
+        self.server.data[b'a'] = b'changed'
+        with self.Injector() as injector:
+            self.assertEqual(b'1', injector.get('kv:a'))
+        self.Store.now += 11
+        with self.Injector() as injector:
+            self.assertEqual(b'changed', injector.get('kv:a'))
+        self.server.data[b'a'] = b'again'
+        self.Store.forget('a')
+        with self.Injector() as injector:
+            self.assertEqual(b'again', injector.get('kv:a'))
+        self.assertEqual(3, len(self.gets()))
+
+
+class TableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'countries.table')
+        jeni.Table.build(self.path, {
+            u'FR': b'France', u'DE': b'Germany', u'\xc5land': b'Aland'})
+
+        class Injector(jeni.Injector):
+            pass
+
+        @Injector.provider('table')
+        class Countries(jeni.TableProvider):
+            path = self.path
+
+        @Injector.provider('upper')
+        class UpperCountries(Countries):
+            def decode(self, value):
+                return bytes(value).decode('utf-8').upper()
+
+        self.Injector = Injector
+        self.Provider = Countries
+        self.UpperProvider = UpperCountries
+
+    def tearDown(self):
+        self.Provider.close_table()
+        self.UpperProvider.close_table()
+        shutil.rmtree(self.directory)
+
+    def test_table(self):
+        table = jeni.Table(self.path)
+        self.assertEqual(3, len(table))
+        self.assertEqual([u'DE', u'FR', u'\xc5land'], list(table))
+        self.assertEqual(b'France', bytes(table['FR']))
+        self.assertEqual(b'Aland', bytes(table[u'\xc5land']))
+        self.assertIn('DE', table)
+        self.assertNotIn('ES', table)
+        self.assertNotIn('', table)
+        self.assertRaises(KeyError, lambda: table['ZZ'])
+        table.close()
+
+    def test_empty(self):
+        jeni.Table.build(self.path, [])
+        table = jeni.Table(self.path)
+        self.assertEqual(0, len(table))
+        self.assertNotIn('FR', table)
+        table.close()
+
+    def test_build_errors(self):
+        self.assertRaises(TypeError, jeni.Table.build, self.path, {'a': 3})
+        self.assertRaises(TypeError, jeni.Table.build, self.path, {'a': u'x'})
+        self.assertRaises(ValueError, jeni.Table.build, self.path,
+                          [(u'a', b'1'), (b'a', b'2')])
+        jeni.Table.build(self.path, {'a': bytearray(b'1')})
+        table = jeni.Table(self.path)
+        self.assertEqual(b'1', bytes(table['a']))
+        table.close()
+
+    def test_not_a_table(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        self.assertRaises(ValueError, jeni.Table, self.path)
+
+    def test_provider(self):
+        with self.Injector() as injector:
+            value = injector.get('table:FR')
+            # Zero-copy slices of the mapping, buffer objects on Python 2.
+            self.assertIsInstance(value, jeni.buffer_slice or memoryview)
+            self.assertEqual(b'France', bytes(value))
+            self.assertEqual(u'GERMANY', injector.get('upper:DE'))
+            self.assertRaises(jeni.UnsetError, injector.get, 'table:ES')
+            table = injector.get('table')
+        with self.Injector() as injector:
+            self.assertIs(table, injector.get('table'))
+        del value
+
+
 if __name__ == '__main__': unittest.main()
@@ -1,5 +1,19 @@
+import array
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
 import unittest
 
+try:
+    import asyncio
+    import tracemalloc
+except ImportError: # Python < 3.4
+    asyncio = tracemalloc = None
+
 import jeni
 
 from test_jeni import BasicInjector
@@ -46,4 +60,337 @@ class FunctionAnnotationTestCase(unittest.TestCase):
             self.injector.apply(annotated_function))
 
 
+@unittest.skipUnless(sys.version_info >= (3, 4), 'requires tracemalloc')
+class InjectorFootprintTestCase(unittest.TestCase):
+    def measure(self, factory, count=1000):
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            injectors = [factory() for _ in range(count)]
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(count, len(injectors))
+        return (after - before) / count
+
+    def test_footprint(self):
+        class EagerInjector(object):
+            """Layout of an injector with a __dict__ & eager containers."""
+            def __init__(self):
+                self.closed = False
+                self.instances = {}
+                self.values = {'injector': self}
+                self.stats = collections.defaultdict(int)
+                self.finalizers = []
+                self.instantiating = []
+        self.assertLess(
+            self.measure(jeni.Injector), self.measure(EagerInjector))
+
+    def test_footprint_after_get(self):
+        def factory():
+            injector = BasicInjector()
+            injector.get('zero')
+            return injector
+        def allocated_factory():
+            injector = factory()
+            injector.metrics, injector.cache_stats, injector.dependencies
+            return injector
+        # Unused containers (e.g. metrics) are still not allocated.
+        self.assertLess(
+            self.measure(factory), self.measure(allocated_factory))
+
+
+class WorkerInjector(jeni.Injector):
+    #: File to record closed worker injectors, by pid.
+    closed_log = None
+
+
+@WorkerInjector.provider('pid')
+def worker_pid():
+    yield os.getpid()
+    with open(WorkerInjector.closed_log, 'a') as fd:
+        fd.write('{}\n'.format(os.getpid()))
+
+
+@jeni.annotate('pid')
+def pid_times(pid, x):
+    return pid, x * 2
+
+
+@unittest.skipUnless(sys.version_info >= (3, 7), 'requires mp_context')
+class ProcessPoolMapTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, WorkerInjector.closed_log = tempfile.mkstemp()
+        os.close(fd)
+        self.context = multiprocessing.get_context('fork')
+
+    def tearDown(self):
+        os.remove(WorkerInjector.closed_log)
+
+    def closed_pids(self):
+        with open(WorkerInjector.closed_log) as fd:
+            return set(int(line) for line in fd)
+
+    def assert_map(self, executor):
+        with executor:
+            results = list(WorkerInjector().map(
+                pid_times, range(20), executor=executor, chunksize=3))
+        self.assertEqual(list(range(0, 40, 2)), [x for _, x in results])
+        pids = set(pid for pid, _ in results)
+        self.assertNotIn(os.getpid(), pids)
+        self.assertTrue(pids.issubset(self.closed_pids()))
+
+    def test_executor(self):
+        self.assert_map(concurrent.futures.ProcessPoolExecutor(
+            max_workers=2, mp_context=self.context))
+
+    def test_worker_pool(self):
+        self.assert_map(
+            WorkerInjector.worker_pool(max_workers=2, mp_context=self.context))
+        # Injectors are created on pool start, even if a worker was unused.
+        self.assertEqual(2, len(self.closed_pids()))
+
+
+def run_loop(main):
+    """Run awaitable of main(loop) on a new event loop, returning result."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main(loop))
+    finally:
+        loop.close()
+
+
+@unittest.skipUnless(sys.version_info >= (3, 4), 'requires asyncio')
+class CloseAsyncTestCase(unittest.TestCase):
+    def test_close_async(self):
+        from test_jeni import CloseTestInjector
+        injector = CloseTestInjector()
+        thing = injector.get('via_generator')
+        run_loop(lambda loop: injector.close_async(timeout=5, loop=loop))
+        self.assertTrue(injector.closed)
+        self.assertTrue(thing.closed)
+
+
+class MemoryInjector(jeni.Injector):
+    record_memory = True
+
+
+@MemoryInjector.provider('big_provider')
+class BigProvider(jeni.Provider):
+    def __init__(self):
+        self.buffer = bytearray(100000)
+
+    def get(self):
+        return len(self.buffer)
+
+
+@MemoryInjector.factory('big_value')
+def big_value():
+    return bytearray(200000)
+
+
+@MemoryInjector.factory('uses_big_value')
+@jeni.annotate('big_value')
+def uses_big_value(big_value):
+    return len(big_value)
+
+
+@unittest.skipUnless(sys.version_info >= (3, 4), 'requires tracemalloc')
+class MemoryReportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tracing = tracemalloc.is_tracing()
+
+    def tearDown(self):
+        if not self.tracing:
+            tracemalloc.stop()
+
+    def test_report(self):
+        injector = MemoryInjector()
+        injector.get('big_provider')
+        injector.get('uses_big_value')
+        report = dict((row['note'], row) for row in injector.memory_report())
+        self.assertEqual(
+            'big_value', injector.memory_report()[0]['note'])
+        self.assertGreaterEqual(
+            report['big_provider']['provider_bytes'], 100000)
+        self.assertLess(report['big_provider']['value_bytes'], 10000)
+        # Factories are called on instantiation, or on get if transient.
+        self.assertGreaterEqual(
+            report['big_value']['provider_bytes'], 200000)
+        self.assertEqual(1, report['big_value']['values'])
+        self.assertEqual('always', report['big_value']['cache'])
+        # Bytes of a dependency are attributed to the dependency only.
+        self.assertLess(report['uses_big_value']['provider_bytes'], 10000)
+        self.assertLess(report['uses_big_value']['value_bytes'], 10000)
+
+    def test_transient(self):
+        class Injector(MemoryInjector):
+            pass
+        Injector.factory('big_value', big_value, cache='transient')
+        injector = Injector()
+        values = [injector.get('big_value') for _ in range(3)]
+        row = injector.memory_report()[0]
+        self.assertEqual(('big_value', 'transient', 3),
+                         (row['note'], row['cache'], row['values']))
+        self.assertGreaterEqual(row['value_bytes'], 600000)
+        self.assertEqual(3, len(values))
+
+    def test_disabled(self):
+        injector = BasicInjector()
+        injector.get('hello')
+        self.assertEqual([], injector.memory_report())
+
+
+@unittest.skipUnless(sys.version_info >= (3, 4), 'requires asyncio')
+class GetAsyncTestCase(unittest.TestCase):
+    def setUp(self):
+        class Injector(jeni.Injector):
+            singleflight = True
+
+        self.calls = calls = []
+
+        @Injector.factory('kv')
+        def kv(name=None):
+            if name is None:
+                return 'KV'
+            calls.append(name)
+            return name.upper()
+
+        self.Injector = Injector
+        self.injector = Injector()
+
+    def test_coalesce(self):
+        def main(loop):
+            return asyncio.gather(
+                self.injector.get_async('kv:a', loop=loop),
+                self.injector.get_async('kv:a', loop=loop),
+                self.injector.get_async('kv:b', loop=loop))
+        self.assertEqual(['A', 'A', 'B'], run_loop(main))
+        self.assertEqual(['a', 'b'], sorted(self.calls))
+        self.assertEqual(1, self.injector.metrics[('kv', 'coalesced')])
+        self.assertEqual({}, self.injector._flights)
+
+    def test_sealed(self):
+        class Sealed(self.Injector):
+            pass
+        Sealed.seal()
+        self.injector = Sealed()
+        self.test_coalesce()
+
+    def test_base_note(self):
+        self.assertIs(self.injector, run_loop(
+            lambda loop: self.injector.get_async('injector', loop=loop)))
+
+
+class SharedInjector(jeni.Injector):
+    pass
+
+
+#: Pids of processes which called the provider of 'weights'.
+weight_calls = []
+
+
+@SharedInjector.factory('weights')
+def weights():
+    weight_calls.append(os.getpid())
+    return array.array('d', [0.5, 1.5, 2.5])
+
+
+@SharedInjector.factory('blob')
+def blob():
+    return b'frozen'
+
+
+@SharedInjector.factory('config')
+def shared_config():
+    return {'not': 'a buffer'}
+
+
+@jeni.annotate('weights')
+def weigh(weights, x):
+    return os.getpid(), list(weight_calls), weights.readonly, weights[x]
+
+
+@unittest.skipUnless(sys.version_info >= (3, 8), 'requires shared_memory')
+class ProcessScopeTestCase(unittest.TestCase):
+    def setUp(self):
+        del weight_calls[:]
+
+    def assert_unlinked(self, scope):
+        from multiprocessing import shared_memory
+        for name, _, _, _ in scope.segments.values():
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    def test_attach(self):
+        scope = jeni.ProcessScope(SharedInjector, shared=['weights', 'blob'])
+        injector = SharedInjector()
+        scope.attach(injector)
+        weights = injector.get('weights')
+        self.assertEqual('d', weights.format)
+        self.assertEqual([0.5, 1.5, 2.5], weights.tolist())
+        self.assertTrue(weights.readonly)
+        self.assertEqual(b'frozen', bytes(injector.get('blob')))
+        self.assertEqual([os.getpid()], weight_calls)
+        del weights
+        injector.close()
+        scope.close()
+        self.assertTrue(scope.parent.closed)
+        self.assert_unlinked(scope)
+        with self.assertRaises(RuntimeError):
+            scope.close()
+
+    def test_worker_pool(self):
+        context = multiprocessing.get_context('fork')
+        with jeni.ProcessScope(SharedInjector, shared=['weights']) as scope:
+            pool = SharedInjector.worker_pool(
+                max_workers=2, scope=scope, mp_context=context)
+            with pool:
+                results = list(SharedInjector().map(
+                    weigh, [0, 1, 2, 1], executor=pool))
+        self.assertEqual([0.5, 1.5, 2.5, 1.5], [r[3] for r in results])
+        for pid, calls, readonly, _ in results:
+            self.assertNotEqual(os.getpid(), pid)
+            self.assertEqual([os.getpid()], calls)
+            self.assertTrue(readonly)
+        self.assert_unlinked(scope)
+
+    def test_pickle(self):
+        with jeni.ProcessScope(SharedInjector, shared=['blob']) as scope:
+            copy = pickle.loads(pickle.dumps(scope))
+            self.assertEqual(scope.segments, copy.segments)
+            injector = SharedInjector()
+            copy.attach(injector)
+            self.assertEqual(b'frozen', bytes(injector.get('blob')))
+            injector.close()
+            handles = list(copy.handles)
+            copy.detach()
+            # Only the injected view held the segment, so it is unmapped.
+            self.assertEqual(
+                [None], [handle._mmap for handle in handles])
+            with self.assertRaises(RuntimeError):
+                copy.close()
+
+    def test_close_worker(self):
+        with jeni.ProcessScope(SharedInjector, shared=['weights']) as scope:
+            copy = pickle.loads(pickle.dumps(scope))
+            jeni.init_worker(SharedInjector, copy)
+            try:
+                self.assertEqual(
+                    2.5, jeni.apply_in_worker(SharedInjector, weigh, 2)[3])
+                handles = list(copy.handles)
+            finally:
+                jeni.close_worker(SharedInjector)
+            # Prepared arguments are dropped, so segments are unmapped.
+            self.assertEqual(
+                [None], [handle._mmap for handle in handles])
+
+    def test_not_a_buffer(self):
+        parent = SharedInjector()
+        with self.assertRaises(TypeError):
+            jeni.ProcessScope(
+                SharedInjector, shared=['blob', 'config'], parent=parent)
+        self.assertTrue(parent.closed)
+
+
 if __name__ == '__main__': unittest.main()